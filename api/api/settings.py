@@ -185,6 +185,109 @@ REST_FRAMEWORK = {
 }
 
 
+# Serve the async versions of the upload, analysis and signing actions
+# (photouploadapi.async_views). Only worth it under an ASGI server.
+ASYNC_VIEWS = os.environ.get('ASYNC_VIEWS', 'False').lower() in ('true', '1', 'yes')
+
+# Background photo analysis (see `manage.py run_analysis_worker`)
+ANALYSIS_WORKER_CONCURRENCY = int(os.environ.get('ANALYSIS_WORKER_CONCURRENCY', '16'))
+ANALYSIS_WORKER_POLL_SECONDS = float(os.environ.get('ANALYSIS_WORKER_POLL_SECONDS', '2'))
+ANALYSIS_JOB_MAX_ATTEMPTS = int(os.environ.get('ANALYSIS_JOB_MAX_ATTEMPTS', '3'))
+ANALYSIS_JOB_RETRY_BACKOFF_SECONDS = int(os.environ.get('ANALYSIS_JOB_RETRY_BACKOFF_SECONDS', '30'))
+ANALYSIS_JOB_LEASE_SECONDS = int(os.environ.get('ANALYSIS_JOB_LEASE_SECONDS', '300'))
+
+# GCS objects of deleted photos are removed in the background (see `manage.py run_purge_worker`)
+PURGE_WORKER_POLL_SECONDS = float(os.environ.get('PURGE_WORKER_POLL_SECONDS', '5'))
+PURGE_BATCH_SIZE = int(os.environ.get('PURGE_BATCH_SIZE', '500'))
+PURGE_LEASE_SECONDS = int(os.environ.get('PURGE_LEASE_SECONDS', '300'))
+PURGE_RETRY_BACKOFF_SECONDS = int(os.environ.get('PURGE_RETRY_BACKOFF_SECONDS', '30'))
+BULK_DELETE_MAX_PHOTOS = int(os.environ.get('BULK_DELETE_MAX_PHOTOS', '1000'))
+
+# Outbound calls to Vision and Geocoding: pooled, time-bounded, retried on 429/5xx
+# and short-circuited for OUTBOUND_BREAKER_RESET_SECONDS after repeated failures
+OUTBOUND_CONNECT_TIMEOUT_SECONDS = float(os.environ.get('OUTBOUND_CONNECT_TIMEOUT_SECONDS', '3.05'))
+OUTBOUND_READ_TIMEOUT_SECONDS = float(os.environ.get('OUTBOUND_READ_TIMEOUT_SECONDS', '30'))
+OUTBOUND_MAX_RETRIES = int(os.environ.get('OUTBOUND_MAX_RETRIES', '3'))
+OUTBOUND_RETRY_BACKOFF_SECONDS = float(os.environ.get('OUTBOUND_RETRY_BACKOFF_SECONDS', '0.5'))
+OUTBOUND_POOL_MAXSIZE = int(os.environ.get('OUTBOUND_POOL_MAXSIZE', '32'))
+OUTBOUND_BREAKER_FAILURE_THRESHOLD = int(os.environ.get('OUTBOUND_BREAKER_FAILURE_THRESHOLD', '5'))
+OUTBOUND_BREAKER_RESET_SECONDS = float(os.environ.get('OUTBOUND_BREAKER_RESET_SECONDS', '30'))
+
+# Quotas shared by every web and worker process (token buckets in the database).
+# Vision is charged per image. Calls that would wait longer than
+# RATE_LIMIT_MAX_WAIT_SECONDS are deferred to the job queue; 0 disables a limit
+VISION_RATE_LIMIT_PER_SECOND = float(os.environ.get('VISION_RATE_LIMIT_PER_SECOND', '30'))
+GEOCODING_RATE_LIMIT_PER_SECOND = float(os.environ.get('GEOCODING_RATE_LIMIT_PER_SECOND', '50'))
+RATE_LIMIT_BURST_SECONDS = float(os.environ.get('RATE_LIMIT_BURST_SECONDS', '1'))
+RATE_LIMIT_MAX_WAIT_SECONDS = float(os.environ.get('RATE_LIMIT_MAX_WAIT_SECONDS', '10'))
+
+# Concurrent analyses share images:annotate calls of up to VISION_BATCH_SIZE images
+VISION_BATCH_SIZE = int(os.environ.get('VISION_BATCH_SIZE', '16'))
+VISION_BATCH_WINDOW_MS = int(os.environ.get('VISION_BATCH_WINDOW_MS', '50'))
+VISION_BATCH_MAX_IN_FLIGHT = int(os.environ.get('VISION_BATCH_MAX_IN_FLIGHT', '4'))
+
+# How images are handed to Vision: 'content' (downscaled to VISION_CONTENT_MAX_EDGE
+# and sent inline), 'gcs_uri' (gs:// URI, needs bucket read access for the Vision
+# caller) or 'signed_url' (Vision fetches a signed HTTPS URL)
+VISION_INPUT_MODE = os.environ.get('VISION_INPUT_MODE', 'content')
+VISION_CONTENT_MAX_EDGE = int(os.environ.get('VISION_CONTENT_MAX_EDGE', '1024'))
+
+# Photos with EXIF GPS are geocoded from those coordinates. 'skip' also skips
+# Vision and names the photo from the geocoded place; 'always' still asks Vision
+# for the landmark name
+EXIF_GPS_VISION_POLICY = os.environ.get('EXIF_GPS_VISION_POLICY', 'skip')
+
+# Reverse-geocoding cache, keyed by coordinates rounded to GEOCODE_CACHE_PRECISION decimals
+GEOCODE_CACHE_PRECISION = int(os.environ.get('GEOCODE_CACHE_PRECISION', '3'))
+GEOCODE_CACHE_TTL_SECONDS = int(os.environ.get('GEOCODE_CACHE_TTL_SECONDS', str(30 * 24 * 3600)))
+GEOCODE_CACHE_MAX_ENTRIES = int(os.environ.get('GEOCODE_CACHE_MAX_ENTRIES', '100000'))
+GEOCODE_CACHE_MEMORY_ENTRIES = int(os.environ.get('GEOCODE_CACHE_MEMORY_ENTRIES', '1024'))
+# Expiry and the MAX_ENTRIES trim run once every GEOCODE_CACHE_EVICT_EVERY inserts per process
+GEOCODE_CACHE_EVICT_EVERY = int(os.environ.get('GEOCODE_CACHE_EVICT_EVERY', '100'))
+
+
+# Uploads are streamed to GCS in UPLOAD_STREAM_CHUNK_BYTES pieces (multiple of 256 KiB)
+UPLOAD_STREAM_CHUNK_BYTES = int(os.environ.get('UPLOAD_STREAM_CHUNK_BYTES', str(1024 * 1024)))
+UPLOAD_SNIFF_BYTES = int(os.environ.get('UPLOAD_SNIFF_BYTES', str(64 * 1024)))
+MAX_PHOTO_UPLOAD_BYTES = int(os.environ.get('MAX_PHOTO_UPLOAD_BYTES', str(50 * 1024 * 1024)))
+
+# Analyze new (buffered) uploads inside the upload request: Vision/Geocoding and
+# derivative rendering run on the in-memory bytes while the original goes to GCS
+UPLOAD_INLINE_ANALYSIS = os.environ.get('UPLOAD_INLINE_ANALYSIS', 'False').lower() in ('true', '1', 'yes')
+UPLOAD_INLINE_ANALYSIS_THREADS = int(os.environ.get('UPLOAD_INLINE_ANALYSIS_THREADS', '32'))
+
+# Batch uploads (upload_photos): files and total bytes per request, and parallel GCS writes per request
+BULK_UPLOAD_MAX_FILES = int(os.environ.get('BULK_UPLOAD_MAX_FILES', '500'))
+BULK_UPLOAD_MAX_BYTES = int(os.environ.get('BULK_UPLOAD_MAX_BYTES', str(512 * 1024 * 1024)))
+BULK_UPLOAD_CONCURRENCY = int(os.environ.get('BULK_UPLOAD_CONCURRENCY', '8'))
+DATA_UPLOAD_MAX_NUMBER_FILES = BULK_UPLOAD_MAX_FILES
+
+# Direct-to-bucket uploads (request_upload / finalize_upload)
+DIRECT_UPLOAD_URL_EXPIRY_SECONDS = int(os.environ.get('DIRECT_UPLOAD_URL_EXPIRY_SECONDS', '900'))
+ALLOWED_UPLOAD_CONTENT_TYPES = ['image/jpeg', 'image/png', 'image/webp']
+
+
+# Signed GET URLs are cached per blob; expiries are rounded up to SIGNED_URL_EXPIRY_BUCKET_SECONDS
+SIGNED_URL_TTL_SECONDS = int(os.environ.get('SIGNED_URL_TTL_SECONDS', '3600'))
+SIGNED_URL_EXPIRY_BUCKET_SECONDS = int(os.environ.get('SIGNED_URL_EXPIRY_BUCKET_SECONDS', '900'))
+SIGNED_URL_REFRESH_MARGIN_SECONDS = int(os.environ.get('SIGNED_URL_REFRESH_MARGIN_SECONDS', '300'))
+SIGNED_URL_CACHE_ALIAS = os.environ.get('SIGNED_URL_CACHE_ALIAS', 'default')
+
+
+# Map queries (photos/within, users/<id>/clusters): most photos or clusters returned
+# per request, and the on-screen width of a cluster cell
+SPATIAL_QUERY_MAX_RESULTS = int(os.environ.get('SPATIAL_QUERY_MAX_RESULTS', '2000'))
+MAP_CLUSTER_CELL_PIXELS = int(os.environ.get('MAP_CLUSTER_CELL_PIXELS', '64'))
+
+# Downscaled copies generated during analysis: size name -> longest edge in pixels
+PHOTO_DERIVATIVE_SIZES = {
+    'thumb': int(os.environ.get('PHOTO_THUMB_EDGE', '400')),
+    'medium': int(os.environ.get('PHOTO_MEDIUM_EDGE', '1280')),
+}
+PHOTO_DERIVATIVE_FORMAT = os.environ.get('PHOTO_DERIVATIVE_FORMAT', 'WEBP')  # WEBP or JPEG
+PHOTO_DERIVATIVE_QUALITY = int(os.environ.get('PHOTO_DERIVATIVE_QUALITY', '80'))
+
+
 ACCOUNT_EMAIL_VERIFICATION = 'optional'
 ACCOUNT_AUTHENTICATION_METHOD = 'username_email'
 ACCOUNT_EMAIL_REQUIRED = True
@@ -2,7 +2,9 @@ from django.contrib import admin
 
 # Register your models here.
 from django.contrib import admin
-from .models import Photo, Landmark
+from .models import Photo, Landmark, AnalysisJob, GeocodeCacheEntry, StoredBlob, BlobTombstone, UserPhotoStats, UserPlaceStats
+from .jobs import enqueue_reanalysis
+from .purge import delete_photos
 
 class LandmarkInline(admin.StackedInline):
     model = Landmark
@@ -28,25 +30,29 @@ class LandmarkInline(admin.StackedInline):
 class PhotoAdmin(admin.ModelAdmin):
     list_display = ('id', 'user', 'original_filename', 'upload_time', 'processing_status', 'gcs_blob_name')
     list_filter = ('processing_status', 'user', 'upload_time')
-    search_fields = ('original_filename', 'user__username', 'gcs_blob_name')
+    search_fields = ('original_filename', 'user__username', 'gcs_blob_name', 'content_sha256')
     inlines = [LandmarkInline]
     readonly_fields = ('upload_time',)
+    list_select_related = ('user',)
     actions = ['reprocess_photos']
 
     def reprocess_photos(self, request, queryset):
-        from .views import PhotoViewSet
-        analyzer = PhotoViewSet()
-        count = 0
-        for photo in queryset:
-            if photo.processing_status != 'processing':
-                try:
-                    analyzer._perform_photo_analysis(photo)
-                    count += 1
-                except Exception as e:
-                    self.message_user(request, f"Error reprocessing {photo.original_filename}: {e}", level='error')
-        self.message_user(request, f"Successfully started reprocessing for {count} photos.")
+        # Run by `manage.py run_analysis_worker`; large re-runs are better done with `manage.py reprocess_photos`
+        jobs = enqueue_reanalysis(queryset)
+        skipped = queryset.count() - len(jobs)
+        message = f"Queued {len(jobs)} photos for re-analysis."
+        if skipped:
+            message += f" {skipped} were already being analyzed or queued."
+        self.message_user(request, message)
     reprocess_photos.short_description = "Re-trigger landmark analysis for selected photos"
 
+    def delete_model(self, request, obj):
+        delete_photos(Photo.objects.filter(pk=obj.pk))
+
+    def delete_queryset(self, request, queryset):
+        # Leaves the GCS objects to the purge worker
+        delete_photos(queryset)
+
 
 @admin.register(Landmark)
 class LandmarkAdmin(admin.ModelAdmin):
@@ -55,6 +61,7 @@ class LandmarkAdmin(admin.ModelAdmin):
     search_fields = ('detected_landmark_name', 'photo__original_filename', 'photo__user__username', 'country', 'state', 'postal_code')
     raw_id_fields = ('photo',) 
     readonly_fields = ('analysis_timestamp',)
+    list_select_related = ('photo__user',)
     fieldsets = (
         (None, {
             'fields': ('photo', 'detected_landmark_name', 'latitude', 'longitude', 'formatted_address')
@@ -79,4 +86,58 @@ class LandmarkAdmin(admin.ModelAdmin):
     def get_photo_user(self, obj):
         return obj.photo.user.username
     get_photo_user.admin_order_field = 'photo__user'
-    get_photo_user.short_description = 'Uploaded by'
\ No newline at end of file
+    get_photo_user.short_description = 'Uploaded by'
+
+
+@admin.register(AnalysisJob)
+class AnalysisJobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'photo', 'kind', 'status', 'attempts', 'run_after', 'locked_by', 'updated_at')
+    list_select_related = ('photo__user',)
+    list_filter = ('status', 'kind')
+    search_fields = ('photo__original_filename', 'photo__user__username', 'locked_by')
+    raw_id_fields = ('photo',)
+    readonly_fields = ('created_at', 'updated_at')
+
+
+
+@admin.register(GeocodeCacheEntry)
+class GeocodeCacheEntryAdmin(admin.ModelAdmin):
+    list_display = ('key', 'hit_count', 'created_at', 'last_used_at')
+    search_fields = ('key',)
+    readonly_fields = ('created_at',)
+
+
+
+@admin.register(StoredBlob)
+class StoredBlobAdmin(admin.ModelAdmin):
+    list_display = ('gcs_blob_name', 'sha256', 'ref_count', 'created_at')
+    search_fields = ('gcs_blob_name', 'sha256')
+    readonly_fields = ('created_at',)
+
+
+
+@admin.register(BlobTombstone)
+class BlobTombstoneAdmin(admin.ModelAdmin):
+    list_display = ('gcs_blob_name', 'attempts', 'run_after', 'created_at')
+    search_fields = ('gcs_blob_name',)
+    readonly_fields = ('created_at',)
+
+
+
+@admin.register(UserPhotoStats)
+class UserPhotoStatsAdmin(admin.ModelAdmin):
+    # Maintained by stats.py; fix drift with `manage.py rebuild_stats`
+    list_display = ('user', 'total', 'pending', 'processing', 'completed', 'failed', 'updated_at')
+    list_select_related = ('user',)
+    search_fields = ('user__username',)
+    readonly_fields = ('user', 'pending', 'processing', 'completed', 'failed', 'updated_at')
+
+
+
+@admin.register(UserPlaceStats)
+class UserPlaceStatsAdmin(admin.ModelAdmin):
+    list_display = ('user', 'kind', 'name', 'photo_count')
+    list_select_related = ('user',)
+    list_filter = ('kind',)
+    search_fields = ('user__username', 'name')
+    readonly_fields = ('user', 'kind', 'name', 'photo_count')
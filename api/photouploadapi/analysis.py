@@ -0,0 +1,184 @@
+import asyncio
+import base64
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from .derivatives import render_derivatives
+from .outbound import http_client
+from .ratelimit import vision_rate_limit
+
+
+logger = logging.getLogger(__name__)
+
+VISION_API_KEY = os.environ.get("VISION_API_KEY")
+VISION_ANNOTATE_URL = "https://vision.googleapis.com/v1/images:annotate"
+# images:annotate rejects requests with more than 16 images.
+VISION_MAX_BATCH_SIZE = 16
+
+
+class VisionBatcher:
+    """
+    Coalesces concurrent landmark-detection requests into batched
+    images:annotate calls.
+
+    Callers block in `annotate` while a dispatcher thread collects requests
+    for up to `window_seconds` (or until `max_batch_size` are waiting), sends
+    them as one call and hands every caller its own entry of the response.
+    """
+
+    def __init__(self, max_batch_size=VISION_MAX_BATCH_SIZE, window_seconds=0.05, max_in_flight=4):
+        self.max_batch_size = max(1, min(max_batch_size, VISION_MAX_BATCH_SIZE))
+        self.window_seconds = window_seconds
+        self._queue = queue.Queue()
+        self._senders = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix='vision-batch')
+        self._lock = threading.Lock()
+        self._dispatcher = None
+        self._stats = {
+            'batches': 0,
+            'images': 0,
+            'failed_batches': 0,
+            'max_batch_size': 0,
+            'total_latency_ms': 0.0,
+            'max_latency_ms': 0.0,
+        }
+
+    def annotate(self, image, features):
+        """
+        Returns the images:annotate response entry for a single image.
+        Raises if the batch call or this image's entry failed.
+        """
+        return self.submit({"image": image, "features": features}).result()
+
+    def submit(self, request_entry) -> Future:
+        future = Future()
+        self._ensure_dispatcher()
+        self._queue.put((request_entry, future))
+        return future
+
+    def stats(self):
+        with self._lock:
+            snapshot = dict(self._stats)
+        batches = snapshot['batches']
+        snapshot['avg_batch_size'] = snapshot['images'] / batches if batches else 0.0
+        snapshot['avg_latency_ms'] = snapshot['total_latency_ms'] / batches if batches else 0.0
+        return snapshot
+
+    def _ensure_dispatcher(self):
+        with self._lock:
+            if self._dispatcher is None or not self._dispatcher.is_alive():
+                self._dispatcher = threading.Thread(target=self._dispatch_forever, name='vision-dispatcher', daemon=True)
+                self._dispatcher.start()
+
+    def _dispatch_forever(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.window_seconds
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._senders.submit(self._send, batch)
+
+    def _send(self, batch):
+        started = time.monotonic()
+        try:
+            # Vision quota is per image; sender threads never see a request end, so
+            # they drop stale connections to the bucket table themselves
+            close_old_connections()
+            vision_rate_limit.acquire(len(batch))
+            response = http_client.post(
+                f"{VISION_ANNOTATE_URL}?key={VISION_API_KEY}",
+                json={"requests": [entry for entry, _ in batch]},
+            )
+            result = response.json()
+            if response.status_code != 200:
+                raise Exception(f"Vision API error: {result.get('error', {}).get('message', response.status_code)}")
+            responses = result.get('responses', [])
+            if len(responses) != len(batch):
+                raise Exception(f"Vision API returned {len(responses)} responses for {len(batch)} images.")
+        except Exception as e:
+            self._record(len(batch), started, failed=True)
+            for _, future in batch:
+                future.set_exception(e)
+            return
+
+        self._record(len(batch), started)
+        for (_, future), entry in zip(batch, responses):
+            if 'error' in entry:
+                future.set_exception(Exception(f"Vision API error: {entry['error'].get('message')}"))
+            else:
+                future.set_result(entry)
+
+    def _record(self, size, started, failed=False):
+        latency_ms = (time.monotonic() - started) * 1000
+        with self._lock:
+            self._stats['batches'] += 1
+            self._stats['images'] += size
+            self._stats['failed_batches'] += int(failed)
+            self._stats['max_batch_size'] = max(self._stats['max_batch_size'], size)
+            self._stats['total_latency_ms'] += latency_ms
+            self._stats['max_latency_ms'] = max(self._stats['max_latency_ms'], latency_ms)
+        logger.info("Vision batch: size=%d latency_ms=%.1f failed=%s", size, latency_ms, failed)
+
+
+vision_batcher = VisionBatcher(
+    max_batch_size=settings.VISION_BATCH_SIZE,
+    window_seconds=settings.VISION_BATCH_WINDOW_MS / 1000,
+    max_in_flight=settings.VISION_BATCH_MAX_IN_FLIGHT,
+)
+
+
+VISION_INPUT_MODES = ('content', 'gcs_uri', 'signed_url')
+
+
+def gcs_image(bucket_name, blob_name):
+    return {"source": {"gcsImageUri": f"gs://{bucket_name}/{blob_name}"}}
+
+
+def uri_image(image_uri):
+    return {"source": {"imageUri": image_uri}}
+
+
+def content_image(image_bytes, max_edge):
+    """
+    Inline image: downscaled to `max_edge` and re-encoded as JPEG, so the
+    request carries tens of KB instead of the full-size original.
+    """
+    data = render_derivatives(image_bytes, {'vision': max_edge}, 'JPEG')['vision']
+    return {"content": base64.b64encode(data).decode('ascii')}
+
+
+def detect_landmarks(image, max_results=1):
+    """
+    Runs LANDMARK_DETECTION for one Vision image (see gcs_image, uri_image
+    and content_image) through the shared batcher and returns its
+    landmarkAnnotations (possibly empty).
+    """
+    entry = vision_batcher.annotate(
+        image=image,
+        features=[{"type": "LANDMARK_DETECTION", "maxResults": max_results}],
+    )
+    return entry.get('landmarkAnnotations', [])
+
+
+async def adetect_landmarks(image, max_results=1):
+    """
+    Async `detect_landmarks`: joins the same batches, but awaits the result
+    instead of blocking a thread on it.
+    """
+    entry = await asyncio.wrap_future(vision_batcher.submit({
+        "image": image,
+        "features": [{"type": "LANDMARK_DETECTION", "maxResults": max_results}],
+    }))
+    return entry.get('landmarkAnnotations', [])
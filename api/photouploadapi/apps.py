@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class PhotouploadapiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'photouploadapi'
+
+    def ready(self):
+        from . import signals  # noqa: F401
@@ -0,0 +1,112 @@
+import asyncio
+import threading
+from urllib.parse import quote
+
+import google.auth.transport.requests
+from google.oauth2 import service_account
+
+from .outbound import http_client
+
+
+GCS_API_URL = "https://storage.googleapis.com/storage/v1"
+GCS_UPLOAD_URL = "https://storage.googleapis.com/upload/storage/v1"
+GCS_SCOPES = ["https://www.googleapis.com/auth/devstorage.read_write"]
+
+
+class AsyncStorageClient:
+    """
+    The few GCS JSON API calls the async views need (upload, ranged download,
+    delete), made through the shared outbound client instead of the blocking
+    google-cloud-storage library.
+    """
+
+    def __init__(self, credentials):
+        self.credentials = credentials
+        self._refresh_lock = threading.Lock()
+
+    @classmethod
+    def from_service_account_json(cls, key_path):
+        return cls(service_account.Credentials.from_service_account_file(key_path, scopes=GCS_SCOPES))
+
+    async def upload(self, bucket_name, blob_name, data, content_type):
+        response = await http_client.apost(
+            f"{GCS_UPLOAD_URL}/b/{bucket_name}/o",
+            params={"uploadType": "media", "name": blob_name},
+            content=data,
+            headers={**await self._auth_headers(), "Content-Type": content_type},
+        )
+        self._raise_for_status(response, "upload", blob_name)
+
+    async def upload_file(self, bucket_name, blob_name, file, size, content_type, chunk_size):
+        """
+        Uploads an open file without holding it in memory: files of up to
+        `chunk_size` bytes go in one request, larger ones through a resumable
+        session one `chunk_size` piece (a multiple of 256 KiB) at a time.
+        """
+        if size <= chunk_size:
+            return await self.upload(bucket_name, blob_name, await asyncio.to_thread(file.read), content_type)
+
+        response = await http_client.apost(
+            f"{GCS_UPLOAD_URL}/b/{bucket_name}/o",
+            params={"uploadType": "resumable", "name": blob_name},
+            headers={**await self._auth_headers(), "X-Upload-Content-Type": content_type,
+                     "X-Upload-Content-Length": str(size)},
+        )
+        self._raise_for_status(response, "upload", blob_name)
+        session_url = response.headers["Location"]
+
+        offset = 0
+        while offset < size:
+            chunk = await asyncio.to_thread(file.read, chunk_size)
+            if not chunk:
+                raise Exception(f"GCS upload of {blob_name} failed: the file ended after {offset} of {size} bytes")
+            sent_end = offset + len(chunk)
+            response = await http_client.arequest(
+                'PUT', session_url, content=chunk,
+                headers={**await self._auth_headers(), "Content-Range": f"bytes {offset}-{sent_end - 1}/{size}"},
+            )
+            if response.status_code != 308:
+                self._raise_for_status(response, "upload", blob_name)
+                return
+            # 308: GCS reports how much it kept, which may be less than was sent
+            persisted = response.headers.get("Range")
+            offset = int(persisted.rsplit("-", 1)[1]) + 1 if persisted else 0
+            if offset != sent_end:
+                await asyncio.to_thread(file.seek, offset)
+        raise Exception(f"GCS upload of {blob_name} failed: the session was not finalized")
+
+    async def download(self, bucket_name, blob_name, start=None, end=None):
+        headers = await self._auth_headers()
+        if start is not None or end is not None:
+            headers["Range"] = f"bytes={start or 0}-{'' if end is None else end}"
+        response = await http_client.aget(
+            f"{GCS_API_URL}/b/{bucket_name}/o/{quote(blob_name, safe='')}",
+            params={"alt": "media"},
+            headers=headers,
+        )
+        self._raise_for_status(response, "download", blob_name)
+        return response.content
+
+    async def delete(self, bucket_name, blob_name):
+        response = await http_client.arequest(
+            'DELETE',
+            f"{GCS_API_URL}/b/{bucket_name}/o/{quote(blob_name, safe='')}",
+            headers=await self._auth_headers(),
+        )
+        if response.status_code != 404:
+            self._raise_for_status(response, "delete", blob_name)
+
+    async def _auth_headers(self):
+        if not self.credentials.valid:
+            # Token refresh is a blocking call to the OAuth endpoint
+            await asyncio.to_thread(self._refresh)
+        return {"Authorization": f"Bearer {self.credentials.token}"}
+
+    def _refresh(self):
+        with self._refresh_lock:
+            if not self.credentials.valid:
+                self.credentials.refresh(google.auth.transport.requests.Request())
+
+    def _raise_for_status(self, response, operation, blob_name):
+        if response.status_code >= 300:
+            raise Exception(f"GCS {operation} of {blob_name} failed: {response.status_code} {response.text}")
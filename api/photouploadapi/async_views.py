@@ -0,0 +1,207 @@
+import asyncio
+import uuid
+
+from adrf.shortcuts import aget_object_or_404
+from adrf.viewsets import GenericViewSet as AsyncGenericViewSet
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from rest_framework import status
+from rest_framework.decorators import action
+from rest_framework.response import Response
+
+from .analysis import adetect_landmarks, content_image
+from .async_storage import AsyncStorageClient
+from .blobs import sha256_of_upload
+from .derivatives import generate_derivatives, upload_derivatives
+from .exif import read_exif_fields
+from .geocache import geocode_cache
+from .models import Photo, StoredBlob
+from .outbound import http_client
+from .ratelimit import RateLimited, geocoding_rate_limit
+from .serializers import PhotoSerializer, PhotoUploadSerializer
+from .upload_handlers import UploadTooLarge
+from .views import (
+    GEOCODING_API_KEY, GEOCODING_URL, PHOTOS_BUCKET_NAME, PhotoViewSet, key_path, requested_size, storage_client,
+)
+
+
+async_storage = AsyncStorageClient.from_service_account_json(key_path)
+
+
+class AsyncPhotoViewSet(AsyncGenericViewSet, PhotoViewSet):
+    """
+    PhotoViewSet with native async versions of the network-bound actions
+    (upload, analysis, signing). Served instead of PhotoViewSet when
+    ASYNC_VIEWS is on, i.e. under uvicorn or gunicorn's UvicornWorker; the
+    remaining actions run in a thread as usual.
+    """
+
+    @action(detail=False, methods=['post'], serializer_class=PhotoUploadSerializer, url_path='upload_photo')
+    async def upload_photo(self, request):
+        """
+        POST /api/v1/photos/upload_photo/
+        Same contract as PhotoViewSet.upload_photo. The ASGI server has
+        already spooled the body, so the file is sent to GCS afterwards, in
+        UPLOAD_STREAM_CHUNK_BYTES pieces, instead of while it arrives.
+        """
+        serializer = PhotoUploadSerializer(data=await sync_to_async(lambda: request.data)())
+        if not await sync_to_async(serializer.is_valid)():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        image_file = serializer.validated_data['image']
+        if image_file.size > settings.MAX_PHOTO_UPLOAD_BYTES:
+            # Only checked once the ASGI server has spooled the whole body
+            raise UploadTooLarge(f"Photos are limited to {settings.MAX_PHOTO_UPLOAD_BYTES} bytes.")
+        original_filename = image_file.name
+        content_sha256, exif_fields = await asyncio.to_thread(self._read_upload, image_file)
+
+        # Identical bytes are stored once; only new content is uploaded
+        uploaded_blob_name = None
+        if not await StoredBlob.objects.filter(sha256=content_sha256).aexists():
+            if settings.UPLOAD_INLINE_ANALYSIS:
+                return await self._aupload_with_inline_analysis(request, image_file, content_sha256, exif_fields)
+            uploaded_blob_name = f"user_{request.user.id}/{uuid.uuid4()}_{original_filename}"
+            try:
+                await async_storage.upload_file(PHOTOS_BUCKET_NAME, uploaded_blob_name, image_file, image_file.size,
+                                                image_file.content_type, settings.UPLOAD_STREAM_CHUNK_BYTES)
+            except Exception as e:
+                return Response({"error": "Failed to upload image to GCS.", "details": str(e)},
+                                status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+        return await sync_to_async(self._save_uploaded_photo)(
+            request, storage_client.bucket(PHOTOS_BUCKET_NAME), image_file, content_sha256, uploaded_blob_name,
+            exif_fields,
+        )
+
+    @action(detail=True, methods=['post'], url_path='trigger_analysis')
+    async def trigger_analysis_for_photo(self, request, pk=None):
+        """
+        POST /api/v1/photos/{photo_id}/trigger_analysis/
+        Triggers (or re-triggers) the landmark detection and geocoding process.
+        """
+        photo = await aget_object_or_404(Photo, pk=pk, user=request.user)
+
+        if photo.processing_status == 'processing':
+            return Response({'message': 'Analysis is already in progress.'}, status=status.HTTP_409_CONFLICT)
+
+        try:
+            await self._aperform_photo_analysis(photo)
+        except RateLimited as e:
+            return await sync_to_async(self._deferred_analysis)(photo, e)
+
+        photo = await Photo.objects.with_details().aget(pk=photo.pk)
+        response_serializer = PhotoSerializer(photo)
+        return Response(response_serializer.data, status=status.HTTP_200_OK)
+
+    @action(detail=True, methods=['get'], url_path='signed_url')
+    async def generate_signed_url(self, request, pk=None):
+        """
+        GET /api/v1/photos/{photo_id}/signed_url/?size=thumb
+        Returns a temporary signed URL to access the photo (or one of its
+        downscaled derivatives).
+        """
+        size = requested_size(request)
+        photo = await aget_object_or_404(Photo, pk=pk, user=request.user)
+
+        # Signing is local CPU work plus a cache lookup
+        return await sync_to_async(self.sign_photo, thread_sensitive=False)(photo, size)
+
+    async def _aupload_with_inline_analysis(self, request, image_file, content_sha256, exif_fields):
+        """
+        Async `_upload_with_inline_analysis`: the GCS upload, the analysis and
+        derivative rendering run as concurrent tasks.
+        """
+        content = await asyncio.to_thread(image_file.read)
+        gcs_blob_name = f"user_{request.user.id}/{uuid.uuid4()}_{image_file.name}"
+        probe = Photo(user=request.user, gcs_blob_name=gcs_blob_name, **exif_fields)
+        upload_error, landmark_fields, derivatives = await asyncio.gather(
+            async_storage.upload(PHOTOS_BUCKET_NAME, gcs_blob_name, content, image_file.content_type),
+            self._aanalyze_image_bytes(probe, content),
+            sync_to_async(upload_derivatives, thread_sensitive=False)(
+                storage_client.bucket(PHOTOS_BUCKET_NAME), gcs_blob_name, content
+            ),
+            return_exceptions=True,
+        )
+        analysis_error = landmark_fields if isinstance(landmark_fields, Exception) else None
+        return await sync_to_async(self._finish_inline_upload)(
+            request, image_file, content_sha256, gcs_blob_name, exif_fields,
+            upload_error=upload_error,
+            landmark_fields=None if analysis_error else landmark_fields,
+            analysis_error=analysis_error,
+            derivatives=None if isinstance(derivatives, Exception) else derivatives,
+        )
+
+    async def _aanalyze_image_bytes(self, photo, image_bytes):
+        """
+        Async `_analyze_image_bytes`.
+        """
+        landmarks = None
+        if self._needs_vision(photo):
+            image = await asyncio.to_thread(content_image, image_bytes, settings.VISION_CONTENT_MAX_EDGE)
+            landmarks = await adetect_landmarks(image)
+
+        location = self._locate(photo, landmarks)
+        reverse_geocode_result = None
+        if location is not None:
+            _, latitude, longitude = location
+            reverse_geocode_result = await geocode_cache.aget_or_fetch(
+                latitude, longitude, lambda: self._afetch_reverse_geocode(latitude, longitude, GEOCODING_API_KEY)
+            )
+        return self._analysis_landmark_fields(location, reverse_geocode_result)
+
+    def _read_upload(self, image_file):
+        # Hashed chunk by chunk; only the EXIF header is held in memory
+        head = image_file.read(settings.UPLOAD_SNIFF_BYTES)
+        image_file.seek(0)
+        return sha256_of_upload(image_file), read_exif_fields(head)
+
+    async def _aperform_photo_analysis(self, photo: Photo):
+        """
+        Async `_perform_photo_analysis`: GCS, Vision and Geocoding are awaited
+        rather than waited on in a thread. Status changes, failures and the
+        landmark go through the same steps as the sync path.
+        """
+        await sync_to_async(self._begin_analysis)(photo)
+
+        image_bytes = None
+        try:
+            image_bytes = await async_storage.download(PHOTOS_BUCKET_NAME, photo.gcs_blob_name)
+            await sync_to_async(generate_derivatives)(photo, storage_client.bucket(PHOTOS_BUCKET_NAME), image_bytes)
+        except Exception as e:
+            # Galleries fall back to the original; landmark analysis can still succeed
+            print(f"Failed to generate derivatives for photo {photo.id}: {e}")
+        self._backfill_exif(photo, image_bytes)
+
+        try:
+            landmarks = None
+            if self._needs_vision(photo):
+                if image_bytes is None and settings.VISION_INPUT_MODE == 'content':
+                    image_bytes = await async_storage.download(PHOTOS_BUCKET_NAME, photo.gcs_blob_name)
+                image = await sync_to_async(self._vision_image, thread_sensitive=False)(
+                    photo, storage_client.bucket(PHOTOS_BUCKET_NAME), image_bytes
+                )
+                # Batched with other in-flight analyses into one images:annotate call
+                landmarks = await adetect_landmarks(image)
+
+            location = self._locate(photo, landmarks)
+            reverse_geocode_result = None
+            if location is not None:
+                _, latitude, longitude = location
+                with self._geocoding_errors():
+                    reverse_geocode_result = await geocode_cache.aget_or_fetch(
+                        latitude, longitude, lambda: self._afetch_reverse_geocode(latitude, longitude, GEOCODING_API_KEY)
+                    )
+            landmark_fields = self._analysis_landmark_fields(location, reverse_geocode_result)
+        except Exception as e:
+            await sync_to_async(self._fail_analysis)(photo, e)
+            raise
+        return await sync_to_async(self._complete_analysis)(photo, landmark_fields)
+
+    async def _afetch_reverse_geocode(self, lat, lng, api_key):
+        params = {
+            "latlng": f"{lat},{lng}",
+            "key": api_key
+        }
+        await geocoding_rate_limit.aacquire()
+        response = await http_client.aget(GEOCODING_URL, params=params)
+        return self._geocoding_results(response)
@@ -0,0 +1,156 @@
+import hashlib
+from collections import defaultdict
+
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+from .models import StoredBlob
+
+
+def sha256_of_upload(uploaded_file):
+    """
+    Hashes an UploadedFile chunk by chunk and rewinds it for the GCS upload.
+    """
+    digest = hashlib.sha256()
+    for chunk in uploaded_file.chunks():
+        digest.update(chunk)
+    uploaded_file.seek(0)
+    return digest.hexdigest()
+
+
+def acquire_existing_blob(sha256):
+    """
+    Takes a reference on the stored blob with this digest, if there is one,
+    and returns its object name. Returns None when the content is new.
+    """
+    if sha256 is None:
+        return None
+    with transaction.atomic():
+        updated = StoredBlob.objects.filter(sha256=sha256).update(ref_count=F('ref_count') + 1)
+        if not updated:
+            return None
+        return StoredBlob.objects.values_list('gcs_blob_name', flat=True).get(sha256=sha256)
+
+
+def register_blob(sha256, gcs_blob_name):
+    """
+    Records a freshly uploaded object under its digest. If a concurrent upload
+    of the same content registered first, a reference on that blob is taken
+    instead and its name is returned; the caller should then remove the
+    duplicate object it just wrote.
+    """
+    while True:
+        try:
+            with transaction.atomic():
+                StoredBlob.objects.create(sha256=sha256, gcs_blob_name=gcs_blob_name)
+            return gcs_blob_name
+        except IntegrityError:
+            existing = acquire_existing_blob(sha256)
+            if existing is not None:
+                return existing
+            # The other blob was released in the meantime; try registering ours again
+
+
+def register_direct_upload(gcs_blob_name):
+    """
+    Records an object the client uploaded straight to the bucket, with one
+    reference. Its bytes never pass through the server, so it has no digest
+    and is not shared. Raises IntegrityError if the name is registered
+    already, i.e. the upload was finalized before.
+    """
+    with transaction.atomic():
+        StoredBlob.objects.create(gcs_blob_name=gcs_blob_name, sha256=None)
+
+
+def acquire_existing_blobs(digest_counts):
+    """
+    Bulk `acquire_existing_blob`: takes `count` references on each stored
+    blob in {sha256: count}. Returns {sha256: gcs_blob_name} for the digests
+    that are already stored.
+    """
+    with transaction.atomic():
+        existing = dict(
+            StoredBlob.objects.select_for_update()
+            .filter(sha256__in=list(digest_counts))
+            .values_list('sha256', 'gcs_blob_name')
+        )
+        by_count = defaultdict(list)
+        for sha256 in existing:
+            by_count[digest_counts[sha256]].append(sha256)
+        for count, digests in by_count.items():
+            StoredBlob.objects.filter(sha256__in=digests).update(ref_count=F('ref_count') + count)
+    return existing
+
+
+def drop_references(digest_counts):
+    """
+    Undoes `acquire_existing_blobs` for references that never got a photo.
+    """
+    by_count = defaultdict(list)
+    for sha256, count in digest_counts.items():
+        by_count[count].append(sha256)
+    for count, digests in by_count.items():
+        StoredBlob.objects.filter(sha256__in=digests).update(ref_count=F('ref_count') - count)
+
+
+def register_blobs(uploads):
+    """
+    Bulk `register_blob` for {sha256: (gcs_blob_name, ref_count)}. Returns
+    {sha256: registered gcs_blob_name}; where that differs from the uploaded
+    name a concurrent upload won and the caller should remove its copy.
+    """
+    with transaction.atomic():
+        StoredBlob.objects.bulk_create(
+            [StoredBlob(sha256=sha256, gcs_blob_name=name, ref_count=count) for sha256, (name, count) in uploads.items()],
+            ignore_conflicts=True,
+        )
+    registered = dict(
+        StoredBlob.objects.filter(sha256__in=list(uploads)).values_list('sha256', 'gcs_blob_name')
+    )
+    for sha256, (gcs_blob_name, count) in uploads.items():
+        if registered.get(sha256) == gcs_blob_name:
+            continue
+        # Lost a race; rare enough to resolve one digest at a time
+        registered[sha256] = register_blob(sha256, gcs_blob_name)
+        if count > 1:
+            StoredBlob.objects.filter(sha256=sha256).update(ref_count=F('ref_count') + count - 1)
+    return registered
+
+
+def release_blob(gcs_blob_name):
+    """
+    Drops one reference on the blob. Returns True when the caller held the
+    last reference (or the blob predates reference counting) and the GCS
+    object should be deleted. Must be called inside a transaction.
+    """
+    stored = StoredBlob.objects.select_for_update().filter(gcs_blob_name=gcs_blob_name).first()
+    if stored is None:
+        return True
+    if stored.ref_count > 1:
+        StoredBlob.objects.filter(pk=stored.pk).update(ref_count=F('ref_count') - 1)
+        return False
+    stored.delete()
+    return True
+
+
+def release_blobs(name_counts):
+    """
+    Bulk `release_blob` for {gcs_blob_name: references to drop}. Returns the
+    names whose last reference was dropped (or that predate reference
+    counting). Must be called inside a transaction.
+    """
+    stored = dict(
+        StoredBlob.objects.select_for_update()
+        .filter(gcs_blob_name__in=list(name_counts))
+        .values_list('gcs_blob_name', 'ref_count')
+    )
+    released = [name for name, count in name_counts.items() if stored.get(name, 0) <= count]
+    StoredBlob.objects.filter(gcs_blob_name__in=released).delete()
+
+    by_count = defaultdict(list)
+    for name, count in name_counts.items():
+        if name in stored and stored[name] > count:
+            by_count[count].append(name)
+    for count, names in by_count.items():
+        StoredBlob.objects.filter(gcs_blob_name__in=names).update(ref_count=F('ref_count') - count)
+    return released
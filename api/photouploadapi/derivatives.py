@@ -0,0 +1,86 @@
+from io import BytesIO
+
+from django.conf import settings
+from google.api_core.exceptions import NotFound
+from PIL import Image, ImageOps
+
+
+DERIVED_PREFIX = "derived"
+FORMAT_EXTENSIONS = {'WEBP': 'webp', 'JPEG': 'jpg'}
+FORMAT_CONTENT_TYPES = {'WEBP': 'image/webp', 'JPEG': 'image/jpeg'}
+ORIGINAL_SIZE = 'original'
+
+
+def available_sizes():
+    return [ORIGINAL_SIZE] + list(settings.PHOTO_DERIVATIVE_SIZES)
+
+
+def derivative_blob_name(gcs_blob_name, size, image_format=None):
+    """
+    derived/{size}/{original blob name}.{ext}, so derivatives of a shared
+    (deduplicated) original are shared as well.
+    """
+    image_format = image_format or settings.PHOTO_DERIVATIVE_FORMAT
+    return f"{DERIVED_PREFIX}/{size}/{gcs_blob_name}.{FORMAT_EXTENSIONS[image_format]}"
+
+
+def render_derivatives(image_bytes, sizes=None, image_format=None):
+    """
+    Downscales an image to every configured long edge. Returns
+    {size: encoded bytes}. Images are never upscaled.
+    """
+    sizes = sizes or settings.PHOTO_DERIVATIVE_SIZES
+    image_format = image_format or settings.PHOTO_DERIVATIVE_FORMAT
+    largest_edge = max(sizes.values())
+
+    rendered = {}
+    with Image.open(BytesIO(image_bytes)) as image:
+        # Let the JPEG decoder skip detail we are about to throw away
+        image.draft('RGB', (largest_edge, largest_edge))
+        image = ImageOps.exif_transpose(image)
+        if image.mode not in ('RGB', 'RGBA') or image_format == 'JPEG':
+            image = image.convert('RGB')
+
+        for size, long_edge in sorted(sizes.items(), key=lambda item: -item[1]):
+            # Each size is derived from the previous (larger) one
+            image.thumbnail((long_edge, long_edge), Image.LANCZOS)
+            buffer = BytesIO()
+            image.save(buffer, format=image_format, quality=settings.PHOTO_DERIVATIVE_QUALITY)
+            rendered[size] = buffer.getvalue()
+    return rendered
+
+
+def upload_derivatives(bucket, gcs_blob_name, image_bytes):
+    """
+    Renders and uploads the configured derivatives of an image stored (or
+    about to be stored) at `gcs_blob_name`. Returns {size: blob name}.
+    """
+    image_format = settings.PHOTO_DERIVATIVE_FORMAT
+    derivatives = {}
+    for size, data in render_derivatives(image_bytes, image_format=image_format).items():
+        blob_name = derivative_blob_name(gcs_blob_name, size, image_format)
+        bucket.blob(blob_name).upload_from_string(data, content_type=FORMAT_CONTENT_TYPES[image_format])
+        derivatives[size] = blob_name
+    return derivatives
+
+
+def generate_derivatives(photo, bucket, image_bytes=None):
+    """
+    Renders and uploads the configured derivatives of a photo next to the
+    original and records them on `photo.derivatives` ({size: blob name}).
+    """
+    if image_bytes is None:
+        image_bytes = bucket.blob(photo.gcs_blob_name).download_as_bytes()
+
+    photo.derivatives = upload_derivatives(bucket, photo.gcs_blob_name, image_bytes)
+    photo.save(update_fields=['derivatives'])
+    return photo.derivatives
+
+
+def delete_derivatives(photo, bucket):
+    for blob_name in (photo.derivatives or {}).values():
+        try:
+            bucket.blob(blob_name).delete()
+        except NotFound:
+            # Never written, or already gone
+            pass
@@ -0,0 +1,64 @@
+from datetime import datetime
+from io import BytesIO
+
+from django.utils import timezone
+from PIL import ExifTags, Image
+
+
+def _degrees(dms, ref):
+    degrees, minutes, seconds = (float(value) for value in dms)
+    value = degrees + minutes / 60 + seconds / 3600
+    return -value if ref in ('S', 'W') else value
+
+
+def _gps(exif):
+    gps = exif.get_ifd(ExifTags.IFD.GPSInfo)
+    try:
+        latitude = _degrees(gps[ExifTags.GPS.GPSLatitude], gps.get(ExifTags.GPS.GPSLatitudeRef))
+        longitude = _degrees(gps[ExifTags.GPS.GPSLongitude], gps.get(ExifTags.GPS.GPSLongitudeRef))
+    except (KeyError, TypeError, ValueError, ZeroDivisionError):
+        return None, None
+    # 0,0 is what cameras without a fix tend to write
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180) or (latitude == 0 and longitude == 0):
+        return None, None
+    return latitude, longitude
+
+
+def _taken_at(exif):
+    exif_ifd = exif.get_ifd(ExifTags.IFD.Exif)
+    value = exif_ifd.get(ExifTags.Base.DateTimeOriginal) or exif.get(ExifTags.Base.DateTime)
+    if not isinstance(value, str):
+        return None
+    offset = exif_ifd.get(ExifTags.Base.OffsetTimeOriginal)
+    try:
+        if isinstance(offset, str) and offset.strip():
+            return datetime.strptime(f"{value.strip()}{offset.strip()}", "%Y:%m:%d %H:%M:%S%z")
+        # Without an offset the camera's local time is all we have; store it as TIME_ZONE
+        return timezone.make_aware(datetime.strptime(value.strip(), "%Y:%m:%d %H:%M:%S"))
+    except ValueError:
+        return None
+
+
+def read_exif_fields(head):
+    """
+    GPS position, capture time and orientation from the EXIF block of an
+    image, as Photo field values. `head` only needs to cover the file's
+    metadata segments (UPLOAD_SNIFF_BYTES); pixels are never decoded.
+    Returns an empty dict for images without (readable) EXIF.
+    """
+    try:
+        with Image.open(BytesIO(head)) as image:
+            exif = image.getexif()
+            if not exif:
+                return {}
+            latitude, longitude = _gps(exif)
+            orientation = exif.get(ExifTags.Base.Orientation)
+            return {
+                'gps_latitude': latitude,
+                'gps_longitude': longitude,
+                'taken_at': _taken_at(exif),
+                'exif_orientation': orientation if orientation in range(1, 9) else None,
+            }
+    except Exception:
+        # Truncated or malformed metadata is not a reason to reject the upload
+        return {}
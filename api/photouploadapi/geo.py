@@ -0,0 +1,181 @@
+import math
+
+from django.db.models import Avg, Count, F, FloatField, Max, Q, Value
+from django.db.models.functions import ASin, Cos, Floor, Least, Power, Radians, Sin, Sqrt
+
+
+GEOHASH_ALPHABET = '0123456789bcdefghjkmnpqrstuvwxyz'
+GEOHASH_PRECISION = 12
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+# Web map tiles: the whole world is TILE_PIXELS * 2 ** zoom pixels wide
+TILE_PIXELS = 256
+
+
+def geohash_encode(latitude, longitude, precision=GEOHASH_PRECISION):
+    """
+    Standard geohash of a point. Nearby points share long prefixes, and all
+    points of a cell sort together, so a cell is a range on an indexed column.
+    """
+    lat_range, lng_range = [-90.0, 90.0], [-180.0, 180.0]
+    chars, bits, bit_count, even = [], 0, 0, True
+    while len(chars) < precision:
+        value, bounds = (longitude, lng_range) if even else (latitude, lat_range)
+        middle = (bounds[0] + bounds[1]) / 2
+        bits <<= 1
+        if value >= middle:
+            bits |= 1
+            bounds[0] = middle
+        else:
+            bounds[1] = middle
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(GEOHASH_ALPHABET[bits])
+            bits, bit_count = 0, 0
+    return ''.join(chars)
+
+
+def cell_size(precision):
+    """
+    (height, width) in degrees of a geohash cell of `precision` characters.
+    """
+    lng_bits = (5 * precision + 1) // 2
+    lat_bits = 5 * precision // 2
+    return 180 / 2 ** lat_bits, 360 / 2 ** lng_bits
+
+
+def _next_prefix(prefix):
+    # The first geohash after every hash starting with `prefix`; None past 'zzz...'
+    while prefix:
+        position = GEOHASH_ALPHABET.index(prefix[-1])
+        if position + 1 < len(GEOHASH_ALPHABET):
+            return prefix[:-1] + GEOHASH_ALPHABET[position + 1]
+        prefix = prefix[:-1]
+    return None
+
+
+def _cells(south, west, north, east, precision):
+    height, width = cell_size(precision)
+    rows = range(math.floor((south + 90) / height), math.floor((min(north, 90 - 1e-9) + 90) / height) + 1)
+    cols = range(math.floor((west + 180) / width), math.floor((min(east, 180 - 1e-9) + 180) / width) + 1)
+    return rows, cols, height, width
+
+
+def geohash_ranges(south, west, north, east, max_cells=32):
+    """
+    Covers a bounding box (west <= east) with the finest geohash cells that
+    number at most `max_cells`, merged into sorted [start, stop) ranges. The
+    cover may include points outside the box; it never misses one inside.
+    """
+    precision = 1
+    while precision < GEOHASH_PRECISION:
+        rows, cols, _, _ = _cells(south, west, north, east, precision + 1)
+        if len(rows) * len(cols) > max_cells:
+            break
+        precision += 1
+
+    rows, cols, height, width = _cells(south, west, north, east, precision)
+    prefixes = sorted({
+        geohash_encode((row + 0.5) * height - 90, (col + 0.5) * width - 180, precision)
+        for row in rows for col in cols
+    })
+
+    ranges = []
+    for prefix in prefixes:
+        stop = _next_prefix(prefix)
+        if ranges and ranges[-1][1] == prefix:
+            ranges[-1][1] = stop
+        else:
+            ranges.append([prefix, stop])
+    return [tuple(bounds) for bounds in ranges]
+
+
+def bbox_parts(south, west, north, east):
+    """
+    A bounding box as (south, west, north, east) parts with west <= east;
+    boxes crossing the antimeridian (west > east) are split in two.
+    """
+    if west <= east:
+        return [(south, west, north, east)]
+    return [(south, west, north, 180.0), (south, -180.0, north, east)]
+
+
+def radius_bbox(latitude, longitude, radius_km):
+    """
+    Bounding box (south, west, north, east) of a circle, possibly crossing
+    the antimeridian. Circles reaching a pole span all longitudes.
+    """
+    lat_delta = radius_km / KM_PER_DEGREE
+    south, north = latitude - lat_delta, latitude + lat_delta
+    if south <= -90 or north >= 90:
+        return max(south, -90.0), -180.0, min(north, 90.0), 180.0
+
+    lng_delta = math.degrees(math.asin(min(1.0, math.sin(radius_km / EARTH_RADIUS_KM) / math.cos(math.radians(latitude)))))
+    west, east = longitude - lng_delta, longitude + lng_delta
+    if west < -180:
+        west += 360
+    if east > 180:
+        east -= 360
+    return south, west, north, east
+
+
+def bbox_filter(south, west, north, east, prefix='', max_cells=32):
+    """
+    Q for rows whose `latitude`/`longitude` lie in the box: geohash ranges
+    that an index can scan, plus the exact bounds.
+    """
+    condition = Q()
+    for part_south, part_west, part_north, part_east in bbox_parts(south, west, north, east):
+        cover = Q()
+        for start, stop in geohash_ranges(part_south, part_west, part_north, part_east, max_cells):
+            cell = Q(**{f'{prefix}geohash__gte': start})
+            if stop is not None:
+                cell &= Q(**{f'{prefix}geohash__lt': stop})
+            cover |= cell
+        condition |= cover & Q(**{
+            f'{prefix}latitude__range': (part_south, part_north),
+            f'{prefix}longitude__range': (part_west, part_east),
+        })
+    return condition
+
+
+def haversine_km(latitude, longitude, prefix=''):
+    """
+    Database expression for the great-circle distance in km between the
+    row's `latitude`/`longitude` and a point.
+    """
+    lat, lng = Radians(F(f'{prefix}latitude')), Radians(F(f'{prefix}longitude'))
+    origin_lat, origin_lng = math.radians(latitude), math.radians(longitude)
+    half_chord = (
+        Power(Sin((lat - Value(origin_lat)) / 2.0), 2)
+        + Value(math.cos(origin_lat)) * Cos(lat) * Power(Sin((lng - Value(origin_lng)) / 2.0), 2)
+    )
+    # Rounding can push the argument a hair above 1
+    return Value(2 * EARTH_RADIUS_KM) * ASin(Sqrt(Least(half_chord, Value(1.0))), output_field=FloatField())
+
+
+def cluster_cell_degrees(zoom, cell_pixels):
+    """
+    Width in degrees of a cluster cell that is `cell_pixels` wide on a web
+    map at `zoom`. The grid starts at (-90, -180), so a zoom level always
+    yields the same cells and clusters stay put while the map is panned.
+    """
+    return 360 / (TILE_PIXELS * 2 ** zoom) * cell_pixels
+
+
+def grid_clusters(landmarks, cell_degrees):
+    """
+    Groups located landmarks into a grid of `cell_degrees` squares in the
+    database: per cell, `row`, `col`, `count`, the centroid
+    (`center_latitude`, `center_longitude`) and the newest photo
+    (`newest_photo_id`), biggest clusters first.
+    """
+    return (
+        landmarks.filter(latitude__isnull=False, longitude__isnull=False)
+        .annotate(row=Floor((F('latitude') + 90.0) / cell_degrees), col=Floor((F('longitude') + 180.0) / cell_degrees))
+        .values('row', 'col')
+        .annotate(count=Count('id'), center_latitude=Avg('latitude'), center_longitude=Avg('longitude'),
+                  newest_photo_id=Max('photo_id'))
+        .order_by('-count', 'row', 'col')
+    )
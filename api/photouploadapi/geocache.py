@@ -0,0 +1,204 @@
+import asyncio
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import IntegrityError
+from django.db.models import F
+from django.utils import timezone
+
+from .models import GeocodeCacheEntry
+
+
+logger = logging.getLogger(__name__)
+
+
+class GeocodeCache:
+    """
+    Two-tier cache for reverse-geocoding results keyed by coordinates rounded
+    to `precision` decimal places (3 places is roughly 100 m).
+
+    Lookups go to an in-process LRU first, then to the GeocodeCacheEntry
+    table, and only then upstream. Concurrent misses for the same key in one
+    process share a single upstream call. Entries expire after `ttl_seconds`
+    and the table is trimmed to `max_entries` by least recent use, checked
+    every `evict_every` inserts of a process rather than on each one.
+    """
+
+    def __init__(self, precision=3, ttl_seconds=30 * 24 * 3600, max_entries=100000, memory_entries=1024,
+                 evict_every=100):
+        self.precision = precision
+        self.ttl = timedelta(seconds=ttl_seconds)
+        self.max_entries = max_entries
+        self.memory_entries = memory_entries
+        self.evict_every = max(1, evict_every)
+        self._puts_since_evict = 0
+        self._memory = OrderedDict()
+        self._in_flight = {}
+        self._lock = threading.Lock()
+        self._stats = {'memory_hits': 0, 'db_hits': 0, 'misses': 0, 'coalesced': 0, 'evictions': 0}
+
+    def key_for(self, lat, lng):
+        return f"{round(float(lat), self.precision):.{self.precision}f},{round(float(lng), self.precision):.{self.precision}f}"
+
+    def get_or_fetch(self, lat, lng, fetch):
+        """
+        Returns cached results for the location, calling `fetch()` (which
+        must return the Geocoding API 'results' list or raise) on a miss.
+        Failed fetches are not cached.
+        """
+        key = self.key_for(lat, lng)
+        results, waiter, leader = self._claim(key)
+        if results is not None:
+            return results
+        if not leader:
+            return waiter.result()
+
+        try:
+            results = self._db_get(key)
+            if results is None:
+                self._count('misses')
+                results = fetch()
+                self._db_put(key, results)
+            else:
+                self._count('db_hits')
+        except Exception as e:
+            waiter.set_exception(e)
+            raise
+        else:
+            waiter.set_result(results)
+            return results
+        finally:
+            self._release(key, waiter)
+
+    async def aget_or_fetch(self, lat, lng, fetch):
+        """
+        Async `get_or_fetch`: `fetch()` returns an awaitable, and waiting on
+        another caller's in-flight fetch does not hold a thread.
+        """
+        key = self.key_for(lat, lng)
+        results, waiter, leader = self._claim(key)
+        if results is not None:
+            return results
+        if not leader:
+            return await asyncio.wrap_future(waiter)
+
+        try:
+            results = await sync_to_async(self._db_get)(key)
+            if results is None:
+                self._count('misses')
+                results = await fetch()
+                await sync_to_async(self._db_put)(key, results)
+            else:
+                self._count('db_hits')
+        except Exception as e:
+            waiter.set_exception(e)
+            raise
+        else:
+            waiter.set_result(results)
+            return results
+        finally:
+            self._release(key, waiter)
+
+    def stats(self):
+        with self._lock:
+            snapshot = dict(self._stats)
+        lookups = snapshot['memory_hits'] + snapshot['db_hits'] + snapshot['misses']
+        snapshot['hit_rate'] = (snapshot['memory_hits'] + snapshot['db_hits']) / lookups if lookups else 0.0
+        return snapshot
+
+    def _claim(self, key):
+        """
+        Returns (results, None, False) on a memory hit, otherwise the future
+        for the key's in-flight fetch and whether the caller must perform it.
+        """
+        with self._lock:
+            results = self._memory_get(key)
+            if results is not None:
+                self._stats['memory_hits'] += 1
+                return results, None, False
+            waiter = self._in_flight.get(key)
+            if waiter is None:
+                waiter = self._in_flight[key] = Future()
+                return None, waiter, True
+            self._stats['coalesced'] += 1
+            return None, waiter, False
+
+    def _release(self, key, waiter):
+        with self._lock:
+            self._in_flight.pop(key, None)
+            if waiter.done() and waiter.exception() is None:
+                self._memory_put(key, waiter.result())
+
+    def _count(self, counter):
+        with self._lock:
+            self._stats[counter] += 1
+
+    def _memory_get(self, key):
+        entry = self._memory.get(key)
+        if entry is None:
+            return None
+        results, expires_at = entry
+        if expires_at < time.monotonic():
+            del self._memory[key]
+            return None
+        self._memory.move_to_end(key)
+        return results
+
+    def _memory_put(self, key, results):
+        self._memory[key] = (results, time.monotonic() + self.ttl.total_seconds())
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def _db_get(self, key):
+        now = timezone.now()
+        entry = GeocodeCacheEntry.objects.filter(key=key, created_at__gte=now - self.ttl).only('id', 'results').first()
+        if entry is None:
+            return None
+        GeocodeCacheEntry.objects.filter(pk=entry.pk).update(last_used_at=now, hit_count=F('hit_count') + 1)
+        return entry.results
+
+    def _db_put(self, key, results):
+        now = timezone.now()
+        try:
+            # An expired entry is refreshed in place
+            GeocodeCacheEntry.objects.update_or_create(
+                key=key, defaults={'results': results, 'created_at': now, 'last_used_at': now, 'hit_count': 0}
+            )
+        except IntegrityError:
+            # Another process cached the same location first
+            return
+        with self._lock:
+            self._puts_since_evict += 1
+            due = self._puts_since_evict >= self.evict_every
+            if due:
+                self._puts_since_evict = 0
+        if due:
+            self._evict()
+
+    def _evict(self):
+        now = timezone.now()
+        evicted, _ = GeocodeCacheEntry.objects.filter(created_at__lt=now - self.ttl).delete()
+        overflow = GeocodeCacheEntry.objects.count() - self.max_entries
+        if overflow > 0:
+            stale_ids = list(GeocodeCacheEntry.objects.order_by('last_used_at').values_list('id', flat=True)[:overflow])
+            evicted += GeocodeCacheEntry.objects.filter(id__in=stale_ids).delete()[0]
+        if evicted:
+            with self._lock:
+                self._stats['evictions'] += evicted
+            logger.info("Geocode cache evicted %d entries", evicted)
+
+
+geocode_cache = GeocodeCache(
+    precision=settings.GEOCODE_CACHE_PRECISION,
+    ttl_seconds=settings.GEOCODE_CACHE_TTL_SECONDS,
+    max_entries=settings.GEOCODE_CACHE_MAX_ENTRIES,
+    memory_entries=settings.GEOCODE_CACHE_MEMORY_ENTRIES,
+    evict_every=settings.GEOCODE_CACHE_EVICT_EVERY,
+)
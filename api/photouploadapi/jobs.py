@@ -0,0 +1,188 @@
+import os
+import socket
+import traceback
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import AnalysisJob, Photo
+from .ratelimit import RateLimited
+
+
+# A photo with a job in these states is analyzed (or about to be) by a worker
+LIVE_JOB_STATUSES = ['queued', 'running']
+
+
+def make_worker_id():
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+def enqueue_analysis(photo: Photo):
+    """
+    Queues landmark analysis for a photo. The photo is left in 'pending'
+    until a worker picks the job up.
+    """
+    return AnalysisJob.objects.create(photo=photo)
+
+
+def enqueue_derivatives(photo: Photo):
+    """
+    Queues rendering of a photo's derivatives alone, leaving its analysis
+    and status untouched.
+    """
+    return AnalysisJob.objects.create(photo=photo, kind='derivatives')
+
+
+def enqueue_analyses(photos, batch_size=500):
+    """
+    Bulk `enqueue_analysis`: one INSERT per `batch_size` photos.
+    """
+    return AnalysisJob.objects.bulk_create([AnalysisJob(photo=photo) for photo in photos], batch_size=batch_size)
+
+
+def without_live_jobs(photos):
+    """
+    Drops the photos with a queued or running analysis job from a queryset.
+    """
+    return photos.exclude(id__in=_live_analysis_jobs().values('photo_id'))
+
+
+def has_live_job(photo_id):
+    return _live_analysis_jobs().filter(photo_id=photo_id).exists()
+
+
+def _live_analysis_jobs():
+    # Derivative jobs never analyze, so they do not hold a photo
+    return AnalysisJob.objects.filter(kind='analysis', status__in=LIVE_JOB_STATUSES)
+
+
+def enqueue_reanalysis(photos):
+    """
+    Queues analysis for the photos in a queryset, skipping those that are
+    being analyzed or already have a live job. Returns the jobs created.
+    """
+    photos = without_live_jobs(photos.exclude(processing_status='processing')).only('id')
+    return enqueue_analyses(photos)
+
+
+def _claimable(now):
+    stale_before = now - timedelta(seconds=settings.ANALYSIS_JOB_LEASE_SECONDS)
+    # The redundant status__in lets the planner use the partial analysisjob_claim_idx
+    return Q(status__in=['queued', 'running']) & (
+        Q(status='queued', run_after__lte=now)
+        | Q(status='running', locked_at__lt=stale_before)
+    )
+
+
+def claim_jobs(worker_id, limit):
+    """
+    Atomically claims up to `limit` runnable jobs for `worker_id`.
+
+    On PostgreSQL the candidate rows are locked with
+    SELECT ... FOR UPDATE SKIP LOCKED, so concurrent workers never block on
+    or double-claim the same job. Backends without SKIP LOCKED (SQLite)
+    serialize writers anyway; there the UPDATE re-checks the claim
+    condition so a row taken by another worker in between is skipped.
+    Jobs whose lease expired (worker died mid-run) are claimed again.
+    """
+    if limit <= 0:
+        return []
+
+    now = timezone.now()
+    with transaction.atomic():
+        candidates = AnalysisJob.objects.filter(_claimable(now)).order_by('run_after', 'id')
+        if connection.features.has_select_for_update_skip_locked:
+            candidates = candidates.select_for_update(skip_locked=True)
+        job_ids = list(candidates.values_list('id', flat=True)[:limit])
+        if not job_ids:
+            return []
+
+        AnalysisJob.objects.filter(_claimable(now), id__in=job_ids).update(
+            status='running',
+            locked_by=worker_id,
+            locked_at=now,
+            attempts=F('attempts') + 1,
+            updated_at=now,
+        )
+
+    return list(
+        AnalysisJob.objects
+        .filter(id__in=job_ids, status='running', locked_by=worker_id, locked_at=now)
+        .select_related('photo')
+        .order_by('run_after', 'id')
+    )
+
+
+def complete_job(job: AnalysisJob):
+    job.status = 'done'
+    job.locked_by = None
+    job.locked_at = None
+    job.last_error = None
+    job.save(update_fields=['status', 'locked_by', 'locked_at', 'last_error', 'updated_at'])
+
+
+def fail_job(job: AnalysisJob, error):
+    """
+    Records a failed attempt. The job is retried with exponential backoff
+    until ANALYSIS_JOB_MAX_ATTEMPTS is reached, after which it (and its
+    photo, for analysis jobs) stay failed.
+    """
+    job.last_error = str(error)
+    job.locked_by = None
+    job.locked_at = None
+    if job.attempts < settings.ANALYSIS_JOB_MAX_ATTEMPTS:
+        job.status = 'queued'
+        job.run_after = timezone.now() + timedelta(seconds=settings.ANALYSIS_JOB_RETRY_BACKOFF_SECONDS * 2 ** (job.attempts - 1))
+        if job.kind == 'analysis':
+            photo = Photo.objects.get(pk=job.photo_id)
+            photo.processing_status = 'pending'
+            photo.save(update_fields=['processing_status'])
+    else:
+        job.status = 'failed'
+    job.save(update_fields=['status', 'run_after', 'locked_by', 'locked_at', 'last_error', 'updated_at'])
+
+
+def defer_job(job: AnalysisJob, retry_after):
+    """
+    Puts a job that hit a Vision/Geocoding rate limit back in the queue for
+    `retry_after` seconds. The attempt does not count towards
+    ANALYSIS_JOB_MAX_ATTEMPTS.
+    """
+    job.status = 'queued'
+    job.attempts = max(0, job.attempts - 1)
+    job.run_after = timezone.now() + timedelta(seconds=retry_after)
+    job.locked_by = None
+    job.locked_at = None
+    job.save(update_fields=['status', 'attempts', 'run_after', 'locked_by', 'locked_at', 'updated_at'])
+
+
+def run_job(job: AnalysisJob, analyzer=None):
+    """
+    Runs a claimed job in the calling thread. Each worker thread gets its own
+    database connection, so connections are recycled around every job.
+    """
+    from .views import PhotoViewSet
+    analyzer = analyzer or PhotoViewSet()
+
+    close_old_connections()
+    try:
+        if job.kind == 'derivatives':
+            analyzer._render_photo_derivatives(job.photo)
+        else:
+            analyzer._perform_photo_analysis(job.photo)
+    except RateLimited as e:
+        defer_job(job, e.retry_after)
+        return False
+    except Exception as e:
+        print(traceback.format_exc())
+        fail_job(job, e)
+        return False
+    else:
+        complete_job(job)
+        return True
+    finally:
+        close_old_connections()
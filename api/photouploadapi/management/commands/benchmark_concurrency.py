@@ -0,0 +1,83 @@
+import asyncio
+import os
+import statistics
+import time
+
+import httpx
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = (
+        "Fires concurrent upload_photo or signed_url requests at a running API "
+        "instance and reports throughput and latency per concurrency level. Run it "
+        "against the sync (gunicorn) and async (uvicorn) deployments to compare them."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://localhost:8080', help="Base URL of the API instance.")
+        parser.add_argument('--token', required=True, help="Auth token of the user making the requests.")
+        parser.add_argument('--endpoint', choices=['upload', 'signed_url'], default='upload')
+        parser.add_argument('--image', help="Image to upload (required for --endpoint upload).")
+        parser.add_argument('--photo-id', type=int, help="Photo to sign (required for --endpoint signed_url).")
+        parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8, 32, 64],
+                            help="Concurrency levels to measure.")
+        parser.add_argument('--requests', type=int, default=200, help="Requests per concurrency level.")
+        parser.add_argument('--timeout', type=float, default=120, help="Per-request timeout in seconds.")
+
+    def handle(self, *args, **options):
+        if options['endpoint'] == 'upload' and not options['image']:
+            raise CommandError("--image is required for the upload benchmark.")
+        if options['endpoint'] == 'signed_url' and not options['photo_id']:
+            raise CommandError("--photo-id is required for the signed_url benchmark.")
+
+        self.stdout.write(f"{'concurrency':>12}{'requests':>10}{'errors':>8}{'req/s':>10}"
+                          f"{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+        for concurrency in options['concurrency']:
+            latencies, errors, elapsed = asyncio.run(self._run_level(options, concurrency))
+            if not latencies:
+                raise CommandError(f"Every request failed at concurrency {concurrency}.")
+            percentiles = statistics.quantiles(latencies, n=100) if len(latencies) > 1 else latencies * 99
+            self.stdout.write(
+                f"{concurrency:>12}{len(latencies) + errors:>10}{errors:>8}{len(latencies) / elapsed:>10.1f}"
+                f"{statistics.median(latencies):>10.0f}{percentiles[94]:>10.0f}{percentiles[98]:>10.0f}"
+            )
+
+    async def _run_level(self, options, concurrency):
+        base_url = options['url'].rstrip('/')
+        headers = {"Authorization": f"Token {options['token']}"}
+        if options['endpoint'] == 'upload':
+            with open(options['image'], 'rb') as image:
+                image_bytes = image.read()
+            filename = os.path.basename(options['image'])
+
+        remaining = iter(range(options['requests']))
+        latencies, errors = [], 0
+
+        async def one(client, index):
+            if options['endpoint'] == 'upload':
+                # A distinct byte per request keeps content deduplication from short-circuiting the upload
+                files = {"image": (filename, image_bytes + index.to_bytes(4, 'big'), "image/jpeg")}
+                return await client.post(f"{base_url}/api/v1/photos/upload_photo/", files=files)
+            return await client.get(f"{base_url}/api/v1/photos/{options['photo_id']}/signed_url/")
+
+        async def worker(client):
+            nonlocal errors
+            for index in remaining:
+                started = time.monotonic()
+                try:
+                    response = await one(client, index)
+                    ok = response.status_code < 300
+                except httpx.HTTPError:
+                    ok = False
+                if ok:
+                    latencies.append((time.monotonic() - started) * 1000)
+                else:
+                    errors += 1
+
+        limits = httpx.Limits(max_connections=concurrency)
+        async with httpx.AsyncClient(headers=headers, limits=limits, timeout=options['timeout']) as client:
+            started = time.monotonic()
+            await asyncio.gather(*[worker(client) for _ in range(concurrency)])
+            elapsed = time.monotonic() - started
+        return latencies, errors, elapsed
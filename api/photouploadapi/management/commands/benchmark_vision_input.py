@@ -0,0 +1,69 @@
+import json
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from photouploadapi.analysis import VISION_ANNOTATE_URL, VISION_API_KEY, VISION_INPUT_MODES
+from photouploadapi.models import Photo
+from photouploadapi.outbound import http_client
+from photouploadapi.views import PHOTOS_BUCKET_NAME, PhotoViewSet, storage_client
+
+
+class Command(BaseCommand):
+    help = (
+        "Sends the most recent photos to Vision once per input mode and reports "
+        "preparation time, request size and Vision latency for each mode."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--photos', type=int, default=10, help="Number of recent photos to send.")
+        parser.add_argument(
+            '--modes', nargs='+', choices=VISION_INPUT_MODES, default=list(VISION_INPUT_MODES),
+            help="Input modes to compare.",
+        )
+
+    def handle(self, *args, **options):
+        photos = list(Photo.objects.order_by('-upload_time')[:options['photos']])
+        if not photos:
+            raise CommandError("No photos to benchmark.")
+
+        bucket = storage_client.bucket(PHOTOS_BUCKET_NAME)
+        viewset = PhotoViewSet()
+        features = [{"type": "LANDMARK_DETECTION", "maxResults": 1}]
+        top_landmarks = {}
+
+        self.stdout.write(f"{'mode':<12}{'photos':>8}{'prep ms':>10}{'request KB':>12}"
+                          f"{'vision p50':>12}{'vision p95':>12}{'total ms':>10}{'agree':>8}")
+        for mode in options['modes']:
+            prep_ms, request_kb, vision_ms, agree = [], [], [], 0
+            for photo in photos:
+                started = time.monotonic()
+                # 'content' includes the GCS download here; during analysis it is shared with derivatives
+                image = viewset._vision_image(photo, bucket, mode=mode)
+                body = json.dumps({"requests": [{"image": image, "features": features}]})
+                prepared = time.monotonic()
+                response = http_client.post(f"{VISION_ANNOTATE_URL}?key={VISION_API_KEY}", data=body,
+                                            headers={"Content-Type": "application/json"})
+                finished = time.monotonic()
+                if response.status_code != 200:
+                    raise CommandError(f"Vision API error for photo {photo.id} ({mode}): {response.text}")
+
+                entry = response.json()['responses'][0]
+                if 'error' in entry:
+                    raise CommandError(f"Vision API error for photo {photo.id} ({mode}): {entry['error'].get('message')}")
+                landmarks = entry.get('landmarkAnnotations', [])
+                landmark = landmarks[0]['description'] if landmarks else None
+                agree += int(top_landmarks.setdefault(photo.id, landmark) == landmark)
+
+                prep_ms.append((prepared - started) * 1000)
+                request_kb.append(len(body) / 1024)
+                vision_ms.append((finished - prepared) * 1000)
+
+            p95 = statistics.quantiles(vision_ms, n=20)[-1] if len(vision_ms) > 1 else vision_ms[0]
+            self.stdout.write(
+                f"{mode:<12}{len(photos):>8}{statistics.mean(prep_ms):>10.0f}{statistics.mean(request_kb):>12.1f}"
+                f"{statistics.median(vision_ms):>12.0f}{p95:>12.0f}"
+                f"{statistics.mean(prep_ms) + statistics.mean(vision_ms):>10.0f}{agree:>8}"
+            )
+        self.stdout.write("'agree' counts photos whose top landmark matches the first mode's.")
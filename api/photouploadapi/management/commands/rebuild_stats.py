@@ -0,0 +1,31 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from photouploadapi.stats import rebuild_user_stats
+
+
+class Command(BaseCommand):
+    help = (
+        "Recomputes the per-user photo statistics (status counts, countries, landmarks) from the photos, "
+        "a batch of users per transaction. Needed only after changes that bypass the app, such as manual SQL."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', nargs='+', help="Only these users (usernames or ids).")
+        parser.add_argument('--batch-size', type=int, default=500, help="Users rebuilt per transaction.")
+
+    def handle(self, *args, **options):
+        users = get_user_model().objects.order_by('id')
+        if options['user']:
+            ids = [user for user in options['user'] if user.isdigit()]
+            names = [user for user in options['user'] if not user.isdigit()]
+            users = users.filter(id__in=ids) | users.filter(username__in=names)
+
+        user_ids = list(users.values_list('id', flat=True))
+        if options['user'] and not user_ids:
+            raise CommandError("No such users.")
+        batch_size = max(1, options['batch_size'])
+        for start in range(0, len(user_ids), batch_size):
+            rebuild_user_stats(user_ids[start:start + batch_size])
+            self.stdout.write(f"{min(start + batch_size, len(user_ids))}/{len(user_ids)} users rebuilt.")
+        self.stdout.write(f"Rebuilt statistics of {len(user_ids)} users.")
@@ -0,0 +1,105 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from photouploadapi.models import BlobTombstone, Photo, StoredBlob
+from photouploadapi.purge import delete_photos
+from photouploadapi.reconcile import bucket_objects, database_records, reconcile
+from photouploadapi.views import PHOTOS_BUCKET_NAME, storage_client
+
+
+ORIGINALS_PREFIX = 'user_'
+
+
+class Command(BaseCommand):
+    help = (
+        "Compares the photo objects in the bucket with the database in one streaming sorted merge and reports "
+        "orphan objects (no photo uses them) and missing objects (photos whose object is gone). With --repair, "
+        "orphan objects are tombstoned for run_purge_worker and photos with missing objects are deleted."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--prefix', default='user_', help="Object name prefix to reconcile; must be under 'user_'.",
+        )
+        parser.add_argument(
+            '--min-age', type=int, default=24 * 3600,
+            help="Ignore objects and photos younger than this many seconds (uploads in progress).",
+        )
+        parser.add_argument('--repair', action='store_true', help="Fix what is found instead of only reporting it.")
+        parser.add_argument('--page-size', type=int, default=1000, help="Objects per bucket listing page.")
+        parser.add_argument('--chunk-size', type=int, default=2000, help="Rows per database fetch.")
+        parser.add_argument('--batch-size', type=int, default=500, help="Findings repaired per transaction.")
+
+    def handle(self, *args, **options):
+        if not options['prefix'].startswith(ORIGINALS_PREFIX):
+            # Derivatives are only recorded in Photo.derivatives, which the merge does not read, so every
+            # live one would look like an orphan
+            raise CommandError(f"--prefix must start with '{ORIGINALS_PREFIX}'; only original photos are reconciled.")
+        cutoff = timezone.now() - timedelta(seconds=options['min_age'])
+        objects = bucket_objects(storage_client, PHOTOS_BUCKET_NAME, options['prefix'], options['page_size'])
+        records = database_records(options['prefix'], options['chunk_size'])
+
+        counts = {'orphan_object': 0, 'missing_object': 0, 'too_recent': 0}
+        orphan_names, missing = [], {}
+        for kind, name, detail in reconcile(objects, records):
+            if kind == 'orphan_object':
+                if detail is not None and detail > cutoff:
+                    counts['too_recent'] += 1
+                    continue
+                self.stdout.write(f"orphan object: {name}")
+                if options['repair']:
+                    orphan_names.append(name)
+            else:
+                if any(upload_time > cutoff for _, upload_time in detail):
+                    counts['too_recent'] += 1
+                    continue
+                photo_ids = [photo_id for photo_id, _ in detail]
+                self.stdout.write(f"missing object: {name} (photos {', '.join(map(str, photo_ids)) or 'none'})")
+                if options['repair']:
+                    missing[name] = photo_ids
+            counts[kind] += 1
+
+            if len(orphan_names) >= options['batch_size']:
+                self._tombstone_orphans(orphan_names)
+                orphan_names = []
+            if len(missing) >= options['batch_size']:
+                self._drop_missing(missing)
+                missing = {}
+
+        self._tombstone_orphans(orphan_names)
+        self._drop_missing(missing)
+
+        action = "repaired" if options['repair'] else "found"
+        self.stdout.write(
+            f"{counts['orphan_object']} orphan objects and {counts['missing_object']} missing objects {action} "
+            f"under '{options['prefix']}' ({counts['too_recent']} skipped as younger than {options['min_age']}s)."
+        )
+
+    def _tombstone_orphans(self, names):
+        if not names:
+            return
+        with transaction.atomic():
+            # A photo may have started using the object since it was listed
+            list(StoredBlob.objects.select_for_update().filter(gcs_blob_name__in=names).values_list('id'))
+            in_use = set(Photo.objects.filter(gcs_blob_name__in=names).values_list('gcs_blob_name', flat=True))
+            names = [name for name in names if name not in in_use]
+            StoredBlob.objects.filter(gcs_blob_name__in=names).delete()
+            BlobTombstone.objects.bulk_create(
+                [BlobTombstone(gcs_blob_name=name) for name in names], ignore_conflicts=True
+            )
+
+    def _drop_missing(self, missing):
+        if not missing:
+            return
+        names = list(missing)
+        with transaction.atomic():
+            delete_photos(Photo.objects.filter(
+                pk__in=[photo_id for photo_ids in missing.values() for photo_id in photo_ids], gcs_blob_name__in=names,
+            ))
+            # Unless a new upload took it meanwhile, the StoredBlob must go so no upload dedups onto it
+            StoredBlob.objects.filter(gcs_blob_name__in=names).exclude(
+                gcs_blob_name__in=Photo.objects.filter(gcs_blob_name__in=names).values('gcs_blob_name')
+            ).delete()
@@ -0,0 +1,198 @@
+import hashlib
+import json
+import os
+import signal
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from photouploadapi.jobs import enqueue_reanalysis, has_live_job, without_live_jobs
+from photouploadapi.models import Photo
+from photouploadapi.ratelimit import RateLimited
+
+
+class Command(BaseCommand):
+    help = (
+        "Re-runs landmark analysis for the photos matching the filters on a bounded thread pool. "
+        "Photos with a queued or running analysis job are left to run_analysis_worker. "
+        "Progress is checkpointed, so re-running the same command after an interruption resumes it."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--status', nargs='+', choices=[choice for choice, _ in Photo.PROCESSING_STATUS_CHOICES],
+                            help="Only photos in these processing states.")
+        parser.add_argument('--since', help="Only photos uploaded at or after this date/time (ISO 8601).")
+        parser.add_argument('--until', help="Only photos uploaded before this date/time (ISO 8601).")
+        parser.add_argument('--user', help="Only photos of this user (username or id).")
+        parser.add_argument('--country', help="Only photos whose landmark is in this country.")
+        parser.add_argument(
+            '--concurrency', type=int, default=settings.ANALYSIS_WORKER_CONCURRENCY,
+            help="Number of analyses run at the same time.",
+        )
+        parser.add_argument('--checkpoint', help="Checkpoint file (default: derived from the filters).")
+        parser.add_argument('--restart', action='store_true', help="Ignore an existing checkpoint.")
+        parser.add_argument(
+            '--enqueue', action='store_true',
+            help="Queue the photos for run_analysis_worker instead of analyzing them here.",
+        )
+        parser.add_argument('--progress-interval', type=float, default=5, help="Seconds between progress lines.")
+
+    def handle(self, *args, **options):
+        filters = {name: options[name] for name in ('status', 'since', 'until', 'user', 'country')}
+        photos = self._select(filters)
+
+        if options['enqueue']:
+            jobs = enqueue_reanalysis(photos)
+            self.stdout.write(f"Queued {len(jobs)} photos for re-analysis.")
+            return
+
+        checkpoint_path = options['checkpoint'] or self._default_checkpoint_path(filters)
+        checkpoint = {"filters": filters, "last_id": 0, "processed": 0, "failed": 0}
+        if not options['restart'] and os.path.exists(checkpoint_path):
+            with open(checkpoint_path) as checkpoint_file:
+                saved = json.load(checkpoint_file)
+            if saved.get("filters") != filters:
+                raise CommandError(f"{checkpoint_path} belongs to a run with other filters; use --restart.")
+            checkpoint = saved
+            self.stdout.write(f"Resuming after photo {checkpoint['last_id']} "
+                              f"({checkpoint['processed']} already processed).")
+
+        remaining = self._remaining(photos, checkpoint['last_id'])
+        total = remaining.count()
+        self.stdout.write(f"Reprocessing {total} photos with concurrency {options['concurrency']}.")
+        self._run(remaining, total, checkpoint, checkpoint_path, options)
+
+    def _select(self, filters):
+        photos = Photo.objects.all()
+        if filters['status']:
+            if 'completed' not in filters['status']:
+                # Lets the planner find them through the partial photo_unfinished_idx
+                photos = Photo.objects.unfinished()
+            photos = photos.filter(processing_status__in=filters['status'])
+        if filters['since']:
+            photos = photos.filter(upload_time__gte=self._parse_moment(filters['since']))
+        if filters['until']:
+            photos = photos.filter(upload_time__lt=self._parse_moment(filters['until']))
+        if filters['user']:
+            user = filters['user']
+            photos = photos.filter(user_id=int(user)) if user.isdigit() else photos.filter(user__username=user)
+        if filters['country']:
+            photos = photos.filter(landmark_data__country__iexact=filters['country'])
+        return photos
+
+    def _remaining(self, photos, last_id):
+        # The analysis worker owns photos with a live job, as in enqueue_reanalysis
+        return without_live_jobs(photos.filter(id__gt=last_id).exclude(processing_status='processing')).order_by('id')
+
+    def _parse_moment(self, value):
+        moment = parse_datetime(value)
+        if moment is None:
+            day = parse_date(value)
+            if day is None:
+                raise CommandError(f"Invalid date: {value}")
+            moment = datetime(day.year, day.month, day.day)
+        if timezone.is_naive(moment):
+            moment = timezone.make_aware(moment)
+        return moment
+
+    def _default_checkpoint_path(self, filters):
+        digest = hashlib.sha256(json.dumps(filters, sort_keys=True).encode()).hexdigest()[:12]
+        return f".reprocess_photos-{digest}.json"
+
+    def _run(self, photos, total, checkpoint, checkpoint_path, options):
+        from photouploadapi.views import PhotoViewSet
+        analyzer = PhotoViewSet()
+        concurrency = max(1, options['concurrency'])
+
+        self._stopping = False
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+
+        # Photos are submitted in id order; the checkpoint only moves past an id
+        # once it and every id before it have finished
+        submitted, finished = deque(), set()
+        processed = failed = skipped = 0
+        started = last_report = time.monotonic()
+        next_photos = photos.iterator(chunk_size=500)
+        in_flight = {}
+        with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='reprocess') as pool:
+            while True:
+                while not self._stopping and len(in_flight) < concurrency * 2:
+                    photo = next(next_photos, None)
+                    if photo is None:
+                        break
+                    if has_live_job(photo.id):
+                        # Queued since the selection started; the worker will analyze it
+                        skipped += 1
+                        continue
+                    submitted.append(photo.id)
+                    in_flight[pool.submit(self._reprocess, analyzer, photo)] = photo.id
+                if not in_flight:
+                    break
+
+                done, _ = wait(in_flight, timeout=options['progress_interval'], return_when=FIRST_COMPLETED)
+                for future in done:
+                    photo_id = in_flight.pop(future)
+                    finished.add(photo_id)
+                    error = future.result()
+                    processed += 1
+                    if error is not None:
+                        failed += 1
+                        self.stderr.write(f"Photo {photo_id}: {error}")
+                while submitted and submitted[0] in finished:
+                    finished.discard(submitted[0])
+                    checkpoint['last_id'] = submitted.popleft()
+
+                if time.monotonic() - last_report >= options['progress_interval']:
+                    last_report = time.monotonic()
+                    self._save_checkpoint(checkpoint, checkpoint_path, processed, failed)
+                    self._report(processed, failed, total, started)
+
+        saved = self._save_checkpoint(checkpoint, checkpoint_path, processed, failed)
+        self._report(processed, failed, total, started)
+        if self._stopping:
+            self.stdout.write(f"Interrupted; run the same command again to resume (checkpoint {checkpoint_path}).")
+        else:
+            os.remove(checkpoint_path)
+            self.stdout.write(f"Done: {saved['processed']} photos reprocessed, {saved['failed']} failed"
+                              f"{f', {skipped} left to the analysis worker' if skipped else ''}.")
+
+    def _reprocess(self, analyzer, photo):
+        close_old_connections()
+        try:
+            while True:
+                try:
+                    analyzer._perform_photo_analysis(photo)
+                    break
+                except RateLimited as e:
+                    # Over quota: hold this slot until the limiter has room again
+                    time.sleep(e.retry_after)
+        except Exception as e:
+            return e
+        finally:
+            close_old_connections()
+        return None
+
+    def _save_checkpoint(self, checkpoint, checkpoint_path, processed, failed):
+        saved = dict(checkpoint, processed=checkpoint['processed'] + processed, failed=checkpoint['failed'] + failed)
+        with open(f"{checkpoint_path}.tmp", 'w') as checkpoint_file:
+            json.dump(saved, checkpoint_file)
+        os.replace(f"{checkpoint_path}.tmp", checkpoint_path)
+        return saved
+
+    def _report(self, processed, failed, total, started):
+        elapsed = time.monotonic() - started
+        rate = processed / elapsed if elapsed else 0.0
+        eta = f", ETA {(total - processed) / rate:.0f}s" if rate and processed < total else ""
+        self.stdout.write(f"{processed}/{total} processed ({failed} failed), {rate:.1f} photos/s{eta}")
+
+    def _stop(self, signum, frame):
+        self.stdout.write("Stopping after in-flight analyses finish...")
+        self._stopping = True
@@ -0,0 +1,85 @@
+import signal
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from photouploadapi.analysis import vision_batcher
+from photouploadapi.geocache import geocode_cache
+from photouploadapi.jobs import claim_jobs, make_worker_id, run_job
+from photouploadapi.outbound import http_client
+from photouploadapi.ratelimit import rate_limit_stats
+
+
+class Command(BaseCommand):
+    help = "Claims queued photo analysis jobs and runs them with a bounded thread pool."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--concurrency', type=int, default=settings.ANALYSIS_WORKER_CONCURRENCY,
+            help="Number of analyses run at the same time.",
+        )
+        parser.add_argument(
+            '--poll-interval', type=float, default=settings.ANALYSIS_WORKER_POLL_SECONDS,
+            help="Seconds to wait between polls when the queue is empty.",
+        )
+        parser.add_argument(
+            '--once', action='store_true',
+            help="Exit once the queue is drained instead of polling forever.",
+        )
+
+    def handle(self, *args, **options):
+        concurrency = max(1, options['concurrency'])
+        poll_interval = options['poll_interval']
+        worker_id = make_worker_id()
+        self._stopping = False
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+
+        self.stdout.write(f"Analysis worker {worker_id} started (concurrency={concurrency}).")
+        in_flight = set()
+        with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='analysis') as pool:
+            while not self._stopping or in_flight:
+                if not self._stopping:
+                    for job in claim_jobs(worker_id, concurrency - len(in_flight)):
+                        in_flight.add(pool.submit(run_job, job))
+
+                if not in_flight:
+                    if options['once']:
+                        break
+                    time.sleep(poll_interval)
+                    continue
+
+                done, in_flight = wait(in_flight, timeout=poll_interval, return_when=FIRST_COMPLETED)
+                for future in done:
+                    future.result()
+
+        stats = vision_batcher.stats()
+        self.stdout.write(
+            f"Analysis worker {worker_id} stopped. Vision batches: {stats['batches']} "
+            f"(avg size {stats['avg_batch_size']:.1f}, avg latency {stats['avg_latency_ms']:.0f} ms, "
+            f"max latency {stats['max_latency_ms']:.0f} ms, failed {stats['failed_batches']})."
+        )
+        stats = geocode_cache.stats()
+        self.stdout.write(
+            f"Geocode cache: {stats['memory_hits']} memory hits, {stats['db_hits']} db hits, "
+            f"{stats['misses']} misses ({stats['hit_rate']:.0%} hit rate), {stats['coalesced']} coalesced, "
+            f"{stats['evictions']} evicted."
+        )
+        for host, stats in http_client.stats().items():
+            self.stdout.write(
+                f"{host}: {stats['calls']} calls, {stats['retries']} retries, {stats['failures']} failed, "
+                f"{stats['short_circuited']} short-circuited, avg latency {stats['avg_latency_ms']:.0f} ms, "
+                f"circuit {stats['circuit']}."
+            )
+        for name, stats in rate_limit_stats().items():
+            self.stdout.write(
+                f"{name} rate limit: {stats['tokens']} tokens in {stats['calls']} calls, {stats['waits']} waited "
+                f"(avg {stats['avg_wait_ms']:.0f} ms, max {stats['max_wait_ms']:.0f} ms), "
+                f"{stats['rejections']} deferred, {stats['errors']} unlimited on error."
+            )
+
+    def _stop(self, signum, frame):
+        self.stdout.write("Shutting down after in-flight jobs finish...")
+        self._stopping = True
@@ -0,0 +1,54 @@
+import signal
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from photouploadapi.purge import claim_tombstones, purge_tombstones
+from photouploadapi.views import PHOTOS_BUCKET_NAME, storage_client
+
+
+class Command(BaseCommand):
+    help = "Deletes the GCS objects of deleted photos (tombstones) in batched requests."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=settings.PURGE_BATCH_SIZE,
+            help="Tombstones claimed per round (deleted 100 per GCS batch request).",
+        )
+        parser.add_argument(
+            '--poll-interval', type=float, default=settings.PURGE_WORKER_POLL_SECONDS,
+            help="Seconds to wait between polls when nothing is due.",
+        )
+        parser.add_argument(
+            '--once', action='store_true',
+            help="Exit once no tombstone is due instead of polling forever.",
+        )
+
+    def handle(self, *args, **options):
+        self._stopping = False
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+
+        bucket = storage_client.bucket(PHOTOS_BUCKET_NAME)
+        total_purged = total_failed = 0
+        self.stdout.write(f"Purge worker started (batch size {options['batch_size']}).")
+        while not self._stopping:
+            tombstones = claim_tombstones(max(1, options['batch_size']))
+            if not tombstones:
+                if options['once']:
+                    break
+                time.sleep(options['poll_interval'])
+                continue
+
+            purged, failed = purge_tombstones(tombstones, storage_client, bucket)
+            total_purged += purged
+            total_failed += failed
+            if failed:
+                self.stderr.write(f"{failed} of {len(tombstones)} deletions failed; they will be retried.")
+
+        self.stdout.write(f"Purge worker stopped. {total_purged} objects purged, {total_failed} failed attempts.")
+
+    def _stop(self, signum, frame):
+        self.stdout.write("Shutting down after the current batch...")
+        self._stopping = True
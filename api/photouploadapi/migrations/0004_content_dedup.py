@@ -0,0 +1,51 @@
+# Generated by Django 4.2.30 on 2026-10-18 14:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("photouploadapi", "0003_geocodecacheentry"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="StoredBlob",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("gcs_blob_name", models.CharField(max_length=255, unique=True)),
+                ("sha256", models.CharField(max_length=64, unique=True)),
+                ("ref_count", models.PositiveIntegerField(default=1)),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name="photo",
+            name="content_sha256",
+            field=models.CharField(
+                blank=True,
+                db_index=True,
+                help_text="SHA-256 of the uploaded bytes",
+                max_length=64,
+                null=True,
+            ),
+        ),
+        migrations.AlterField(
+            model_name="photo",
+            name="gcs_blob_name",
+            field=models.CharField(
+                db_index=True,
+                help_text="Name of the file in Google Cloud Storage",
+                max_length=255,
+            ),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-18 14:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("photouploadapi", "0004_content_dedup"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="photo",
+            name="size_bytes",
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 4.2.30 on 2026-10-18 14:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("photouploadapi", "0005_photo_size_bytes"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="analysisjob",
+            index=models.Index(
+                condition=models.Q(("status__in", ["queued", "running"])),
+                fields=["status", "run_after", "id"],
+                name="analysisjob_claim_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="landmark",
+            index=models.Index(fields=["country"], name="landmark_country_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="landmark",
+            index=models.Index(fields=["state"], name="landmark_state_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="landmark",
+            index=models.Index(
+                fields=["analysis_timestamp"], name="landmark_analyzed_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="photo",
+            index=models.Index(
+                fields=["user", "-upload_time", "-id"], name="photo_user_upload_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="photo",
+            index=models.Index(
+                condition=models.Q(("processing_status", "completed"), _negated=True),
+                fields=["processing_status", "upload_time"],
+                name="photo_unfinished_idx",
+            ),
+        ),
+    ]
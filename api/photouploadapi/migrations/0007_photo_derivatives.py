@@ -0,0 +1,22 @@
+# Generated by Django 4.2.30 on 2026-10-18 15:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("photouploadapi", "0006_query_plan_indexes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="photo",
+            name="derivatives",
+            field=models.JSONField(
+                blank=True,
+                default=dict,
+                help_text="Downscaled copies: size name -> GCS blob name",
+            ),
+        ),
+    ]
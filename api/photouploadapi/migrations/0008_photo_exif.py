@@ -0,0 +1,39 @@
+# Generated by Django 4.2.30 on 2026-10-18 15:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("photouploadapi", "0007_photo_derivatives"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="photo",
+            name="exif_orientation",
+            field=models.PositiveSmallIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="photo",
+            name="gps_latitude",
+            field=models.FloatField(
+                blank=True, help_text="From the photo's EXIF GPS tags", null=True
+            ),
+        ),
+        migrations.AddField(
+            model_name="photo",
+            name="gps_longitude",
+            field=models.FloatField(
+                blank=True, help_text="From the photo's EXIF GPS tags", null=True
+            ),
+        ),
+        migrations.AddField(
+            model_name="photo",
+            name="taken_at",
+            field=models.DateTimeField(
+                blank=True, help_text="EXIF capture time", null=True
+            ),
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 4.2.30 on 2026-10-18 15:34
+
+from django.db import migrations, models
+
+from photouploadapi.geo import geohash_encode
+
+
+def backfill_geohash(apps, schema_editor):
+    Landmark = apps.get_model("photouploadapi", "Landmark")
+    located = Landmark.objects.filter(latitude__isnull=False, longitude__isnull=False).only(
+        "id", "latitude", "longitude"
+    )
+    batch = []
+    for landmark in located.iterator(chunk_size=2000):
+        landmark.geohash = geohash_encode(landmark.latitude, landmark.longitude)
+        batch.append(landmark)
+        if len(batch) >= 2000:
+            Landmark.objects.bulk_update(batch, ["geohash"])
+            batch = []
+    Landmark.objects.bulk_update(batch, ["geohash"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("photouploadapi", "0010_ratelimitbucket"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="landmark",
+            name="geohash",
+            field=models.CharField(
+                blank=True,
+                help_text="Of latitude/longitude; set on save",
+                max_length=12,
+                null=True,
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="landmark",
+            index=models.Index(fields=["geohash"], name="landmark_geohash_idx"),
+        ),
+        migrations.RunPython(backfill_geohash, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,117 @@
+# Generated by Django 4.2.30 on 2026-10-18 15:42
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+from django.db.models import Count
+
+
+def backfill_user_stats(apps, schema_editor):
+    Photo = apps.get_model("photouploadapi", "Photo")
+    Landmark = apps.get_model("photouploadapi", "Landmark")
+    UserPhotoStats = apps.get_model("photouploadapi", "UserPhotoStats")
+    UserPlaceStats = apps.get_model("photouploadapi", "UserPlaceStats")
+
+    counts = {}
+    statuses = Photo.objects.values_list("user_id", "processing_status").annotate(photos=Count("id")).order_by()
+    for user_id, status, photos in statuses:
+        setattr(counts.setdefault(user_id, UserPhotoStats(user_id=user_id)), status, photos)
+    UserPhotoStats.objects.bulk_create(counts.values(), batch_size=1000)
+
+    places = {}
+    landmarks = (
+        Landmark.objects.values_list("photo__user_id", "country", "detected_landmark_name")
+        .annotate(photos=Count("id"))
+        .order_by()
+    )
+    for user_id, country, landmark_name, photos in landmarks:
+        if country:
+            places[(user_id, "country", country)] = places.get((user_id, "country", country), 0) + photos
+        if landmark_name not in (None, "", "Unknown"):
+            key = (user_id, "landmark", landmark_name)
+            places[key] = places.get(key, 0) + photos
+    UserPlaceStats.objects.bulk_create(
+        [
+            UserPlaceStats(user_id=user_id, kind=kind, name=name, photo_count=photos)
+            for (user_id, kind, name), photos in places.items()
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("auth", "0012_alter_user_first_name_max_length"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ("photouploadapi", "0011_landmark_geohash"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="UserPhotoStats",
+            fields=[
+                (
+                    "user",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="photo_stats",
+                        serialize=False,
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+                ("pending", models.IntegerField(default=0)),
+                ("processing", models.IntegerField(default=0)),
+                ("completed", models.IntegerField(default=0)),
+                ("failed", models.IntegerField(default=0)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name="UserPlaceStats",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "kind",
+                    models.CharField(
+                        choices=[("country", "Country"), ("landmark", "Landmark")],
+                        max_length=10,
+                    ),
+                ),
+                ("name", models.CharField(max_length=255)),
+                ("photo_count", models.IntegerField(default=0)),
+                (
+                    "user",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="place_stats",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["user", "kind", "-photo_count"],
+                        name="userplacestats_top_idx",
+                    )
+                ],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name="userplacestats",
+            constraint=models.UniqueConstraint(
+                fields=("user", "kind", "name"), name="userplacestats_unique"
+            ),
+        ),
+        migrations.RunPython(backfill_user_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 4.2.30 on 2026-10-18 15:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("photouploadapi", "0012_user_stats"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="storedblob",
+            name="sha256",
+            field=models.CharField(
+                blank=True,
+                help_text="Unknown for direct uploads, which are never shared",
+                max_length=64,
+                null=True,
+                unique=True,
+            ),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.30 on 2026-10-18 16:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("photouploadapi", "0013_storedblob_direct_uploads"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="analysisjob",
+            name="kind",
+            field=models.CharField(
+                choices=[("analysis", "Analysis"), ("derivatives", "Derivatives only")],
+                default="analysis",
+                help_text="Derivative jobs re-render the downscaled copies of an analyzed photo",
+                max_length=20,
+            ),
+        ),
+    ]
@@ -1,14 +1,57 @@
 from django.db import models
+from django.db.models import Q
 from django.contrib.auth.models import User
 
 
 from django.db import models
 from django.conf import settings 
+from django.utils import timezone
 import uuid
 
+from .geo import bbox_filter, geohash_encode, haversine_km, radius_bbox
+
+class PhotoQuerySet(models.QuerySet):
+    def with_details(self):
+        """
+        Joins everything PhotoSerializer reads (owner username and landmark
+        data), so serializing any number of photos costs a single query.
+        """
+        return self.select_related('user', 'landmark_data')
+
+    def unfinished(self):
+        """
+        Photos still waiting for (or failed) analysis. Matches the condition
+        of the partial index photo_unfinished_idx, so reprocess_photos
+        starts its status selections here.
+        """
+        return self.exclude(processing_status='completed')
+
+    def within_bbox(self, south, west, north, east):
+        """
+        Photos whose landmark lies in the box (west > east crosses the
+        antimeridian). The landmarks are found through landmark_geohash_idx
+        first, so the planner cannot fall back to scanning every photo of the
+        user in upload order.
+        """
+        return self.filter(pk__in=Landmark.objects.filter(bbox_filter(south, west, north, east)).values('photo_id'))
+
+    def near(self, latitude, longitude, radius_km):
+        """
+        Photos whose landmark is within `radius_km` of the point, annotated
+        with `distance_km`: the circle's bounding box, then the exact
+        haversine distance.
+        """
+        return (
+            self.within_bbox(*radius_bbox(latitude, longitude, radius_km))
+            .annotate(distance_km=haversine_km(latitude, longitude, prefix='landmark_data__'))
+            .filter(distance_km__lte=radius_km)
+        )
+
 class Photo(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='photos')
-    gcs_blob_name = models.CharField(max_length=255, unique=True, help_text="Name of the file in Google Cloud Storage")
+    gcs_blob_name = models.CharField(max_length=255, db_index=True, help_text="Name of the file in Google Cloud Storage")
+    content_sha256 = models.CharField(max_length=64, blank=True, null=True, db_index=True, help_text="SHA-256 of the uploaded bytes")
+    size_bytes = models.BigIntegerField(blank=True, null=True)
     upload_time = models.DateTimeField(auto_now_add=True)
     PROCESSING_STATUS_CHOICES = [
         ('pending', 'Pending'),
@@ -22,10 +65,71 @@ class Photo(models.Model):
         default='pending'
     )
     original_filename = models.CharField(max_length=255, blank=True, null=True)
+    derivatives = models.JSONField(default=dict, blank=True, help_text="Downscaled copies: size name -> GCS blob name")
+    gps_latitude = models.FloatField(blank=True, null=True, help_text="From the photo's EXIF GPS tags")
+    gps_longitude = models.FloatField(blank=True, null=True, help_text="From the photo's EXIF GPS tags")
+    taken_at = models.DateTimeField(blank=True, null=True, help_text="EXIF capture time")
+    exif_orientation = models.PositiveSmallIntegerField(blank=True, null=True)
+
+    objects = PhotoQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Every per-user listing filters on user and pages newest first
+            models.Index(fields=['user', '-upload_time', '-id'], name='photo_user_upload_idx'),
+            models.Index(fields=['processing_status', 'upload_time'], name='photo_unfinished_idx',
+                         condition=~Q(processing_status='completed')),
+        ]
+
+    @property
+    def has_gps(self):
+        return self.gps_latitude is not None and self.gps_longitude is not None
+
+    def blob_name_for_size(self, size=None):
+        """
+        Blob to serve for a requested size; falls back to the original until
+        the derivative has been generated.
+        """
+        if size and size != 'original':
+            return self.derivatives.get(size, self.gcs_blob_name)
+        return self.gcs_blob_name
 
     def __str__(self):
         return f"Photo {self.id} by {self.user.username}"
 
+class StoredBlob(models.Model):
+    """
+    A GCS object shared by every Photo with the same content. The object is
+    deleted only when the last referencing photo goes away.
+    """
+    gcs_blob_name = models.CharField(max_length=255, unique=True)
+    sha256 = models.CharField(max_length=64, unique=True, blank=True, null=True,
+                              help_text="Unknown for direct uploads, which are never shared")
+    ref_count = models.PositiveIntegerField(default=1)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.gcs_blob_name} ({self.ref_count} refs)"
+
+class BlobTombstone(models.Model):
+    """
+    A GCS object (original or derivative) whose photos are gone. The purge
+    worker deletes the object and then the tombstone.
+    """
+    gcs_blob_name = models.CharField(max_length=255, unique=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    run_after = models.DateTimeField(default=timezone.now, help_text="Not purged before this time")
+    attempts = models.PositiveSmallIntegerField(default=0)
+    last_error = models.TextField(blank=True, null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['run_after', 'id'], name='blobtombstone_purge_idx'),
+        ]
+
+    def __str__(self):
+        return f"Tombstone for {self.gcs_blob_name}"
+
 class Landmark(models.Model):
     photo = models.OneToOneField(Photo, on_delete=models.CASCADE, related_name='landmark_data')
     detected_landmark_name = models.CharField(max_length=255, blank=True, null=True)
@@ -40,7 +144,130 @@ class Landmark(models.Model):
     district = models.CharField(max_length=100, null=True, blank=True)
     country = models.CharField(max_length=100, null=True, blank=True)
     postal_code = models.CharField(max_length=20, null=True, blank=True)
+    geohash = models.CharField(max_length=12, blank=True, null=True, help_text="Of latitude/longitude; set on save")
     analysis_timestamp = models.DateTimeField(auto_now=True, help_text="When landmark analysis was last updated/completed")
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['geohash'], name='landmark_geohash_idx'),
+            models.Index(fields=['country'], name='landmark_country_idx'),
+            models.Index(fields=['state'], name='landmark_state_idx'),
+            models.Index(fields=['analysis_timestamp'], name='landmark_analyzed_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        has_location = self.latitude is not None and self.longitude is not None
+        self.geohash = geohash_encode(self.latitude, self.longitude) if has_location else None
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and {'latitude', 'longitude'} & set(update_fields):
+            kwargs['update_fields'] = {*update_fields, 'geohash'}
+        super().save(*args, **kwargs)
+
     def __str__(self):
         return self.detected_landmark_name or f"Landmark data for Photo {self.photo.id}"
+
+
+class AnalysisJob(models.Model):
+    photo = models.ForeignKey(Photo, on_delete=models.CASCADE, related_name='analysis_jobs')
+    STATUS_CHOICES = [
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ]
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='queued')
+    KIND_CHOICES = [
+        ('analysis', 'Analysis'),
+        ('derivatives', 'Derivatives only'),
+    ]
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES, default='analysis',
+                            help_text="Derivative jobs re-render the downscaled copies of an analyzed photo")
+    attempts = models.PositiveSmallIntegerField(default=0)
+    run_after = models.DateTimeField(default=timezone.now, help_text="Job is not claimed before this time")
+    locked_by = models.CharField(max_length=128, blank=True, null=True, help_text="Worker that currently holds the job")
+    locked_at = models.DateTimeField(blank=True, null=True)
+    last_error = models.TextField(blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            # Claim scans only ever look at live jobs
+            models.Index(fields=['status', 'run_after', 'id'], name='analysisjob_claim_idx',
+                         condition=Q(status__in=['queued', 'running'])),
+        ]
+
+    def __str__(self):
+        return f"Analysis job {self.id} for Photo {self.photo_id} ({self.status})"
+
+
+class UserPhotoStats(models.Model):
+    """
+    Photo counts per processing status for one user, kept up to date by
+    stats.py as photos change. `manage.py rebuild_stats` recomputes them.
+    """
+    user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, primary_key=True,
+                                related_name='photo_stats')
+    pending = models.IntegerField(default=0)
+    processing = models.IntegerField(default=0)
+    completed = models.IntegerField(default=0)
+    failed = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    @property
+    def total(self):
+        return self.pending + self.processing + self.completed + self.failed
+
+    def __str__(self):
+        return f"Photo stats of user {self.user_id}"
+
+
+class UserPlaceStats(models.Model):
+    """
+    Number of a user's photos per country or landmark name, maintained like
+    UserPhotoStats. Rows are removed when their count drops to zero.
+    """
+    KIND_CHOICES = [
+        ('country', 'Country'),
+        ('landmark', 'Landmark'),
+    ]
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='place_stats')
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    name = models.CharField(max_length=255)
+    photo_count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'kind', 'name'], name='userplacestats_unique'),
+        ]
+        indexes = [
+            # "Top N" reads for a user and kind
+            models.Index(fields=['user', 'kind', '-photo_count'], name='userplacestats_top_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.name} ({self.photo_count} photos of user {self.user_id})"
+
+
+class RateLimitBucket(models.Model):
+    """
+    Shared state of a token bucket (see ratelimit.py). `tokens` goes negative
+    while callers hold reservations for future slots.
+    """
+    name = models.CharField(max_length=64, unique=True)
+    tokens = models.FloatField()
+    updated_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"{self.name}: {self.tokens:.1f} tokens"
+
+
+class GeocodeCacheEntry(models.Model):
+    key = models.CharField(max_length=64, unique=True, help_text="Quantized 'lat,lng' the results are cached under")
+    results = models.JSONField(help_text="Geocoding API 'results' list")
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_used_at = models.DateTimeField(default=timezone.now, db_index=True)
+    hit_count = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"Geocode cache {self.key}"
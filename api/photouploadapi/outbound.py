@@ -0,0 +1,284 @@
+import asyncio
+import logging
+import random
+import threading
+import time
+import weakref
+from urllib.parse import urlsplit
+
+import httpx
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+
+logger = logging.getLogger(__name__)
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class CircuitOpenError(Exception):
+    """
+    Raised instead of calling an upstream whose circuit is open.
+    """
+
+
+class CircuitBreaker:
+    """
+    Opens after `failure_threshold` consecutive failed calls and rejects
+    calls for `reset_seconds`. After that a single trial call is let through
+    (half-open); its outcome closes or re-opens the circuit.
+    """
+
+    def __init__(self, failure_threshold=5, reset_seconds=30):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = None
+        self.opens = 0
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == 'closed':
+                return True
+            if self.state == 'open' and time.monotonic() - self.opened_at >= self.reset_seconds:
+                self.state = 'half_open'
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = 'closed'
+            self.failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == 'half_open' or self.failures >= self.failure_threshold:
+                if self.state != 'open':
+                    self.opens += 1
+                self.state = 'open'
+                self.opened_at = time.monotonic()
+
+
+class OutboundClient:
+    """
+    Shared HTTP client for calls to Google APIs, with sync (requests) and
+    async (httpx, `a`-prefixed methods) entry points.
+
+    Connections are kept alive in a pool per host, every call has connect
+    and read timeouts, 429/5xx responses and connection errors are retried
+    with jittered exponential backoff, and a circuit breaker per host fails
+    fast while an upstream is degraded.
+    """
+
+    def __init__(self, connect_timeout=3.05, read_timeout=30, max_retries=3, backoff_seconds=0.5,
+                 pool_maxsize=32, failure_threshold=5, reset_seconds=30):
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.pool_maxsize = pool_maxsize
+        self.adapter = HTTPAdapter(pool_connections=8, pool_maxsize=pool_maxsize, pool_block=False)
+        self.session = requests.Session()
+        self.session.mount('https://', self.adapter)
+        self.session.mount('http://', self.adapter)
+        self._lock = threading.Lock()
+        self._breakers = {}
+        self._stats = {}
+        self._async_clients = weakref.WeakKeyDictionary()
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def request(self, method, url, **kwargs):
+        """
+        Like requests.request, but pooled, time-bounded and retried (only use
+        it for idempotent calls; Vision and Geocoding reads are). Returns
+        the last response (which may still be an error status) or raises the
+        last connection error / CircuitOpenError.
+        """
+        host = urlsplit(url).netloc
+        breaker = self._begin_call(host)
+        if not breaker.allow():
+            self._count(host, 'short_circuited')
+            raise CircuitOpenError(f"{host} is failing; not calling it for up to {self.reset_seconds}s.")
+
+        kwargs.setdefault('timeout', self.timeout)
+        attempt = 0
+        settled = False
+        try:
+            while True:
+                started = time.monotonic()
+                try:
+                    response = self.session.request(method, url, **kwargs)
+                    error = None
+                except (requests.ConnectionError, requests.Timeout) as e:
+                    response, error = None, e
+                delay = self._settle(host, breaker, method, attempt, started, response, error)
+                if delay is None:
+                    settled = True
+                    if error is not None:
+                        raise error
+                    return response
+                attempt += 1
+                time.sleep(delay)
+        except BaseException:
+            if not settled:
+                self._abandon(host, breaker)
+            raise
+
+    async def aget(self, url, **kwargs):
+        return await self.arequest('GET', url, **kwargs)
+
+    async def apost(self, url, **kwargs):
+        return await self.arequest('POST', url, **kwargs)
+
+    async def arequest(self, method, url, **kwargs):
+        """
+        Async `request` over an httpx connection pool for the running event
+        loop. Retries, circuit breakers and stats are shared with the sync path.
+        """
+        host = urlsplit(url).netloc
+        breaker = self._begin_call(host)
+        if not breaker.allow():
+            self._count(host, 'short_circuited')
+            raise CircuitOpenError(f"{host} is failing; not calling it for up to {self.reset_seconds}s.")
+
+        kwargs.setdefault('timeout', httpx.Timeout(self.timeout[1], connect=self.timeout[0]))
+        client = self._async_client()
+        attempt = 0
+        settled = False
+        try:
+            while True:
+                started = time.monotonic()
+                try:
+                    response = await client.request(method, url, **kwargs)
+                    error = None
+                except httpx.TransportError as e:
+                    response, error = None, e
+                delay = self._settle(host, breaker, method, attempt, started, response, error)
+                if delay is None:
+                    settled = True
+                    if error is not None:
+                        raise error
+                    return response
+                attempt += 1
+                await asyncio.sleep(delay)
+        except BaseException:
+            if not settled:
+                self._abandon(host, breaker)
+            raise
+
+    def stats(self):
+        """
+        Per-host call counters, latency, circuit state and connection pool
+        usage of the sync session.
+        """
+        with self._lock:
+            snapshot = {host: dict(stats) for host, stats in self._stats.items()}
+        for host, stats in snapshot.items():
+            breaker = self._breakers[host]
+            stats['avg_latency_ms'] = stats['total_latency_ms'] / stats['attempts'] if stats['attempts'] else 0.0
+            stats['circuit'] = breaker.state
+            stats['circuit_opens'] = breaker.opens
+
+        pools = {}
+        for key in list(self.adapter.poolmanager.pools.keys()):
+            pool = self.adapter.poolmanager.pools.get(key)
+            if pool is not None:
+                pools[(key.key_host, key.key_port)] = {
+                    'connections_opened': pool.num_connections,
+                    'requests': pool.num_requests,
+                    # The pool queue is padded with None placeholders for connections not yet opened
+                    'idle': sum(1 for conn in list(pool.pool.queue) if conn is not None) if pool.pool else 0,
+                    'maxsize': pool.pool.maxsize if pool.pool else 0,
+                }
+        for host, stats in snapshot.items():
+            parts = urlsplit(f"//{host}")
+            stats['pool'] = pools.get((parts.hostname, parts.port)) or pools.get((parts.hostname, 443))
+        return snapshot
+
+    def _settle(self, host, breaker, method, attempt, started, response, error):
+        """
+        Records one attempt and returns the delay before the next one, or None
+        when this attempt's outcome is final.
+        """
+        self._record_latency(host, (time.monotonic() - started) * 1000)
+        if error is None and response.status_code not in RETRY_STATUSES:
+            breaker.record_success()
+            return None
+        if attempt >= self.max_retries:
+            self._count(host, 'failures')
+            breaker.record_failure()
+            return None
+
+        self._count(host, 'retries')
+        delay = self._retry_delay(attempt + 1, response)
+        logger.warning("Retrying %s %s in %.2fs (attempt %d): %s", method, host, delay, attempt + 1,
+                       error or response.status_code)
+        return delay
+
+    def _abandon(self, host, breaker):
+        """
+        Settles a call that ended in an unexpected exception (or was
+        cancelled) as failed. A half-open trial must always report back, or
+        the circuit would never leave half-open.
+        """
+        self._count(host, 'failures')
+        breaker.record_failure()
+
+    def _async_client(self):
+        # httpx pools are bound to the event loop they were created on
+        loop = asyncio.get_running_loop()
+        client = self._async_clients.get(loop)
+        if client is None:
+            limits = httpx.Limits(max_connections=self.pool_maxsize, max_keepalive_connections=self.pool_maxsize)
+            client = self._async_clients[loop] = httpx.AsyncClient(limits=limits)
+        return client
+
+    def _retry_delay(self, attempt, response):
+        retry_after = response.headers.get('Retry-After') if response is not None else None
+        if retry_after and retry_after.isdigit():
+            return min(float(retry_after), self.backoff_seconds * 2 ** self.max_retries)
+        # Full jitter keeps workers that failed together from retrying together
+        return random.uniform(0, self.backoff_seconds * 2 ** (attempt - 1))
+
+    def _begin_call(self, host):
+        with self._lock:
+            if host not in self._breakers:
+                self._breakers[host] = CircuitBreaker(self.failure_threshold, self.reset_seconds)
+                self._stats[host] = {
+                    'calls': 0, 'attempts': 0, 'retries': 0, 'failures': 0, 'short_circuited': 0,
+                    'total_latency_ms': 0.0, 'max_latency_ms': 0.0,
+                }
+            self._stats[host]['calls'] += 1
+            return self._breakers[host]
+
+    def _count(self, host, counter):
+        with self._lock:
+            self._stats[host][counter] += 1
+
+    def _record_latency(self, host, latency_ms):
+        with self._lock:
+            stats = self._stats[host]
+            stats['attempts'] += 1
+            stats['total_latency_ms'] += latency_ms
+            stats['max_latency_ms'] = max(stats['max_latency_ms'], latency_ms)
+
+
+http_client = OutboundClient(
+    connect_timeout=settings.OUTBOUND_CONNECT_TIMEOUT_SECONDS,
+    read_timeout=settings.OUTBOUND_READ_TIMEOUT_SECONDS,
+    max_retries=settings.OUTBOUND_MAX_RETRIES,
+    backoff_seconds=settings.OUTBOUND_RETRY_BACKOFF_SECONDS,
+    pool_maxsize=settings.OUTBOUND_POOL_MAXSIZE,
+    failure_threshold=settings.OUTBOUND_BREAKER_FAILURE_THRESHOLD,
+    reset_seconds=settings.OUTBOUND_BREAKER_RESET_SECONDS,
+)
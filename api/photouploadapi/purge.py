@@ -0,0 +1,132 @@
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+from google.cloud.storage.batch import Batch
+
+from .blobs import release_blobs
+from .models import BlobTombstone, Photo
+from .stats import record_photos_deleted
+
+
+logger = logging.getLogger(__name__)
+
+# Calls per GCS JSON API batch request
+GCS_BATCH_LIMIT = 100
+
+
+class _ResultBatch(Batch):
+    """
+    A GCS batch that keeps what finish() returns: one sub-response per
+    deferred call, in request order. Used as a context manager, the batch
+    would otherwise drop them.
+    """
+
+    results = None
+
+    def finish(self, raise_exception=True):
+        self.results = super().finish(raise_exception=raise_exception)
+        return self.results
+
+
+def tombstone_photo_objects(photos):
+    """
+    Drops the blob references held by `photos` (a Photo queryset) and
+    tombstones every object no photo references anymore, originals and
+    derivatives alike. Must run in the transaction that deletes the photos.
+    Returns the ids of the photos.
+    """
+    name_counts, derivatives, photo_ids = {}, {}, []
+    for photo_id, gcs_blob_name, photo_derivatives in (
+        photos.select_for_update().values_list('id', 'gcs_blob_name', 'derivatives')
+    ):
+        photo_ids.append(photo_id)
+        name_counts[gcs_blob_name] = name_counts.get(gcs_blob_name, 0) + 1
+        derivatives.setdefault(gcs_blob_name, set()).update((photo_derivatives or {}).values())
+
+    names = set()
+    for gcs_blob_name in release_blobs(name_counts):
+        names.add(gcs_blob_name)
+        names.update(derivatives[gcs_blob_name])
+    BlobTombstone.objects.bulk_create(
+        [BlobTombstone(gcs_blob_name=name) for name in sorted(names)], ignore_conflicts=True, batch_size=500
+    )
+    return photo_ids
+
+
+def delete_photos(photos):
+    """
+    Deletes the photos (and their landmarks and jobs) right away, uncounts
+    them from the user stats and leaves their GCS objects to the purge
+    worker. Returns the ids deleted.
+    """
+    with transaction.atomic():
+        photo_ids = tombstone_photo_objects(photos)
+        record_photos_deleted(photo_ids)
+        Photo.objects.filter(pk__in=photo_ids).delete()
+    return photo_ids
+
+
+def claim_tombstones(limit):
+    """
+    Leases up to `limit` due tombstones for PURGE_LEASE_SECONDS by pushing
+    their run_after forward; tombstones of a worker that dies come due again
+    when the lease runs out.
+    """
+    now = timezone.now()
+    lease_until = now + timedelta(seconds=settings.PURGE_LEASE_SECONDS)
+    with transaction.atomic():
+        candidates = BlobTombstone.objects.filter(run_after__lte=now).order_by('run_after', 'id')
+        if connection.features.has_select_for_update_skip_locked:
+            candidates = candidates.select_for_update(skip_locked=True)
+        tombstone_ids = list(candidates.values_list('id', flat=True)[:limit])
+        if not tombstone_ids:
+            return []
+        BlobTombstone.objects.filter(id__in=tombstone_ids, run_after__lte=now).update(
+            run_after=lease_until, attempts=F('attempts') + 1,
+        )
+    return list(BlobTombstone.objects.filter(id__in=tombstone_ids, run_after=lease_until).order_by('id'))
+
+
+def purge_tombstones(tombstones, client, bucket):
+    """
+    Deletes the objects of claimed tombstones with GCS batch requests of up
+    to GCS_BATCH_LIMIT deletions. An object that is already gone counts as
+    purged, so replaying a partially applied batch is harmless. Failed
+    deletions keep their tombstone and are retried with exponential backoff.
+    Returns (purged, failed).
+    """
+    purged, failed = [], []
+    for start in range(0, len(tombstones), GCS_BATCH_LIMIT):
+        chunk = tombstones[start:start + GCS_BATCH_LIMIT]
+        try:
+            with _ResultBatch(client, raise_exception=False) as batch:
+                for tombstone in chunk:
+                    bucket.delete_blob(tombstone.gcs_blob_name)
+            outcomes = [
+                None if 200 <= response.status_code < 300 or response.status_code == 404
+                else f"{response.status_code} {response.text[:200]}"
+                for response in batch.results
+            ]
+        except Exception as e:
+            logger.warning("GCS batch delete of %d objects failed: %s", len(chunk), e)
+            outcomes = [str(e)] * len(chunk)
+
+        for tombstone, error in zip(chunk, outcomes):
+            if error is None:
+                purged.append(tombstone.id)
+            else:
+                failed.append((tombstone, error))
+
+    BlobTombstone.objects.filter(id__in=purged).delete()
+    now = timezone.now()
+    for tombstone, error in failed:
+        tombstone.last_error = error
+        tombstone.run_after = now + timedelta(
+            seconds=settings.PURGE_RETRY_BACKOFF_SECONDS * 2 ** min(tombstone.attempts - 1, 6)
+        )
+        tombstone.save(update_fields=['last_error', 'run_after'])
+    return len(purged), len(failed)
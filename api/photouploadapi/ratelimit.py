@@ -0,0 +1,154 @@
+import asyncio
+import logging
+import threading
+import time
+from collections import deque
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import RateLimitBucket
+
+
+logger = logging.getLogger(__name__)
+
+# Window of the `current_rate` metric
+RATE_WINDOW_SECONDS = 60
+
+
+class RateLimited(Exception):
+    """
+    Raised when the next free slot is more than `max_wait_seconds` away.
+    The work should be deferred by `retry_after` seconds instead of failed.
+    """
+
+    def __init__(self, name, retry_after):
+        super().__init__(f"{name} rate limit reached; retry in {retry_after:.1f}s.")
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """
+    Token bucket shared by every process through a RateLimitBucket row, so
+    all instances and workers together stay under an upstream quota of
+    `rate` tokens per second (bursts of up to `burst`).
+
+    Callers reserve tokens in one short locked transaction and are told how
+    long to sleep until their slot; the bucket goes into debt instead of
+    making callers poll. A reservation further out than `max_wait_seconds`
+    is refused with RateLimited. If the database is unreachable the call is
+    let through, so the limiter never breaks analysis on its own.
+    """
+
+    def __init__(self, name, rate, burst_seconds=1, max_wait_seconds=10):
+        self.name = name
+        self.rate = rate
+        self.burst = max(1.0, rate * burst_seconds)
+        self.max_wait_seconds = max_wait_seconds
+        self._lock = threading.Lock()
+        self._granted = deque()
+        self._stats = {
+            'calls': 0, 'tokens': 0, 'waits': 0, 'total_wait_ms': 0.0, 'max_wait_ms': 0.0,
+            'rejections': 0, 'errors': 0,
+        }
+
+    @property
+    def enabled(self):
+        return self.rate > 0
+
+    def acquire(self, tokens=1):
+        """
+        Blocks until `tokens` may be spent, or raises RateLimited.
+        """
+        if self.enabled:
+            time.sleep(self._reserve(tokens))
+
+    async def aacquire(self, tokens=1):
+        """
+        Async `acquire`: the reservation runs in Django's sync thread and the
+        wait is an asyncio sleep.
+        """
+        if self.enabled:
+            await asyncio.sleep(await sync_to_async(self._reserve)(tokens))
+
+    def stats(self):
+        now = time.monotonic()
+        with self._lock:
+            self._trim(now)
+            snapshot = dict(self._stats)
+            snapshot['current_rate'] = sum(tokens for _, tokens in self._granted) / RATE_WINDOW_SECONDS
+        snapshot['rate_limit'] = self.rate
+        snapshot['burst'] = self.burst
+        snapshot['avg_wait_ms'] = snapshot['total_wait_ms'] / snapshot['waits'] if snapshot['waits'] else 0.0
+        return snapshot
+
+    def _reserve(self, tokens):
+        try:
+            wait = self._reserve_in_db(tokens)
+        except RateLimited:
+            self._count('rejections')
+            raise
+        except Exception as e:
+            logger.warning("Rate limiter %s unavailable, not limiting: %s", self.name, e)
+            self._count('errors')
+            wait = 0.0
+
+        now = time.monotonic()
+        with self._lock:
+            self._stats['calls'] += 1
+            self._stats['tokens'] += tokens
+            if wait > 0:
+                self._stats['waits'] += 1
+                self._stats['total_wait_ms'] += wait * 1000
+                self._stats['max_wait_ms'] = max(self._stats['max_wait_ms'], wait * 1000)
+            self._granted.append((now + wait, tokens))
+            self._trim(now)
+        return wait
+
+    def _reserve_in_db(self, tokens):
+        RateLimitBucket.objects.get_or_create(
+            name=self.name, defaults={'tokens': self.burst, 'updated_at': timezone.now()}
+        )
+        with transaction.atomic():
+            bucket = RateLimitBucket.objects.select_for_update().get(name=self.name)
+            now = timezone.now()
+            elapsed = max(0.0, (now - bucket.updated_at).total_seconds())
+            available = min(self.burst, bucket.tokens + elapsed * self.rate)
+            # A request bigger than the bucket can ever cover would be refused forever
+            tokens = min(tokens, self.burst + self.rate * self.max_wait_seconds)
+            wait = max(0.0, (tokens - available) / self.rate)
+            if wait > self.max_wait_seconds:
+                raise RateLimited(self.name, wait - self.max_wait_seconds)
+
+            bucket.tokens = available - tokens
+            bucket.updated_at = now
+            bucket.save(update_fields=['tokens', 'updated_at'])
+        return wait
+
+    def _count(self, counter):
+        with self._lock:
+            self._stats[counter] += 1
+
+    def _trim(self, now):
+        while self._granted and self._granted[0][0] < now - RATE_WINDOW_SECONDS:
+            self._granted.popleft()
+
+
+vision_rate_limit = TokenBucket(
+    'vision',
+    rate=settings.VISION_RATE_LIMIT_PER_SECOND,
+    burst_seconds=settings.RATE_LIMIT_BURST_SECONDS,
+    max_wait_seconds=settings.RATE_LIMIT_MAX_WAIT_SECONDS,
+)
+geocoding_rate_limit = TokenBucket(
+    'geocoding',
+    rate=settings.GEOCODING_RATE_LIMIT_PER_SECOND,
+    burst_seconds=settings.RATE_LIMIT_BURST_SECONDS,
+    max_wait_seconds=settings.RATE_LIMIT_MAX_WAIT_SECONDS,
+)
+
+
+def rate_limit_stats():
+    return {limiter.name: limiter.stats() for limiter in (vision_rate_limit, geocoding_rate_limit)}
@@ -0,0 +1,95 @@
+import heapq
+from itertools import groupby
+
+from django.db import connection
+from django.db.models import F
+from django.db.models.functions import Collate
+
+from .models import BlobTombstone, Photo, StoredBlob
+
+
+class ObjectRecords:
+    """
+    Everything the database knows about one object name: the photos using
+    it, whether a StoredBlob row references it and whether it is tombstoned.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.photos = []
+        self.stored = False
+        self.tombstoned = False
+
+
+def bucket_objects(client, bucket_name, prefix, page_size=1000):
+    """
+    Yields (name, time_created) for the objects under `prefix`, fetched page
+    by page. GCS lists names in UTF-8 byte order.
+    """
+    blobs = client.list_blobs(
+        bucket_name, prefix=prefix, page_size=page_size, fields='items(name,timeCreated),nextPageToken'
+    )
+    for blob in blobs:
+        yield blob.name, blob.time_created
+
+
+def _byte_ordered(queryset):
+    # Compare names byte-wise like GCS does, not by the database's locale collation
+    collation = 'C' if connection.vendor == 'postgresql' else 'BINARY'
+    return queryset.annotate(name_key=Collate(F('gcs_blob_name'), collation)).order_by('name_key')
+
+
+def database_records(prefix, chunk_size=2000):
+    """
+    Yields an ObjectRecords per object name under `prefix` referenced by a
+    photo, a StoredBlob or a tombstone, in the same order as bucket_objects.
+    The three tables are streamed with chunked iterator() queries and merged,
+    so memory use does not depend on the number of rows.
+    """
+    photos = _byte_ordered(Photo.objects.filter(gcs_blob_name__startswith=prefix)).values_list(
+        'gcs_blob_name', 'id', 'upload_time'
+    )
+    stored = _byte_ordered(StoredBlob.objects.filter(gcs_blob_name__startswith=prefix)).values_list('gcs_blob_name')
+    tombstones = _byte_ordered(BlobTombstone.objects.filter(gcs_blob_name__startswith=prefix)).values_list(
+        'gcs_blob_name'
+    )
+    rows = heapq.merge(
+        (('photo', row) for row in photos.iterator(chunk_size=chunk_size)),
+        (('stored', row) for row in stored.iterator(chunk_size=chunk_size)),
+        (('tombstone', row) for row in tombstones.iterator(chunk_size=chunk_size)),
+        key=lambda item: item[1][0],
+    )
+    for name, group in groupby(rows, key=lambda item: item[1][0]):
+        records = ObjectRecords(name)
+        for kind, row in group:
+            if kind == 'photo':
+                records.photos.append(row[1:])
+            elif kind == 'stored':
+                records.stored = True
+            else:
+                records.tombstoned = True
+        yield records
+
+
+def reconcile(objects, records):
+    """
+    Sorted merge of bucket_objects and database_records. Yields
+    ('orphan_object', name, time_created) for objects no photo uses and that
+    are not already tombstoned, and ('missing_object', name, photos) for
+    names that photos (or a StoredBlob row, which later uploads would reuse)
+    point at but that are not in the bucket.
+    """
+    objects, records = iter(objects), iter(records)
+    current_object, current_records = next(objects, None), next(records, None)
+    while current_object is not None or current_records is not None:
+        if current_records is None or (current_object is not None and current_object[0] < current_records.name):
+            yield 'orphan_object', current_object[0], current_object[1]
+            current_object = next(objects, None)
+        elif current_object is None or current_records.name < current_object[0]:
+            if current_records.photos or current_records.stored:
+                yield 'missing_object', current_records.name, current_records.photos
+            current_records = next(records, None)
+        else:
+            if not current_records.photos and not current_records.tombstoned:
+                yield 'orphan_object', current_object[0], current_object[1]
+            current_object, current_records = next(objects, None), next(records, None)
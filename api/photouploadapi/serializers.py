@@ -1,7 +1,11 @@
 import os
+from io import BytesIO
+from PIL import Image
 from rest_framework import serializers
 from .models import Photo, Landmark
+from .upload_handlers import GCSUploadedFile
 from django.contrib.auth import get_user_model
+from django.conf import settings
 
 
 PHOTOS_BUCKET_NAME = os.environ.get("PHOTOS_BUCKET_NAME", "your-gcs-photos-bucket-name")
@@ -25,7 +29,7 @@ class PhotoSerializer(serializers.ModelSerializer):
     gcs_url = serializers.SerializerMethodField()
     def get_gcs_url(self, obj):
         if obj.gcs_blob_name:
-            return f"https://storage.googleapis.com/{PHOTOS_BUCKET_NAME}/{obj.gcs_blob_name}"
+            return f"https://storage.googleapis.com/{PHOTOS_BUCKET_NAME}/{obj.blob_name_for_size(self.context.get('size'))}"
         return None
 
 
@@ -33,9 +37,66 @@ class PhotoSerializer(serializers.ModelSerializer):
         model = Photo
         fields = [
             'photo_id', 'user', 'gcs_blob_name', 'original_filename',
-            'upload_time', 'processing_status', 'landmark_data', 'gcs_url'
+            'upload_time', 'processing_status', 'landmark_data', 'gcs_url',
+            'content_sha256', 'derivatives', 'gps_latitude', 'gps_longitude',
+            'taken_at', 'exif_orientation'
         ]
-        read_only_fields = ['upload_time', 'processing_status', 'user', 'gcs_blob_name']
+        read_only_fields = [
+            'upload_time', 'processing_status', 'user', 'gcs_blob_name', 'content_sha256', 'derivatives',
+            'gps_latitude', 'gps_longitude', 'taken_at', 'exif_orientation'
+        ]
+
+class GalleryPhotoSerializer(PhotoSerializer):
+    """
+    PhotoSerializer plus a signed URL for the requested `size`, looked up in
+    the `signed_urls` context mapping of blob name to (url, expires_at).
+    """
+    signed_url = serializers.SerializerMethodField()
+
+    def get_signed_url(self, obj):
+        signed = self.context.get('signed_urls', {}).get(obj.blob_name_for_size(self.context.get('size')))
+        return signed[0] if signed else None
+
+    class Meta(PhotoSerializer.Meta):
+        fields = PhotoSerializer.Meta.fields + ['signed_url']
+
+class StreamedImageField(serializers.ImageField):
+    """
+    ImageField that also accepts files already streamed to GCS. Those are
+    only available as their leading bytes, so the format is sniffed from the
+    header instead of decoding the whole image.
+    """
+    def to_internal_value(self, data):
+        if not isinstance(data, GCSUploadedFile):
+            return super().to_internal_value(data)
+
+        file_object = serializers.FileField.to_internal_value(self, data)
+        try:
+            Image.open(BytesIO(data.head))
+        except Exception:
+            self.fail('invalid_image')
+        return file_object
 
 class PhotoUploadSerializer(serializers.Serializer):
-    image = serializers.ImageField(write_only=True, help_text="The photo file to upload.")
\ No newline at end of file
+    image = StreamedImageField(write_only=True, help_text="The photo file to upload.")
+
+class UploadRequestSerializer(serializers.Serializer):
+    filename = serializers.CharField(max_length=200)
+    content_type = serializers.ChoiceField(choices=settings.ALLOWED_UPLOAD_CONTENT_TYPES)
+    size = serializers.IntegerField(min_value=1, max_value=settings.MAX_PHOTO_UPLOAD_BYTES)
+    method = serializers.ChoiceField(choices=['PUT', 'POST'], default='PUT',
+                                     help_text="PUT returns a signed URL, POST a signed policy form.")
+
+    def validate_filename(self, value):
+        value = os.path.basename(value.replace('\\', '/'))
+        if not value:
+            raise serializers.ValidationError("Invalid filename.")
+        return value
+
+class UploadFinalizeSerializer(serializers.Serializer):
+    upload_token = serializers.CharField()
+
+class BulkDeleteSerializer(serializers.Serializer):
+    photo_ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1), allow_empty=False, max_length=settings.BULK_DELETE_MAX_PHOTOS
+    )
@@ -0,0 +1,45 @@
+from django.conf import settings
+from django.db.models.signals import post_delete, post_init, post_save, pre_delete
+from django.dispatch import receiver
+
+from .models import Landmark, Photo
+from .purge import tombstone_photo_objects
+from .stats import record_landmark_deleted, record_landmark_saved, record_photo_saved, track_landmark, track_photo
+
+
+@receiver(pre_delete, sender=settings.AUTH_USER_MODEL)
+def tombstone_user_photos(sender, instance, **kwargs):
+    # The photo rows go with the user's cascade; their GCS objects are left to the purge worker
+    tombstone_photo_objects(Photo.objects.filter(user=instance))
+
+
+@receiver(post_init, sender=Photo)
+def track_loaded_photo(sender, instance, **kwargs):
+    if instance.pk is not None and 'processing_status' in instance.__dict__:
+        track_photo(instance)
+
+
+@receiver(post_save, sender=Photo)
+def count_photo_status(sender, instance, created, raw, update_fields, **kwargs):
+    if not raw:
+        record_photo_saved(instance, created, update_fields)
+
+
+@receiver(post_init, sender=Landmark)
+def track_loaded_landmark(sender, instance, **kwargs):
+    if instance.pk is not None and {'country', 'detected_landmark_name'} <= instance.__dict__.keys():
+        track_landmark(instance)
+
+
+@receiver(post_save, sender=Landmark)
+def count_landmark_places(sender, instance, created, raw, update_fields, **kwargs):
+    if not raw:
+        record_landmark_saved(instance, created, update_fields)
+
+
+@receiver(post_delete, sender=Landmark)
+def uncount_landmark_places(sender, instance, origin, **kwargs):
+    # Landmarks deleted with their photos are uncounted in bulk by delete_photos,
+    # and a deleted user's stats rows go with the user
+    if isinstance(origin, Landmark) or getattr(origin, 'model', None) is Landmark:
+        record_landmark_deleted(instance)
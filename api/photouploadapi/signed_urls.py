@@ -0,0 +1,95 @@
+import hashlib
+import math
+import threading
+import time
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.core.cache import caches
+
+
+class SignedUrlCache:
+    """
+    Reuses V4 signed GET URLs per blob instead of signing on every request.
+
+    Expiry times are rounded up to fixed `bucket_seconds` boundaries, so a
+    cached URL stays byte-identical (and browser-cacheable) until it is within
+    `refresh_margin_seconds` of expiring, at which point a new one is signed.
+    Entries live in the Django cache named by SIGNED_URL_CACHE_ALIAS, which is
+    shared across workers when a shared cache backend is configured.
+    """
+
+    def __init__(self, ttl_seconds=3600, bucket_seconds=900, refresh_margin_seconds=300, cache_alias='default'):
+        self.ttl_seconds = ttl_seconds
+        self.bucket_seconds = bucket_seconds
+        self.refresh_margin_seconds = refresh_margin_seconds
+        self.cache_alias = cache_alias
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'signing_ms': 0.0}
+
+    @property
+    def cache(self):
+        return caches[self.cache_alias]
+
+    def sign(self, bucket, blob_name):
+        """
+        Returns (signed_url, expires_at) for a blob, signing only on a miss.
+        """
+        return self.sign_many(bucket, [blob_name])[blob_name]
+
+    def sign_many(self, bucket, blob_names):
+        """
+        Bulk variant of `sign`: one cache round trip for all blobs, and every
+        URL signed here shares the same expiry bucket.
+        """
+        keys = {self._key(name): name for name in blob_names}
+        cached = self.cache.get_many(list(keys))
+        results = {keys[key]: (url, datetime.fromtimestamp(expires_at, tz=dt_timezone.utc))
+                   for key, (url, expires_at) in cached.items()}
+
+        missing = [name for name in blob_names if name not in results]
+        with self._lock:
+            self._stats['hits'] += len(results)
+            self._stats['misses'] += len(missing)
+        if not missing:
+            return results
+
+        expires_at = self._expiry_bucket()
+        started = time.monotonic()
+        fresh = {}
+        for name in missing:
+            url = bucket.blob(name).generate_signed_url(
+                expiration=datetime.fromtimestamp(expires_at, tz=dt_timezone.utc),
+                method='GET',
+                version='v4'
+            )
+            fresh[self._key(name)] = (url, expires_at)
+            results[name] = (url, datetime.fromtimestamp(expires_at, tz=dt_timezone.utc))
+        with self._lock:
+            self._stats['signing_ms'] += (time.monotonic() - started) * 1000
+
+        timeout = max(1, int(expires_at - time.time() - self.refresh_margin_seconds))
+        self.cache.set_many(fresh, timeout=timeout)
+        return results
+
+    def stats(self):
+        with self._lock:
+            snapshot = dict(self._stats)
+        lookups = snapshot['hits'] + snapshot['misses']
+        snapshot['hit_rate'] = snapshot['hits'] / lookups if lookups else 0.0
+        snapshot['avg_signing_ms'] = snapshot['signing_ms'] / snapshot['misses'] if snapshot['misses'] else 0.0
+        return snapshot
+
+    def _expiry_bucket(self):
+        return math.ceil((time.time() + self.ttl_seconds) / self.bucket_seconds) * self.bucket_seconds
+
+    def _key(self, blob_name):
+        return f"signed-url:{hashlib.sha1(blob_name.encode()).hexdigest()}"
+
+
+signed_url_cache = SignedUrlCache(
+    ttl_seconds=settings.SIGNED_URL_TTL_SECONDS,
+    bucket_seconds=settings.SIGNED_URL_EXPIRY_BUCKET_SECONDS,
+    refresh_margin_seconds=settings.SIGNED_URL_REFRESH_MARGIN_SECONDS,
+    cache_alias=settings.SIGNED_URL_CACHE_ALIAS,
+)
@@ -0,0 +1,223 @@
+from collections import Counter
+
+from django.db import transaction
+from django.db.models import Count, F
+
+from .models import Landmark, Photo, UserPhotoStats, UserPlaceStats
+
+
+STATUSES = [status for status, _ in Photo.PROCESSING_STATUS_CHOICES]
+# Not a place anyone visited
+UNNAMED_LANDMARKS = {None, '', 'Unknown'}
+
+
+def landmark_places(country, landmark_name):
+    """
+    The (kind, name) UserPlaceStats keys a landmark counts towards.
+    """
+    places = []
+    if country:
+        places.append(('country', country))
+    if landmark_name not in UNNAMED_LANDMARKS:
+        places.append(('landmark', landmark_name))
+    return places
+
+
+def apply_status_deltas(deltas):
+    """
+    Adds {(user_id, status): delta} to UserPhotoStats, one UPDATE per user.
+    """
+    by_user = {}
+    for (user_id, status), delta in deltas.items():
+        if delta:
+            by_user.setdefault(user_id, {})[status] = F(status) + delta
+    # Fixed order, so concurrent writers lock the rows in the same order
+    for user_id, updates in sorted(by_user.items()):
+        stats = UserPhotoStats.objects.filter(user_id=user_id)
+        if not stats.update(**updates):
+            UserPhotoStats.objects.bulk_create([UserPhotoStats(user_id=user_id)], ignore_conflicts=True)
+            stats.update(**updates)
+
+
+def apply_place_deltas(deltas):
+    """
+    Adds {(user_id, kind, name): delta} to UserPlaceStats, dropping places
+    no photo counts towards anymore.
+    """
+    for (user_id, kind, name), delta in sorted(deltas.items()):
+        places = UserPlaceStats.objects.filter(user_id=user_id, kind=kind, name=name)
+        if delta > 0 and not places.update(photo_count=F('photo_count') + delta):
+            UserPlaceStats.objects.bulk_create([UserPlaceStats(user_id=user_id, kind=kind, name=name)],
+                                               ignore_conflicts=True)
+            places.update(photo_count=F('photo_count') + delta)
+        elif delta < 0:
+            places.update(photo_count=F('photo_count') + delta)
+            places.filter(photo_count__lte=0).delete()
+
+
+def track_photo(photo):
+    # The status the database holds for the photo, to diff against on the next save
+    photo._stats_status = photo.processing_status
+
+
+def track_landmark(landmark):
+    landmark._stats_places = landmark_places(landmark.country, landmark.detected_landmark_name)
+
+
+def record_photo_saved(photo, created, update_fields=None):
+    """
+    Counts a saved photo's status change. Photos loaded without their
+    status (deferred) cannot be diffed and are left to rebuild_stats.
+    """
+    if not created and not hasattr(photo, '_stats_status'):
+        return
+    if update_fields is not None and 'processing_status' not in update_fields:
+        return
+    old = None if created else photo._stats_status
+    if old != photo.processing_status:
+        deltas = Counter({(photo.user_id, photo.processing_status): 1})
+        if old is not None:
+            deltas[(photo.user_id, old)] -= 1
+        apply_status_deltas(deltas)
+    track_photo(photo)
+
+
+def record_landmark_saved(landmark, created, update_fields=None):
+    """
+    Moves a saved landmark's photo between countries and landmark names.
+    """
+    if not created and not hasattr(landmark, '_stats_places'):
+        return
+    if update_fields is not None and not {'country', 'detected_landmark_name'} & set(update_fields):
+        return
+    old = [] if created else landmark._stats_places
+    new = landmark_places(landmark.country, landmark.detected_landmark_name)
+    if old != new:
+        user_id = landmark.photo.user_id
+        deltas = Counter({(user_id, kind, name): 1 for kind, name in new})
+        deltas.subtract({(user_id, kind, name): 1 for kind, name in old})
+        apply_place_deltas(deltas)
+    track_landmark(landmark)
+
+
+def record_landmark_deleted(landmark):
+    """
+    Uncounts a deleted landmark's photo from its country and landmark name.
+    """
+    if not hasattr(landmark, '_stats_places'):
+        return
+    user_id = Photo.objects.filter(pk=landmark.photo_id).values_list('user_id', flat=True).first()
+    if user_id is not None:
+        apply_place_deltas(Counter({(user_id, kind, name): -1 for kind, name in landmark._stats_places}))
+
+
+def record_photos_created(photos):
+    """
+    Counts photos inserted with bulk_create, which sends no signals.
+    """
+    apply_status_deltas(Counter((photo.user_id, photo.processing_status) for photo in photos))
+    for photo in photos:
+        track_photo(photo)
+
+
+def record_status_changes(photos):
+    """
+    Counts the status changes of photos saved with bulk_update (or a
+    queryset update), against the status each was last tracked with.
+    """
+    deltas = Counter()
+    for photo in photos:
+        deltas[(photo.user_id, photo.processing_status)] += 1
+        deltas[(photo.user_id, photo._stats_status)] -= 1
+        track_photo(photo)
+    apply_status_deltas(deltas)
+
+
+def record_landmarks_created(landmarks):
+    """
+    Counts landmarks inserted with bulk_create; their photos must be loaded.
+    """
+    deltas = Counter()
+    for landmark in landmarks:
+        for kind, name in landmark_places(landmark.country, landmark.detected_landmark_name):
+            deltas[(landmark.photo.user_id, kind, name)] += 1
+        track_landmark(landmark)
+    apply_place_deltas(deltas)
+
+
+def record_photos_deleted(photo_ids):
+    """
+    Uncounts photos (and their landmarks) about to be deleted, with two
+    grouped queries however many there are. Must run in the deleting
+    transaction.
+    """
+    statuses = (
+        Photo.objects.filter(pk__in=photo_ids)
+        .values_list('user_id', 'processing_status')
+        .annotate(photos=Count('id'))
+        .order_by()
+    )
+    apply_status_deltas({(user_id, status): -photos for user_id, status, photos in statuses})
+
+    landmarks = (
+        Landmark.objects.filter(photo_id__in=photo_ids)
+        .values_list('photo__user_id', 'country', 'detected_landmark_name')
+        .annotate(photos=Count('id'))
+        .order_by()
+    )
+    deltas = Counter()
+    for user_id, country, landmark_name, photos in landmarks:
+        for kind, name in landmark_places(country, landmark_name):
+            deltas[(user_id, kind, name)] -= photos
+    apply_place_deltas(deltas)
+
+
+def rebuild_user_stats(user_ids):
+    """
+    Recomputes the summary rows of the given users from Photo and Landmark
+    with grouped queries, replacing what was there.
+    """
+    with transaction.atomic():
+        UserPhotoStats.objects.filter(user_id__in=user_ids).delete()
+        UserPlaceStats.objects.filter(user_id__in=user_ids).delete()
+
+        counts = {user_id: UserPhotoStats(user_id=user_id) for user_id in user_ids}
+        statuses = (
+            Photo.objects.filter(user_id__in=user_ids)
+            .values_list('user_id', 'processing_status')
+            .annotate(photos=Count('id'))
+            .order_by()
+        )
+        for user_id, status, photos in statuses:
+            setattr(counts[user_id], status, photos)
+        UserPhotoStats.objects.bulk_create(counts.values())
+
+        places = Counter()
+        landmarks = (
+            Landmark.objects.filter(photo__user_id__in=user_ids)
+            .values_list('photo__user_id', 'country', 'detected_landmark_name')
+            .annotate(photos=Count('id'))
+            .order_by()
+        )
+        for user_id, country, landmark_name, photos in landmarks:
+            for kind, name in landmark_places(country, landmark_name):
+                places[(user_id, kind, name)] += photos
+        UserPlaceStats.objects.bulk_create([
+            UserPlaceStats(user_id=user_id, kind=kind, name=name, photo_count=photos)
+            for (user_id, kind, name), photos in places.items()
+        ], batch_size=1000)
+
+
+def user_stats(user, top=10):
+    """
+    The summary of a user's photos in three indexed reads: per-status
+    counts, every country and the `top` landmarks by photo count.
+    """
+    counts = UserPhotoStats.objects.filter(user=user).first() or UserPhotoStats(user=user)
+    countries = UserPlaceStats.objects.filter(user=user, kind='country').order_by('-photo_count', 'name')
+    landmarks = UserPlaceStats.objects.filter(user=user, kind='landmark').order_by('-photo_count', 'name')[:top]
+    return {
+        "counts": {**{status: getattr(counts, status) for status in STATUSES}, "total": counts.total},
+        "countries_visited": [{"name": name, "photos": photos} for name, photos in countries.values_list('name', 'photo_count')],
+        "top_landmarks": [{"name": name, "photos": photos} for name, photos in landmarks.values_list('name', 'photo_count')],
+    }
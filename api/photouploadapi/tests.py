@@ -1,3 +1,1730 @@
-from django.test import TestCase
+import asyncio
+import base64
+from datetime import datetime, timedelta, timezone as dt_timezone
+import hashlib
+import importlib
+from importlib import import_module
+import json
+import os
+import tempfile
+import threading
+import time
+from io import BytesIO, StringIO
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.files.uploadhandler import StopFutureHandlers
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, connection
+from django.utils import timezone
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import clear_url_caches, resolve
+from google.api_core.exceptions import NotFound
+import requests
+from PIL import ExifTags, Image
+from rest_framework.test import APIClient
+
+from . import urls as photo_urls
+from .analysis import VisionBatcher, content_image, detect_landmarks
+from .async_storage import AsyncStorageClient
+from .async_views import AsyncPhotoViewSet
+from .blobs import acquire_existing_blobs, register_blobs
+from .exif import read_exif_fields
+from .derivatives import delete_derivatives, derivative_blob_name, generate_derivatives, render_derivatives
+from .geo import geohash_encode
+from .geocache import GeocodeCache
+from .jobs import claim_jobs, complete_job, enqueue_analysis, enqueue_derivatives, enqueue_reanalysis, fail_job, run_job
+from .management.commands.reprocess_photos import Command as ReprocessPhotosCommand
+from .models import AnalysisJob, BlobTombstone, GeocodeCacheEntry, Photo, Landmark, StoredBlob, UserPhotoStats, UserPlaceStats
+from .outbound import CircuitBreaker, CircuitOpenError, OutboundClient
+from .purge import claim_tombstones, delete_photos, purge_tombstones
+from .ratelimit import RateLimited, TokenBucket
+from .reconcile import database_records, reconcile
+from .signed_urls import SignedUrlCache
+from .stats import rebuild_user_stats
+from .upload_handlers import GCSStreamingUploadHandler
+from .views import PHOTOS_BUCKET_NAME, PhotoViewSet
+
+User = get_user_model()
+
+
+class PhotoListQueryCountTests(TestCase):
+    """
+    Serializing photos must not issue per-photo queries for the owner or
+    landmark data, however many photos are returned.
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='alice', password='secret-pass')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def _create_photos(self, count):
+        for _ in range(count):
+            index = Photo.objects.count()
+            photo = Photo.objects.create(user=self.user, gcs_blob_name=f"user_{self.user.id}/{index}.jpg",
+                                         original_filename=f"{index}.jpg", processing_status='completed')
+            Landmark.objects.create(photo=photo, detected_landmark_name="Eiffel Tower", country="France")
+
+    def _assert_constant_queries(self, url, expected_queries):
+        for count in (1, 25):
+            self._create_photos(count)
+            # force_authenticate skips the session/token lookup, so only view queries are counted
+            with self.assertNumQueries(expected_queries):
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+
+    def test_list_user_photos(self):
+        # target user, photos with owner and landmark joined
+        self._assert_constant_queries(f'/api/v1/users/{self.user.id}/photos/', 2)
+
+    @mock.patch('photouploadapi.views.storage_client')
+    def test_user_gallery(self, storage_client):
+        storage_client.bucket.return_value.blob.return_value.generate_signed_url.return_value = 'https://signed'
+        # target user, page count, page of photos with owner and landmark joined
+        self._assert_constant_queries(f'/api/v1/users/{self.user.id}/gallery/', 3)
+
+    def test_photo_details(self):
+        self._create_photos(1)
+        photo = Photo.objects.get()
+        with self.assertNumQueries(1):
+            response = self.client.get(f'/api/v1/photos/{photo.id}/details/')
+        self.assertEqual(response.data['landmark_data']['detected_landmark_name'], "Eiffel Tower")
+        self.assertEqual(response.data['user'], 'alice')
+
+
+class ListUserPhotosPaginationTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='bob', password='secret-pass')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_cursor_walks_all_photos_newest_first(self):
+        photos = [Photo.objects.create(user=self.user, gcs_blob_name=f"user_{self.user.id}/{index}.jpg")
+                  for index in range(7)]
+        # Identical timestamps must still page deterministically on id
+        Photo.objects.filter(pk__in=[photo.pk for photo in photos[2:5]]).update(upload_time=photos[2].upload_time)
+        expected = list(Photo.objects.order_by('-upload_time', '-id').values_list('id', flat=True))
+
+        seen = []
+        url = f'/api/v1/users/{self.user.id}/photos/?page_size=3'
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertLessEqual(len(response.data['results']), 3)
+            seen.extend(photo['photo_id'] for photo in response.data['results'])
+            url = response.data['next']
+
+        self.assertEqual(seen, expected)
+
+    def test_invalid_cursor(self):
+        response = self.client.get(f'/api/v1/users/{self.user.id}/photos/?cursor=not-a-cursor')
+        self.assertEqual(response.status_code, 404)
+
+
+class QueryPlanIndexTests(TestCase):
+    """
+    Runs EXPLAIN on the SQL an endpoint actually issues and checks that the
+    expected index shows up in the plan.
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='carol', password='secret-pass')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        for index in range(3):
+            photo = Photo.objects.create(user=self.user, gcs_blob_name=f"user_{self.user.id}/{index}.jpg")
+            Landmark.objects.create(photo=photo, country="France", state="Ile-de-France")
+
+    def _plan(self, sql, params=()):
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                # Tiny test tables would otherwise always be seq-scanned
+                cursor.execute("SET LOCAL enable_seqscan = off")
+                cursor.execute(f"EXPLAIN {sql}", params)
+            else:
+                cursor.execute(f"EXPLAIN QUERY PLAN {sql}", params)
+            return "\n".join(str(row) for row in cursor.fetchall())
+
+    def _assert_request_uses_index(self, url, table, index_name):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        statements = [query['sql'] for query in context.captured_queries
+                      if f'FROM "{table}"' in query['sql'] and 'COUNT(' not in query['sql']]
+        self.assertTrue(statements, f"No query on {table} issued by {url}")
+        for sql in statements:
+            self.assertIn(index_name, self._plan(sql))
+
+    def _assert_queryset_uses_index(self, queryset, index_name):
+        sql, params = queryset.query.sql_with_params()
+        self.assertIn(index_name, self._plan(sql, params))
+
+    def test_list_user_photos_uses_user_upload_index(self):
+        self._assert_request_uses_index(f'/api/v1/users/{self.user.id}/photos/',
+                                        'photouploadapi_photo', 'photo_user_upload_idx')
+
+    def test_next_page_uses_user_upload_index(self):
+        first_page = self.client.get(f'/api/v1/users/{self.user.id}/photos/?page_size=1')
+        self._assert_request_uses_index(first_page.data['next'], 'photouploadapi_photo', 'photo_user_upload_idx')
+
+    @mock.patch('photouploadapi.views.storage_client')
+    def test_gallery_uses_user_upload_index(self, storage_client):
+        storage_client.bucket.return_value.blob.return_value.generate_signed_url.return_value = 'https://signed'
+        self._assert_request_uses_index(f'/api/v1/users/{self.user.id}/gallery/',
+                                        'photouploadapi_photo', 'photo_user_upload_idx')
+
+    def test_reprocessing_unfinished_photos_uses_partial_index(self):
+        command = ReprocessPhotosCommand()
+        photos = command._select({'status': ['pending', 'failed'], 'since': None, 'until': None,
+                                  'user': None, 'country': None})
+        self._assert_queryset_uses_index(command._remaining(photos, 0), 'photo_unfinished_idx')
+
+    def test_job_claim_uses_partial_index(self):
+        with CaptureQueriesContext(connection) as context:
+            claim_jobs('test-worker', 10)
+        select = next(query['sql'] for query in context.captured_queries
+                      if query['sql'].startswith('SELECT') and 'photouploadapi_analysisjob' in query['sql'])
+        self.assertIn('analysisjob_claim_idx', self._plan(select))
+
+    def test_landmark_admin_filters_use_indexes(self):
+        self._assert_queryset_uses_index(Landmark.objects.filter(country="France"), 'landmark_country_idx')
+        self._assert_queryset_uses_index(Landmark.objects.filter(state="Ile-de-France"), 'landmark_state_idx')
+        self._assert_queryset_uses_index(Landmark.objects.order_by('-analysis_timestamp'), 'landmark_analyzed_idx')
+
+
+@override_settings(ANALYSIS_JOB_MAX_ATTEMPTS=2, ANALYSIS_JOB_RETRY_BACKOFF_SECONDS=30, ANALYSIS_JOB_LEASE_SECONDS=300)
+class AnalysisJobQueueTests(TestCase):
+
+    def setUp(self):
+        self.photo = Photo.objects.create(user=User.objects.create(username='owner'), gcs_blob_name='a.jpg')
+        self.job = enqueue_analysis(self.photo)
+
+    def test_claimed_job_is_not_claimed_again_until_its_lease_expires(self):
+        job, = claim_jobs('worker-1', 10)
+        self.assertEqual((job.status, job.locked_by, job.attempts), ('running', 'worker-1', 1))
+        self.assertEqual(claim_jobs('worker-2', 10), [])
+
+        # worker-1 died mid-run
+        AnalysisJob.objects.filter(pk=job.pk).update(locked_at=timezone.now() - timedelta(seconds=301))
+        job, = claim_jobs('worker-2', 10)
+        self.assertEqual((job.locked_by, job.attempts), ('worker-2', 2))
+
+    def test_failed_attempts_back_off_until_max_attempts(self):
+        job, = claim_jobs('worker', 1)
+        Photo.objects.filter(pk=self.photo.pk).update(processing_status='failed')
+        fail_job(job, ValueError('boom'))
+
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.last_error, job.locked_by), ('queued', 'boom', None))
+        self.assertAlmostEqual((job.run_after - timezone.now()).total_seconds(), 30, delta=5)
+        self.assertEqual(Photo.objects.get(pk=self.photo.pk).processing_status, 'pending')
+        self.assertEqual(claim_jobs('worker', 1), [])
+
+        AnalysisJob.objects.filter(pk=job.pk).update(run_after=timezone.now())
+        job, = claim_jobs('worker', 1)
+        fail_job(job, ValueError('boom again'))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ('failed', 2))
+        AnalysisJob.objects.filter(pk=job.pk).update(run_after=timezone.now())
+        self.assertEqual(claim_jobs('worker', 1), [])
+
+    def test_completed_job_is_done(self):
+        job, = claim_jobs('worker', 1)
+        analyzer = mock.Mock()
+
+        self.assertTrue(run_job(job, analyzer))
+
+        analyzer._perform_photo_analysis.assert_called_once_with(job.photo)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.locked_by), ('done', None))
+        self.assertEqual(claim_jobs('worker', 1), [])
+
+    def test_derivative_jobs_only_render_derivatives(self):
+        AnalysisJob.objects.all().delete()
+        Photo.objects.filter(pk=self.photo.pk).update(processing_status='completed')
+        enqueue_derivatives(self.photo)
+        job, = claim_jobs('worker', 1)
+        analyzer = mock.Mock()
+        analyzer._render_photo_derivatives.side_effect = OSError('cannot identify image')
+
+        self.assertFalse(run_job(job, analyzer))
+
+        analyzer._perform_photo_analysis.assert_not_called()
+        analyzer._render_photo_derivatives.assert_called_once_with(job.photo)
+        self.assertEqual(Photo.objects.get(pk=self.photo.pk).processing_status, 'completed')
+        # A pending rendering does not hold back a re-analysis
+        self.assertEqual(len(enqueue_reanalysis(Photo.objects.all())), 1)
+
+    def test_photo_is_not_created_without_its_job(self):
+        with mock.patch('photouploadapi.views.enqueue_analysis', side_effect=RuntimeError('queue down')):
+            with self.assertRaises(RuntimeError):
+                PhotoViewSet()._create_uploaded_photo(user=self.photo.user, gcs_blob_name='b.jpg', content_sha256='b')
+        self.assertFalse(Photo.objects.filter(gcs_blob_name='b.jpg').exists())
+
+
+
+@mock.patch('photouploadapi.management.commands.reprocess_photos.signal.signal')
+@mock.patch('photouploadapi.views.PhotoViewSet._perform_photo_analysis')
+class ReprocessPhotosCommandTests(TestCase):
+
+    def setUp(self):
+        owner = User.objects.create(username='owner')
+        self.photos = [Photo.objects.create(user=owner, gcs_blob_name=f"{index}.jpg") for index in range(5)]
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.checkpoint = os.path.join(directory.name, 'checkpoint.json')
+        self.command = ReprocessPhotosCommand()
+
+    def _reprocess(self, **options):
+        call_command(self.command, checkpoint=self.checkpoint, concurrency=1, progress_interval=60,
+                     stdout=StringIO(), stderr=StringIO(), **options)
+
+    def _analyzed(self, analyze):
+        return [call.args[0].id for call in analyze.call_args_list]
+
+    def _write_checkpoint(self, last_id, filters=None):
+        filters = filters or {'status': None, 'since': None, 'until': None, 'user': None, 'country': None}
+        with open(self.checkpoint, 'w') as checkpoint_file:
+            json.dump({'filters': filters, 'last_id': last_id, 'processed': 2, 'failed': 0}, checkpoint_file)
+
+    def test_interrupted_run_is_checkpointed_and_resumed(self, analyze, _signal):
+        def stop_after_first(photo):
+            self.command._stopping = True
+        analyze.side_effect = stop_after_first
+
+        self._reprocess()
+
+        first_run = self._analyzed(analyze)
+        self.assertEqual(first_run, [photo.id for photo in self.photos[:len(first_run)]])
+        with open(self.checkpoint) as checkpoint_file:
+            saved = json.load(checkpoint_file)
+        self.assertEqual((saved['last_id'], saved['processed']), (first_run[-1], len(first_run)))
+
+        analyze.reset_mock(side_effect=True)
+        self._reprocess()
+
+        self.assertEqual(self._analyzed(analyze), [photo.id for photo in self.photos[len(first_run):]])
+        self.assertFalse(os.path.exists(self.checkpoint))
+
+    def test_restart_ignores_the_checkpoint(self, analyze, _signal):
+        self._write_checkpoint(self.photos[1].id)
+        self._reprocess(restart=True)
+        self.assertEqual(self._analyzed(analyze), [photo.id for photo in self.photos])
+
+    def test_checkpoint_of_other_filters_is_refused(self, analyze, _signal):
+        self._write_checkpoint(self.photos[1].id, filters={'status': ['failed'], 'since': None, 'until': None,
+                                                           'user': None, 'country': None})
+        with self.assertRaises(CommandError):
+            self._reprocess()
+        analyze.assert_not_called()
+
+    def test_photos_with_live_jobs_are_left_to_the_worker(self, analyze, _signal):
+        enqueue_analysis(self.photos[0])
+        running = enqueue_analysis(self.photos[1])
+        AnalysisJob.objects.filter(pk=running.pk).update(status='running')
+        done = enqueue_analysis(self.photos[2])
+        AnalysisJob.objects.filter(pk=done.pk).update(status='done')
+
+        with mock.patch.object(self.command, '_remaining', lambda photos, last_id: photos.order_by('id')):
+            # Jobs queued after the selection was made are caught before submission too
+            self._reprocess()
+        with_remaining_filter = self._analyzed(analyze)
+        analyze.reset_mock()
+        self._reprocess()
+
+        expected = [photo.id for photo in self.photos[2:]]
+        self.assertEqual(with_remaining_filter, expected)
+        self.assertEqual(self._analyzed(analyze), expected)
+
+
+class ExifFieldsTests(TestCase):
+
+    def _jpeg(self, exif=None):
+        buffer = BytesIO()
+        Image.new('RGB', (64, 48)).save(buffer, 'JPEG', exif=exif or Image.Exif())
+        return buffer.getvalue()
+
+    def test_reads_gps_capture_time_and_orientation(self):
+        exif = Image.Exif()
+        exif[ExifTags.Base.Orientation] = 6
+        exif.get_ifd(ExifTags.IFD.GPSInfo).update({
+            ExifTags.GPS.GPSLatitudeRef: 'S', ExifTags.GPS.GPSLatitude: (33.0, 51.0, 25.2),
+            ExifTags.GPS.GPSLongitudeRef: 'E', ExifTags.GPS.GPSLongitude: (151.0, 12.0, 54.0),
+        })
+        exif.get_ifd(ExifTags.IFD.Exif).update({
+            ExifTags.Base.DateTimeOriginal: '2024:05:01 10:20:30', ExifTags.Base.OffsetTimeOriginal: '+10:00',
+        })
+
+        fields = read_exif_fields(self._jpeg(exif))
+
+        self.assertAlmostEqual(fields['gps_latitude'], -33.857)
+        self.assertAlmostEqual(fields['gps_longitude'], 151.215)
+        self.assertEqual(fields['taken_at'], datetime(2024, 5, 1, 0, 20, 30, tzinfo=dt_timezone.utc))
+        self.assertEqual(fields['exif_orientation'], 6)
+
+    def test_missing_or_truncated_exif(self):
+        self.assertEqual(read_exif_fields(self._jpeg()), {})
+        self.assertEqual(read_exif_fields(b'not an image'), {})
+
+
+@mock.patch('photouploadapi.analysis.vision_rate_limit', mock.Mock())
+class VisionBatcherTests(TestCase):
+
+    def _post(self, url, json):
+        # One response entry per image, named after it; 'bad' images get an error entry
+        entries = [{'error': {'message': 'bad image'}} if entry['image'] == 'bad' else {'name': entry['image']}
+                   for entry in json['requests']]
+        return mock.Mock(status_code=200, json=mock.Mock(return_value={'responses': entries}))
+
+    def _batch_sizes(self, post):
+        return [len(call.kwargs['json']['requests']) for call in post.call_args_list]
+
+    @mock.patch('photouploadapi.analysis.http_client')
+    def test_batches_up_to_max_size(self, http_client):
+        http_client.post.side_effect = self._post
+        batcher = VisionBatcher(max_batch_size=2, window_seconds=0.2)
+
+        futures = [batcher.submit({'image': str(index), 'features': []}) for index in range(5)]
+
+        self.assertEqual([future.result(timeout=5) for future in futures], [{'name': str(index)} for index in range(5)])
+        self.assertEqual(sorted(self._batch_sizes(http_client.post)), [1, 2, 2])
+        self.assertEqual(batcher.stats()['max_batch_size'], 2)
+
+    @mock.patch('photouploadapi.analysis.http_client')
+    def test_window_flushes_partial_batch(self, http_client):
+        http_client.post.side_effect = self._post
+        batcher = VisionBatcher(max_batch_size=16, window_seconds=0.05)
+
+        self.assertEqual(batcher.annotate('alone', []), {'name': 'alone'})
+        self.assertEqual(self._batch_sizes(http_client.post), [1])
+
+    @mock.patch('photouploadapi.analysis.http_client')
+    def test_errors_reach_the_right_callers(self, http_client):
+        http_client.post.side_effect = self._post
+        batcher = VisionBatcher(max_batch_size=3, window_seconds=1)
+
+        good, bad, other = [batcher.submit({'image': image, 'features': []}) for image in ('good', 'bad', 'other')]
+
+        self.assertEqual(good.result(timeout=5), {'name': 'good'})
+        self.assertEqual(other.result(timeout=5), {'name': 'other'})
+        with self.assertRaisesMessage(Exception, 'bad image'):
+            bad.result(timeout=5)
+
+    @mock.patch('photouploadapi.analysis.http_client')
+    def test_failed_call_fails_every_caller_in_the_batch(self, http_client):
+        http_client.post.return_value = mock.Mock(
+            status_code=403, json=mock.Mock(return_value={'error': {'message': 'quota'}})
+        )
+        batcher = VisionBatcher(max_batch_size=2, window_seconds=1)
+
+        futures = [batcher.submit({'image': image, 'features': []}) for image in ('a', 'b')]
+
+        for future in futures:
+            with self.assertRaisesMessage(Exception, 'quota'):
+                future.result(timeout=5)
+        self.assertEqual(batcher.stats()['failed_batches'], 1)
+
+
+
+@override_settings(VISION_CONTENT_MAX_EDGE=512)
+class VisionInputTests(TestCase):
+
+    def setUp(self):
+        self.photo = Photo(pk=1, gcs_blob_name='user_1/a.jpg')
+        self.bucket = mock.Mock()
+        buffer = BytesIO()
+        Image.new('RGB', (3000, 2000), 'red').save(buffer, 'JPEG')
+        self.bucket.blob.return_value.download_as_bytes.return_value = buffer.getvalue()
+
+    def _inline_image(self, image):
+        return Image.open(BytesIO(base64.b64decode(image['content'])))
+
+    def _sent_request(self, image):
+        # What detect_landmarks posts to images:annotate for this image
+        with mock.patch('photouploadapi.analysis.vision_batcher', VisionBatcher(window_seconds=0)), \
+                mock.patch('photouploadapi.analysis.http_client') as http_client:
+            http_client.post.return_value = mock.Mock(status_code=200, json=mock.Mock(return_value={'responses': [{}]}))
+            detect_landmarks(image)
+        request, = http_client.post.call_args.kwargs['json']['requests']
+        return request
+
+    def test_inline_content_is_downscaled_to_the_max_edge(self):
+        image = content_image(self.bucket.blob.return_value.download_as_bytes(), 1024)
+
+        self.assertEqual(list(image), ['content'])
+        decoded = self._inline_image(image)
+        self.assertEqual((decoded.format, decoded.size), ('JPEG', (1024, 683)))
+
+    def test_content_mode_sends_downloaded_bytes_inline(self):
+        image = PhotoViewSet()._vision_image(self.photo, self.bucket, mode='content')
+
+        self.bucket.blob.assert_called_with('user_1/a.jpg')
+        self.assertLessEqual(max(self._inline_image(image).size), 512)
+        request = self._sent_request(image)
+        self.assertEqual(request, {'image': image, 'features': [{'type': 'LANDMARK_DETECTION', 'maxResults': 1}]})
+
+    def test_gcs_uri_mode_sends_the_object_uri(self):
+        image = PhotoViewSet()._vision_image(self.photo, self.bucket, mode='gcs_uri')
+
+        self.assertEqual(self._sent_request(image)['image'],
+                         {'source': {'gcsImageUri': f'gs://{PHOTOS_BUCKET_NAME}/user_1/a.jpg'}})
+        self.bucket.blob.return_value.download_as_bytes.assert_not_called()
+
+    @mock.patch('photouploadapi.views.storage_client')
+    def test_signed_url_mode_sends_an_https_uri(self, storage_client):
+        caches['default'].clear()
+        storage_client.bucket.return_value.blob.return_value.generate_signed_url.return_value = \
+            'https://storage.googleapis.com/bucket/user_1/a.jpg?X-Goog-Signature=abc'
+
+        image = PhotoViewSet()._vision_image(self.photo, self.bucket, mode='signed_url')
+
+        self.assertEqual(self._sent_request(image)['image'],
+                         {'source': {'imageUri': 'https://storage.googleapis.com/bucket/user_1/a.jpg?X-Goog-Signature=abc'}})
+        self.bucket.blob.return_value.download_as_bytes.assert_not_called()
+
+    def test_unknown_mode_is_a_configuration_error(self):
+        with self.assertRaises(ImproperlyConfigured):
+            PhotoViewSet()._vision_image(self.photo, self.bucket, mode='ftp')
+
+
+class GeocodeCacheTests(TestCase):
+
+    def test_database_entries_expire_after_ttl(self):
+        cache = GeocodeCache(ttl_seconds=60)
+        fetch = mock.Mock(return_value=['paris'])
+        cache.get_or_fetch(48.8584, 2.2945, fetch)
+        entry = GeocodeCacheEntry.objects.get()
+
+        self.assertEqual(GeocodeCache(ttl_seconds=60).get_or_fetch(48.8584, 2.2945, fetch), ['paris'])
+        self.assertEqual(fetch.call_count, 1)
+
+        GeocodeCacheEntry.objects.update(created_at=timezone.now() - timedelta(seconds=61))
+        fetch.return_value = ['paris, again']
+        self.assertEqual(GeocodeCache(ttl_seconds=60).get_or_fetch(48.8584, 2.2945, fetch), ['paris, again'])
+        self.assertEqual(fetch.call_count, 2)
+        # Refreshed in place
+        self.assertEqual(GeocodeCacheEntry.objects.get().pk, entry.pk)
+
+    def test_least_recently_used_entries_are_evicted(self):
+        cache = GeocodeCache(max_entries=2, memory_entries=1, evict_every=3)
+        for lat in (1, 2):
+            cache.get_or_fetch(lat, 0, lambda: [lat])
+        GeocodeCacheEntry.objects.filter(key=cache.key_for(1, 0)).update(last_used_at=timezone.now() - timedelta(days=1))
+        # Back from the database, which marks the entry as used
+        self.assertEqual(cache.get_or_fetch(1, 0, mock.Mock()), [1])
+        self.assertEqual(cache.stats()['db_hits'], 1)
+
+        cache.get_or_fetch(3, 0, lambda: [3])
+
+        self.assertEqual(set(GeocodeCacheEntry.objects.values_list('key', flat=True)),
+                         {cache.key_for(1, 0), cache.key_for(3, 0)})
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+    def test_concurrent_misses_share_one_fetch(self):
+        cache = GeocodeCache()
+        # Threads would not see the test transaction
+        cache._db_get = mock.Mock(return_value=None)
+        cache._db_put = mock.Mock()
+        release = threading.Event()
+        fetch = mock.Mock(side_effect=lambda: release.wait(5) and ['paris'])
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(cache.get_or_fetch(48.8584, 2.2945, fetch)))
+                   for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        deadline = time.monotonic() + 5
+        while cache.stats()['coalesced'] < 2 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        release.set()
+        for thread in threads:
+            thread.join(5)
+
+        self.assertEqual(results, [['paris']] * 3)
+        self.assertEqual(fetch.call_count, 1)
+        self.assertEqual(cache.stats()['coalesced'], 2)
+
+
+class BulkBlobReferenceTests(TestCase):
+
+    def test_acquire_counts_references_per_digest(self):
+        StoredBlob.objects.create(sha256='a' * 64, gcs_blob_name='a.jpg')
+
+        acquired = acquire_existing_blobs({'a' * 64: 3, 'b' * 64: 1})
+
+        self.assertEqual(acquired, {'a' * 64: 'a.jpg'})
+        self.assertEqual(StoredBlob.objects.get(sha256='a' * 64).ref_count, 4)
+
+    def test_register_falls_back_to_existing_blob(self):
+        StoredBlob.objects.create(sha256='a' * 64, gcs_blob_name='winner.jpg')
+
+        registered = register_blobs({'a' * 64: ('loser.jpg', 2), 'b' * 64: ('b.jpg', 2)})
+
+        self.assertEqual(registered, {'a' * 64: 'winner.jpg', 'b' * 64: 'b.jpg'})
+        self.assertEqual(dict(StoredBlob.objects.values_list('gcs_blob_name', 'ref_count')),
+                         {'winner.jpg': 3, 'b.jpg': 2})
+
+
+class TokenBucketTests(TestCase):
+
+    def test_reservations_queue_up_behind_the_burst(self):
+        bucket = TokenBucket('test', rate=10, burst_seconds=0.5, max_wait_seconds=1)
+
+        waits = [bucket._reserve(1) for _ in range(7)]
+
+        self.assertEqual(waits[:5], [0.0] * 5)
+        self.assertAlmostEqual(waits[5], 0.1, places=1)
+        self.assertAlmostEqual(waits[6], 0.2, places=1)
+
+    def test_refuses_reservations_beyond_max_wait(self):
+        bucket = TokenBucket('test', rate=10, burst_seconds=0.5, max_wait_seconds=1)
+        bucket._reserve(15)
+
+        with self.assertRaises(RateLimited):
+            bucket._reserve(1)
+        self.assertEqual(bucket.stats()['rejections'], 1)
+
+    def test_rate_limited_job_is_deferred_without_using_an_attempt(self):
+        photo = Photo.objects.create(user=User.objects.create(username='owner'), gcs_blob_name='a.jpg')
+        enqueue_analysis(photo)
+        job = claim_jobs('worker', 1)[0]
+        analyzer = mock.Mock()
+        analyzer._perform_photo_analysis.side_effect = RateLimited('vision', 30)
+
+        self.assertFalse(run_job(job, analyzer))
+
+        job = AnalysisJob.objects.get(pk=job.pk)
+        self.assertEqual((job.status, job.attempts), ('queued', 0))
+
+
+class OutboundClientTests(TestCase):
+
+    def _client(self, responses, **kwargs):
+        client = OutboundClient(max_retries=3, backoff_seconds=0.5, **kwargs)
+        client.session = mock.Mock()
+        client.session.request.side_effect = responses
+        return client
+
+    def _response(self, status_code, headers=None):
+        return mock.Mock(status_code=status_code, headers=headers or {})
+
+    @mock.patch('photouploadapi.outbound.time.sleep')
+    def test_retries_retryable_statuses_with_growing_backoff(self, sleep):
+        client = self._client([self._response(503), self._response(502), self._response(200)])
+
+        response = client.get('https://vision.example/v1')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(client.session.request.call_count, 3)
+        delays = [call.args[0] for call in sleep.call_args_list]
+        self.assertEqual(len(delays), 2)
+        self.assertTrue(0 <= delays[0] <= 0.5 and 0 <= delays[1] <= 1.0)
+        stats = client.stats()['vision.example']
+        self.assertEqual((stats['calls'], stats['attempts'], stats['retries'], stats['failures']), (1, 3, 2, 0))
+
+    @mock.patch('photouploadapi.outbound.time.sleep')
+    def test_gives_up_after_max_retries(self, sleep):
+        client = self._client([self._response(503)] * 4 + [requests.ConnectionError('down')] * 4)
+
+        self.assertEqual(client.get('https://vision.example/v1').status_code, 503)
+        with self.assertRaises(requests.ConnectionError):
+            client.get('https://vision.example/v1')
+
+        self.assertEqual(client.session.request.call_count, 8)
+        self.assertEqual(sleep.call_count, 6)
+        stats = client.stats()['vision.example']
+        self.assertEqual((stats['retries'], stats['failures']), (6, 2))
+
+    @mock.patch('photouploadapi.outbound.time.sleep')
+    def test_honours_retry_after(self, sleep):
+        client = self._client([self._response(429, {'Retry-After': '2'}), self._response(200)])
+
+        client.get('https://vision.example/v1')
+
+        sleep.assert_called_once_with(2.0)
+
+    @mock.patch('photouploadapi.outbound.time.monotonic')
+    def test_breaker_opens_half_opens_and_closes(self, monotonic):
+        monotonic.return_value = 100.0
+        breaker = CircuitBreaker(failure_threshold=2, reset_seconds=30)
+
+        breaker.record_failure()
+        self.assertEqual(breaker.state, 'closed')
+        breaker.record_failure()
+        self.assertEqual(breaker.state, 'open')
+        self.assertFalse(breaker.allow())
+
+        monotonic.return_value = 130.0
+        self.assertTrue(breaker.allow())
+        self.assertEqual(breaker.state, 'half_open')
+        # Only the trial call is let through
+        self.assertFalse(breaker.allow())
+        breaker.record_success()
+        self.assertEqual(breaker.state, 'closed')
+        self.assertTrue(breaker.allow())
+
+    @mock.patch('photouploadapi.outbound.time.monotonic')
+    def test_failed_half_open_trial_reopens_the_circuit(self, monotonic):
+        monotonic.return_value = 100.0
+        breaker = CircuitBreaker(failure_threshold=2, reset_seconds=30)
+        breaker.record_failure()
+        breaker.record_failure()
+
+        monotonic.return_value = 130.0
+        breaker.allow()
+        breaker.record_failure()
+
+        self.assertEqual((breaker.state, breaker.opens), ('open', 2))
+        self.assertFalse(breaker.allow())
+        monotonic.return_value = 160.0
+        self.assertTrue(breaker.allow())
+
+    def test_short_circuits_while_open(self):
+        client = self._client([ValueError('bad url')], failure_threshold=1, reset_seconds=30)
+
+        with self.assertRaises(ValueError):
+            client.get('https://vision.example/v1')
+        with self.assertRaises(CircuitOpenError):
+            client.get('https://vision.example/v1')
+
+        self.assertEqual(client.session.request.call_count, 1)
+        self.assertEqual(client.stats()['vision.example']['short_circuited'], 1)
+
+    def test_unexpected_error_in_half_open_trial_does_not_wedge_the_circuit(self):
+        client = self._client([ValueError('bad url'), ValueError('bad url'), self._response(200)],
+                              failure_threshold=1, reset_seconds=0)
+
+        for _ in range(2):
+            with self.assertRaises(ValueError):
+                client.get('https://vision.example/v1')
+            self.assertEqual(client.stats()['vision.example']['circuit'], 'open')
+
+        self.assertEqual(client.get('https://vision.example/v1').status_code, 200)
+        self.assertEqual(client.stats()['vision.example']['circuit'], 'closed')
+
+    def test_cancelled_async_trial_settles_the_circuit(self):
+        client = OutboundClient(failure_threshold=1, reset_seconds=0)
+        pool = mock.Mock()
+        pool.request = mock.AsyncMock(side_effect=[asyncio.CancelledError(), self._response(200)])
+
+        with mock.patch.object(client, '_async_client', return_value=pool):
+            with self.assertRaises(asyncio.CancelledError):
+                asyncio.run(client.aget('https://geocode.example/json'))
+            self.assertEqual(client.stats()['geocode.example']['circuit'], 'open')
+
+            response = asyncio.run(client.aget('https://geocode.example/json'))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(client.stats()['geocode.example']['circuit'], 'closed')
+
+
+class PhotoUploadTests(TestCase):
+    """
+    upload_photo against an in-memory bucket: `self.blobs` holds every
+    object written (streamed or uploaded), by name.
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='owner', password='password')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.blobs = {}
+        self.upload_error = None
+        patcher = mock.patch('photouploadapi.views.storage_client')
+        storage_client = patcher.start()
+        self.addCleanup(patcher.stop)
+        storage_client.bucket.return_value.blob.side_effect = self._blob
+
+    def _blob(self, name):
+        if name not in self.blobs:
+            self.blobs[name] = mock.Mock()
+            self.blobs[name].name = name
+            self.blobs[name].upload_from_string.side_effect = self.upload_error
+        return self.blobs[name]
+
+    def _deleted(self):
+        return {name for name, blob in self.blobs.items() if blob.delete.called}
+
+    def _jpeg(self, color='red'):
+        buffer = BytesIO()
+        Image.new('RGB', (64, 48), color).save(buffer, 'JPEG')
+        return buffer.getvalue()
+
+    def _upload(self, content, filename='photo.jpg'):
+        return self.client.post('/api/v1/photos/upload_photo/',
+                                {'image': SimpleUploadedFile(filename, content, 'image/jpeg')}, format='multipart')
+
+    def test_reupload_shares_the_object_and_reuses_the_analysis(self):
+        first = self._upload(self._jpeg())
+        self.assertEqual(first.status_code, 202)
+        photo = Photo.objects.get(pk=first.data['photo']['photo_id'])
+        self.assertTrue(AnalysisJob.objects.filter(photo=photo).exists())
+        Landmark.objects.create(photo=photo, detected_landmark_name='Eiffel Tower', country='France')
+        Photo.objects.filter(pk=photo.pk).update(processing_status='completed')
+
+        second = self._upload(self._jpeg(), 'copy.jpg')
+
+        self.assertEqual(second.status_code, 201)
+        copy = Photo.objects.with_details().get(pk=second.data['photo']['photo_id'])
+        self.assertEqual(copy.gcs_blob_name, photo.gcs_blob_name)
+        self.assertEqual(copy.landmark_data.detected_landmark_name, 'Eiffel Tower')
+        self.assertFalse(AnalysisJob.objects.filter(photo=copy).exists())
+        self.assertEqual(StoredBlob.objects.get().ref_count, 2)
+        # The second streamed copy is dropped in favour of the stored one
+        self.assertEqual(self._deleted(), set(self.blobs) - {photo.gcs_blob_name})
+
+        delete_photos(Photo.objects.filter(pk=photo.pk))
+        self.assertFalse(BlobTombstone.objects.exists())
+        self.assertEqual(StoredBlob.objects.get().ref_count, 1)
+        delete_photos(Photo.objects.filter(pk=copy.pk))
+        self.assertEqual(list(BlobTombstone.objects.values_list('gcs_blob_name', flat=True)), [photo.gcs_blob_name])
+        self.assertFalse(StoredBlob.objects.exists())
+
+    @override_settings(UPLOAD_SNIFF_BYTES=4, UPLOAD_STREAM_CHUNK_BYTES=256 * 1024)
+    def test_streaming_handler_writes_hashes_and_keeps_the_head(self):
+        request = mock.Mock()
+        request.user.id = 7
+        handler = GCSStreamingUploadHandler(request, mock.Mock(blob=self._blob))
+        with self.assertRaises(StopFutureHandlers):
+            handler.new_file('image', 'photo.jpg', 'image/jpeg', None)
+        for start, chunk in ((0, b'abc'), (3, b'defgh')):
+            handler.receive_data_chunk(chunk, start)
+
+        uploaded = handler.file_complete(8)
+
+        blob_name, = self.blobs
+        self.assertTrue(blob_name.startswith('user_7/') and blob_name.endswith('_photo.jpg'))
+        self.blobs[blob_name].open.assert_called_once_with('wb', chunk_size=256 * 1024, content_type='image/jpeg',
+                                                          ignore_flush=True)
+        writer = self.blobs[blob_name].open.return_value
+        self.assertEqual(b''.join(call.args[0] for call in writer.write.call_args_list), b'abcdefgh')
+        writer.close.assert_called_once()
+        self.assertEqual((uploaded.gcs_blob_name, uploaded.head, uploaded.size), (blob_name, b'abcd', 8))
+        self.assertEqual(uploaded.sha256, hashlib.sha256(b'abcdefgh').hexdigest())
+
+    def test_oversize_upload_is_aborted_with_413(self):
+        with override_settings(MAX_PHOTO_UPLOAD_BYTES=100):
+            response = self._upload(self._jpeg())
+
+        self.assertEqual(response.status_code, 413)
+        blob, = self.blobs.values()
+        # The resumable session is never finalized, so nothing is committed in GCS
+        blob.open.return_value.close.assert_not_called()
+        self.assertFalse(Photo.objects.exists() or StoredBlob.objects.exists())
+
+    def test_invalid_image_removes_the_streamed_object(self):
+        response = self._upload(b'not an image')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self._deleted(), set(self.blobs))
+        self.assertEqual(len(self.blobs), 1)
+        self.assertFalse(Photo.objects.exists() or StoredBlob.objects.exists())
+
+    def test_failed_photo_insert_keeps_no_reference_or_object(self):
+        stored = self._upload(self._jpeg('blue'))
+        self.assertEqual(stored.status_code, 202)
+
+        with mock.patch.object(PhotoViewSet, '_create_uploaded_photo', side_effect=IntegrityError('boom')):
+            new_content = self._upload(self._jpeg())
+            known_content = self._upload(self._jpeg('blue'))
+
+        self.assertEqual((new_content.status_code, known_content.status_code), (500, 500))
+        self.assertEqual(Photo.objects.count(), 1)
+        self.assertEqual(list(StoredBlob.objects.values_list('gcs_blob_name', 'ref_count')),
+                         [(stored.data['photo']['gcs_blob_name'], 1)])
+        self.assertEqual(self._deleted(), set(self.blobs) - {stored.data['photo']['gcs_blob_name']})
+
+    DERIVATIVES = {'thumb': 'derived/thumb/photo.webp', 'medium': 'derived/medium/photo.webp'}
+    LANDMARK = {'detected_landmark_name': 'Eiffel Tower', 'country': 'France'}
+
+    def _inline_upload(self, analysis=LANDMARK, derivatives=DERIVATIVES):
+        """
+        upload_photo with UPLOAD_INLINE_ANALYSIS; `analysis` and `derivatives`
+        are what those stages return, or the exception they raise.
+        """
+        with override_settings(UPLOAD_INLINE_ANALYSIS=True), \
+                mock.patch.object(PhotoViewSet, '_analyze_image_bytes', side_effect=[analysis]), \
+                mock.patch('photouploadapi.views.upload_derivatives', side_effect=[derivatives]):
+            return self._upload(self._jpeg())
+
+    def test_inline_upload_stores_the_analysis(self):
+        response = self._inline_upload()
+
+        self.assertEqual(response.status_code, 201)
+        photo = Photo.objects.with_details().get()
+        self.assertEqual((photo.processing_status, photo.derivatives), ('completed', self.DERIVATIVES))
+        self.assertEqual(photo.landmark_data.detected_landmark_name, 'Eiffel Tower')
+        self.assertFalse(AnalysisJob.objects.exists())
+        self.assertEqual(self._deleted(), set())
+
+    def test_failed_inline_gcs_upload_removes_the_derivatives(self):
+        self.upload_error = Exception('GCS is down')
+
+        response = self._inline_upload()
+
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(self._deleted(), set(self.DERIVATIVES.values()))
+        self.assertFalse(Photo.objects.exists() or StoredBlob.objects.exists() or Landmark.objects.exists())
+
+    def test_failed_inline_analysis_queues_the_photo(self):
+        response = self._inline_upload(analysis=ValueError('Reverse geocoding returned no results.'))
+
+        self.assertEqual(response.status_code, 202)
+        photo = Photo.objects.get()
+        self.assertEqual((photo.processing_status, photo.derivatives), ('pending', self.DERIVATIVES))
+        self.assertTrue(AnalysisJob.objects.filter(photo=photo).exists())
+        self.assertFalse(Landmark.objects.exists())
+        self.assertEqual(self._deleted(), set())
+
+    def test_failed_inline_derivatives_queue_the_photo_for_rendering(self):
+        response = self._inline_upload(derivatives=OSError('cannot identify image'))
+
+        self.assertEqual(response.status_code, 201)
+        photo = Photo.objects.with_details().get()
+        self.assertEqual((photo.processing_status, photo.derivatives), ('completed', {}))
+        self.assertEqual(photo.landmark_data.country, 'France')
+        job, = AnalysisJob.objects.filter(photo=photo)
+        self.assertEqual(job.kind, 'derivatives')
+        self.assertEqual(self._deleted(), set())
+
+    def test_failed_inline_database_write_removes_every_object(self):
+        with mock.patch.object(Landmark.objects, 'create', side_effect=IntegrityError('boom')):
+            response = self._inline_upload()
+
+        self.assertEqual(response.status_code, 500)
+        original, = set(self.blobs) - set(self.DERIVATIVES.values())
+        self.assertEqual(self._deleted(), {original, *self.DERIVATIVES.values()})
+        self.assertFalse(Photo.objects.exists() or StoredBlob.objects.exists() or AnalysisJob.objects.exists())
+
+
+class BulkUploadTests(TestCase):
+    """
+    upload_photos against an in-memory bucket, as in PhotoUploadTests.
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='owner', password='password')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.blobs = {}
+        patcher = mock.patch('photouploadapi.views.storage_client')
+        storage_client = patcher.start()
+        self.addCleanup(patcher.stop)
+        storage_client.bucket.return_value.blob.side_effect = self._blob
+
+    def _blob(self, name):
+        if name not in self.blobs:
+            self.blobs[name] = mock.Mock()
+            self.blobs[name].name = name
+        return self.blobs[name]
+
+    def _uploaded(self):
+        return {name for name, blob in self.blobs.items() if blob.upload_from_file.called}
+
+    def _deleted(self):
+        return {name for name, blob in self.blobs.items() if blob.delete.called}
+
+    def _jpeg(self, color):
+        buffer = BytesIO()
+        Image.new('RGB', (64, 48), color).save(buffer, 'JPEG')
+        return buffer.getvalue()
+
+    def _upload(self, *contents):
+        files = [SimpleUploadedFile(f'{index}.jpg', content, 'image/jpeg') for index, content in enumerate(contents)]
+        return self.client.post('/api/v1/photos/upload_photos/', {'images': files}, format='multipart')
+
+    def test_all_valid_files_are_accepted(self):
+        response = self._upload(self._jpeg('red'), self._jpeg('blue'))
+
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual([entry['status'] for entry in response.data['results']], ['queued', 'queued'])
+        self.assertEqual((response.data['uploaded'], response.data['failed']), (2, 0))
+        self.assertEqual(AnalysisJob.objects.count(), 2)
+
+    def test_oversize_and_invalid_files_are_reported_per_file(self):
+        content = self._jpeg('red')
+        with override_settings(MAX_PHOTO_UPLOAD_BYTES=len(content)):
+            response = self._upload(content + b'\0', b'not an image', content)
+
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual([entry['status'] for entry in response.data['results']], ['invalid', 'invalid', 'queued'])
+        self.assertIn('limited to', str(response.data['results'][0]['errors']))
+        self.assertEqual((response.data['uploaded'], response.data['failed']), (1, 2))
+        self.assertEqual(len(self._uploaded()), 1)
+        self.assertEqual(Photo.objects.count(), 1)
+
+    def test_requests_over_the_total_limit_are_refused(self):
+        content = self._jpeg('red')
+        with override_settings(BULK_UPLOAD_MAX_BYTES=len(content) * 2):
+            response = self._upload(content, self._jpeg('blue'), self._jpeg('green'))
+
+        self.assertEqual(response.status_code, 413)
+        self.assertEqual(self.blobs, {})
+        self.assertFalse(Photo.objects.exists())
+
+    def test_duplicate_content_in_a_batch_is_stored_once(self):
+        content = self._jpeg('red')
+
+        response = self._upload(content, content, self._jpeg('blue'))
+
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(len(self._uploaded()), 2)
+        stored = StoredBlob.objects.get(sha256=hashlib.sha256(content).hexdigest())
+        self.assertEqual(stored.ref_count, 2)
+        self.assertEqual(Photo.objects.filter(gcs_blob_name=stored.gcs_blob_name).count(), 2)
+
+    def test_lost_registration_race_uses_the_winning_object(self):
+        content = self._jpeg('red')
+        content_sha256 = hashlib.sha256(content).hexdigest()
+
+        def register_after_a_concurrent_upload(uploads):
+            StoredBlob.objects.create(sha256=content_sha256, gcs_blob_name='user_9/winner.jpg')
+            return register_blobs(uploads)
+
+        with mock.patch('photouploadapi.views.register_blobs', side_effect=register_after_a_concurrent_upload):
+            response = self._upload(content, content)
+
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(set(Photo.objects.values_list('gcs_blob_name', flat=True)), {'user_9/winner.jpg'})
+        self.assertEqual(StoredBlob.objects.get().ref_count, 3)
+        self.assertEqual(self._deleted(), self._uploaded())
+
+    def test_failed_insert_deletes_new_objects_and_releases_references(self):
+        stored = self._upload(self._jpeg('blue'))
+        self.assertEqual(stored.status_code, 202)
+        stored_name = stored.data['results'][0]['photo']['gcs_blob_name']
+
+        with mock.patch.object(Photo.objects, 'bulk_create', side_effect=IntegrityError('boom')):
+            response = self._upload(self._jpeg('red'), self._jpeg('blue'))
+
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(Photo.objects.count(), 1)
+        self.assertEqual(list(StoredBlob.objects.values_list('gcs_blob_name', 'ref_count')), [(stored_name, 1)])
+        self.assertEqual(self._deleted(), self._uploaded() - {stored_name})
+
+
+class AsyncViewTests(TestCase):
+    """
+    The native async upload, analysis and signing views, routed as with
+    ASYNC_VIEWS=True, against mocked GCS.
+    """
+
+    def setUp(self):
+        with override_settings(ASYNC_VIEWS=True):
+            self._route_photo_views()
+        self.addCleanup(self._route_photo_views)
+        caches['default'].clear()
+        self.user = User.objects.create_user(username='owner', password='password')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.storage_client = mock.Mock()
+        self.async_storage = mock.Mock(upload=mock.AsyncMock(return_value=None), upload_file=mock.AsyncMock(), download=mock.AsyncMock())
+        for target, value in [('photouploadapi.views.storage_client', self.storage_client),
+                              ('photouploadapi.async_views.storage_client', self.storage_client),
+                              ('photouploadapi.async_views.async_storage', self.async_storage)]:
+            patcher = mock.patch(target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def _route_photo_views(self):
+        # urls.py picks the viewset when it is imported
+        importlib.reload(photo_urls)
+        importlib.reload(import_module(settings.ROOT_URLCONF))
+        clear_url_caches()
+
+    def _jpeg(self):
+        buffer = BytesIO()
+        Image.new('RGB', (64, 48), 'red').save(buffer, 'JPEG')
+        return buffer.getvalue()
+
+    def test_routes_to_the_async_viewset(self):
+        self.assertIs(resolve('/api/v1/photos/upload_photo/').func.cls, AsyncPhotoViewSet)
+
+    def test_upload_streams_the_file_to_gcs_and_queues_the_photo(self):
+        content = self._jpeg()
+
+        response = self.client.post('/api/v1/photos/upload_photo/',
+                                    {'image': SimpleUploadedFile('photo.jpg', content, 'image/jpeg')}, format='multipart')
+
+        self.assertEqual(response.status_code, 202)
+        photo = Photo.objects.get(pk=response.data['photo']['photo_id'])
+        bucket_name, blob_name, image_file, size, content_type, chunk_size = self.async_storage.upload_file.call_args.args
+        self.assertEqual((blob_name, size, content_type), (photo.gcs_blob_name, len(content), 'image/jpeg'))
+        self.assertNotIsInstance(image_file, bytes)
+        self.assertEqual(StoredBlob.objects.get().sha256, hashlib.sha256(content).hexdigest())
+        self.assertTrue(AnalysisJob.objects.filter(photo=photo).exists())
+
+    def test_failed_upload_creates_no_rows(self):
+        self.async_storage.upload_file.side_effect = Exception('GCS is down')
+
+        response = self.client.post('/api/v1/photos/upload_photo/',
+                                    {'image': SimpleUploadedFile('photo.jpg', self._jpeg(), 'image/jpeg')},
+                                    format='multipart')
+
+        self.assertEqual(response.status_code, 500)
+        self.assertFalse(Photo.objects.exists() or StoredBlob.objects.exists())
+
+    def _inline_upload(self, analysis, derivatives):
+        with override_settings(UPLOAD_INLINE_ANALYSIS=True), \
+                mock.patch.object(AsyncPhotoViewSet, '_aanalyze_image_bytes', side_effect=[analysis]), \
+                mock.patch('photouploadapi.async_views.upload_derivatives', side_effect=[derivatives]):
+            return self.client.post('/api/v1/photos/upload_photo/',
+                                    {'image': SimpleUploadedFile('photo.jpg', self._jpeg(), 'image/jpeg')},
+                                    format='multipart')
+
+    def _deleted(self):
+        blob = self.storage_client.bucket.return_value.blob
+        self.assertEqual(blob.return_value.delete.call_count, blob.call_count)
+        return {call.args[0] for call in blob.call_args_list}
+
+    def test_inline_upload_with_failed_gcs_upload_removes_the_derivatives(self):
+        self.async_storage.upload.side_effect = Exception('GCS is down')
+
+        response = self._inline_upload({'detected_landmark_name': 'Eiffel Tower'}, {'thumb': 'derived/thumb/a.webp'})
+
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(self._deleted(), {'derived/thumb/a.webp'})
+        self.assertFalse(Photo.objects.exists() or StoredBlob.objects.exists())
+
+    def test_inline_upload_with_failed_analysis_and_derivatives_queues_the_photo(self):
+        response = self._inline_upload(ValueError('no results'), OSError('cannot identify image'))
+
+        self.assertEqual(response.status_code, 202)
+        photo = Photo.objects.get()
+        self.assertEqual((photo.processing_status, photo.derivatives), ('pending', {}))
+        self.assertTrue(AnalysisJob.objects.filter(photo=photo).exists())
+        self.assertEqual(self._deleted(), set())
+
+    @override_settings(EXIF_GPS_VISION_POLICY='skip')
+    @mock.patch('photouploadapi.async_views.generate_derivatives')
+    @mock.patch('photouploadapi.async_views.geocode_cache')
+    def test_trigger_analysis_geocodes_the_exif_location(self, geocode_cache, generate_derivatives):
+        photo = Photo.objects.create(user=self.user, gcs_blob_name='a.jpg', gps_latitude=48.858, gps_longitude=2.294)
+        self.async_storage.download.return_value = self._jpeg()
+        geocode_cache.aget_or_fetch = mock.AsyncMock(return_value=[{
+            'formatted_address': 'Champ de Mars, Paris',
+            'address_components': [{'long_name': 'France', 'types': ['country']}],
+        }])
+
+        response = self.client.post(f'/api/v1/photos/{photo.pk}/trigger_analysis/')
+
+        self.assertEqual(response.status_code, 200)
+        photo.refresh_from_db()
+        self.assertEqual(photo.processing_status, 'completed')
+        self.assertEqual(Landmark.objects.get(photo=photo).country, 'France')
+        generate_derivatives.assert_called_once()
+
+    def test_trigger_analysis_of_another_users_photo_is_not_found(self):
+        photo = Photo.objects.create(user=User.objects.create(username='other'), gcs_blob_name='a.jpg')
+
+        self.assertEqual(self.client.post(f'/api/v1/photos/{photo.pk}/trigger_analysis/').status_code, 404)
+
+    def test_signed_url(self):
+        photo = Photo.objects.create(user=self.user, gcs_blob_name='a.jpg')
+        self.storage_client.bucket.return_value.blob.return_value.generate_signed_url.return_value = 'https://signed/a'
+
+        response = self.client.get(f'/api/v1/photos/{photo.pk}/signed_url/')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['signed_url'], 'https://signed/a')
+        self.storage_client.bucket.return_value.blob.assert_called_with('a.jpg')
+
+
+@override_settings(EXIF_GPS_VISION_POLICY='skip')
+class AnalysisOutcomeTests(TestCase):
+    """
+    The sync and async analyses share their status handling and landmark
+    upsert; every scenario runs through both, for a photo with EXIF GPS.
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='owner', password='password')
+        self.async_storage = mock.Mock(download=mock.AsyncMock(return_value=b''))
+        for target, value in [('photouploadapi.views.storage_client', mock.Mock()),
+                              ('photouploadapi.async_views.storage_client', mock.Mock()),
+                              ('photouploadapi.async_views.async_storage', self.async_storage),
+                              ('photouploadapi.views.generate_derivatives', mock.Mock()),
+                              ('photouploadapi.async_views.generate_derivatives', mock.Mock())]:
+            patcher = mock.patch(target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def _analyze_sync(self, photo, geocode):
+        with mock.patch('photouploadapi.views.geocode_cache') as geocode_cache:
+            geocode_cache.get_or_fetch.side_effect = [geocode]
+            PhotoViewSet()._perform_photo_analysis(photo)
+
+    def _analyze_async(self, photo, geocode):
+        with mock.patch('photouploadapi.async_views.geocode_cache') as geocode_cache:
+            geocode_cache.aget_or_fetch = mock.AsyncMock(side_effect=[geocode])
+            async_to_sync(AsyncPhotoViewSet()._aperform_photo_analysis)(photo)
+
+    def _outcomes(self, geocode):
+        """
+        [(status, error)] of the sync and the async analysis when geocoding
+        returns (or raises) `geocode`.
+        """
+        outcomes = []
+        for analyze in (self._analyze_sync, self._analyze_async):
+            photo = Photo.objects.create(user=self.user, gcs_blob_name=f'{analyze.__name__}.jpg',
+                                         gps_latitude=48.858, gps_longitude=2.294)
+            error = None
+            try:
+                analyze(photo, geocode)
+            except Exception as e:
+                error = e
+            photo.refresh_from_db()
+            outcomes.append((photo.processing_status, error and f"{type(error).__name__}: {error}"))
+        return outcomes
+
+    def test_geocoded_photos_complete_with_a_landmark(self):
+        results = [{'formatted_address': 'Paris', 'address_components': [{'long_name': 'France', 'types': ['country']}]}]
+
+        self.assertEqual(self._outcomes(results), [('completed', None)] * 2)
+        self.assertEqual(list(Landmark.objects.values_list('country', flat=True)), ['France', 'France'])
+
+    def test_geocoding_errors_fail_the_photo(self):
+        self.assertEqual(self._outcomes(Exception('upstream 500')),
+                         [('failed', 'Exception: Geocoding failed: upstream 500')] * 2)
+        self.assertEqual(self._outcomes([]),
+                         [('failed', 'ValueError: Geocoding failed: Reverse geocoding returned no results.')] * 2)
+        self.assertFalse(Landmark.objects.exists())
+
+    def test_rate_limited_analysis_goes_back_to_pending(self):
+        outcomes = self._outcomes(RateLimited('geocoding', 30))
+
+        self.assertEqual([status for status, _ in outcomes], ['pending', 'pending'])
+        self.assertTrue(all(error.startswith('RateLimited') for _, error in outcomes))
+
+
+class AsyncStorageClientTests(TestCase):
+
+    def _response(self, status_code, headers=None):
+        return mock.Mock(status_code=status_code, headers=headers or {}, text='')
+
+    @mock.patch('photouploadapi.async_storage.http_client')
+    def test_large_files_go_through_a_resumable_session_in_chunks(self, http_client):
+        chunk = 256 * 1024
+        content = bytes(range(256)) * (chunk * 2 // 256) + b'tail'
+        http_client.apost = mock.AsyncMock(return_value=self._response(200, {'Location': 'https://session'}))
+        # GCS keeps only half of the second chunk, so the rest is resent from there
+        http_client.arequest = mock.AsyncMock(side_effect=[
+            self._response(308, {'Range': f'bytes=0-{chunk - 1}'}),
+            self._response(308, {'Range': f'bytes=0-{chunk + chunk // 2 - 1}'}),
+            self._response(200),
+        ])
+        client = AsyncStorageClient(mock.Mock(valid=True, token='token'))
+
+        asyncio.run(client.upload_file('bucket', 'a.jpg', BytesIO(content), len(content), 'image/jpeg', chunk))
+
+        self.assertEqual(http_client.apost.call_args.kwargs['params']['uploadType'], 'resumable')
+        sent = [(call.kwargs['headers']['Content-Range'], call.kwargs['content']) for call in http_client.arequest.call_args_list]
+        total = len(content)
+        self.assertEqual([content_range for content_range, _ in sent], [
+            f'bytes 0-{chunk - 1}/{total}',
+            f'bytes {chunk}-{chunk * 2 - 1}/{total}',
+            f'bytes {chunk + chunk // 2}-{total - 1}/{total}',
+        ])
+        self.assertEqual(sent[2][1], content[chunk + chunk // 2:])
+
+    @mock.patch('photouploadapi.async_storage.http_client')
+    def test_small_files_are_sent_in_one_request(self, http_client):
+        http_client.apost = mock.AsyncMock(return_value=self._response(200))
+        client = AsyncStorageClient(mock.Mock(valid=True, token='token'))
+
+        asyncio.run(client.upload_file('bucket', 'a.jpg', BytesIO(b'jpeg'), 4, 'image/jpeg', 256 * 1024))
+
+        self.assertEqual(http_client.apost.call_args.kwargs['params']['uploadType'], 'media')
+        self.assertEqual(http_client.apost.call_args.kwargs['content'], b'jpeg')
+
+
+class FinalizeUploadTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='owner', password='password')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        patcher = mock.patch('photouploadapi.views.storage_client')
+        self.bucket = patcher.start().bucket.return_value
+        self.addCleanup(patcher.stop)
+        self.bucket.blob.return_value.generate_signed_url.return_value = 'https://signed'
+        self.bucket.get_blob.return_value = mock.Mock(size=1000, content_type='image/jpeg',
+                                                      download_as_bytes=mock.Mock(return_value=b''))
+        reservation = self.client.post('/api/v1/photos/request_upload/',
+                                       {'filename': 'photo.jpg', 'content_type': 'image/jpeg', 'size': 1000})
+        self.blob_name = reservation.data['gcs_blob_name']
+        self.token = reservation.data['upload_token']
+
+    def _finalize(self):
+        return self.client.post('/api/v1/photos/finalize_upload/', {'upload_token': self.token})
+
+    def test_finalize_registers_the_object_once(self):
+        response = self._finalize()
+
+        self.assertEqual(response.status_code, 202)
+        photo = Photo.objects.get()
+        self.assertEqual(photo.gcs_blob_name, self.blob_name)
+        self.assertTrue(AnalysisJob.objects.filter(photo=photo).exists())
+        self.assertEqual(list(StoredBlob.objects.values_list('gcs_blob_name', 'sha256', 'ref_count')),
+                         [(self.blob_name, None, 1)])
+        self.assertEqual(self._finalize().status_code, 409)
+        self.assertEqual(Photo.objects.count(), 1)
+
+    def test_concurrent_finalize_creates_one_photo(self):
+        # Both requests pass the early check before either has committed
+        with mock.patch.object(PhotoViewSet, '_direct_upload_finalized', return_value=False):
+            self.assertEqual(self._finalize().status_code, 202)
+            self.assertEqual(self._finalize().status_code, 409)
+
+        self.assertEqual(Photo.objects.count(), 1)
+        self.assertFalse(AnalysisJob.objects.exclude(photo__in=Photo.objects.all()).exists())
+
+    def test_deleted_upload_is_purged_and_cannot_be_finalized_again(self):
+        self._finalize()
+
+        delete_photos(Photo.objects.all())
+
+        self.assertEqual(list(BlobTombstone.objects.values_list('gcs_blob_name', flat=True)), [self.blob_name])
+        self.assertEqual(self._finalize().status_code, 409)
+        self.assertFalse(Photo.objects.exists())
+
+    def test_rejects_missing_or_mismatched_objects(self):
+        self.bucket.get_blob.return_value = None
+        self.assertEqual(self._finalize().status_code, 400)
+
+        self.bucket.get_blob.return_value = mock.Mock(size=999, content_type='image/jpeg')
+        self.assertEqual(self._finalize().status_code, 400)
+        self.bucket.blob.return_value.delete.assert_called_once()
+        self.assertFalse(Photo.objects.exists() or StoredBlob.objects.exists())
+
+
+class SignedUrlTests(TestCase):
+
+    def setUp(self):
+        caches['default'].clear()
+        self.bucket = mock.Mock()
+        self.sign = self.bucket.blob.return_value.generate_signed_url
+        self.sign.side_effect = lambda expiration, **kwargs: f"https://signed/{expiration.timestamp():.0f}/{self.sign.call_count}"
+
+    def test_urls_share_expiry_buckets_and_are_reused_until_the_refresh_margin(self):
+        cache = SignedUrlCache(ttl_seconds=3600, bucket_seconds=900, refresh_margin_seconds=300)
+        with mock.patch('time.time', return_value=900_100):
+            url, expires_at = cache.sign(self.bucket, 'a.jpg')
+        # 900_100 + 3600 rounded up to the next 900 s boundary
+        self.assertEqual(expires_at.timestamp(), 904_500)
+        with mock.patch('time.time', return_value=900_800):
+            self.assertEqual(cache.sign_many(self.bucket, ['a.jpg', 'b.jpg'])['b.jpg'][1], expires_at)
+
+        with mock.patch('time.time', return_value=904_500 - 301):
+            self.assertEqual(cache.sign(self.bucket, 'a.jpg'), (url, expires_at))
+        self.assertEqual(self.sign.call_count, 2)
+        with mock.patch('time.time', return_value=904_500 - 299):
+            refreshed, refreshed_expiry = cache.sign(self.bucket, 'a.jpg')
+        self.assertNotEqual(refreshed, url)
+        self.assertGreater(refreshed_expiry, expires_at)
+
+    @mock.patch('photouploadapi.views.storage_client')
+    def test_bulk_signing_is_capped_at_a_gallery_page(self, storage_client):
+        user = User.objects.create_user(username='owner', password='password')
+        client = APIClient()
+        client.force_authenticate(user)
+        photo = Photo.objects.create(user=user, gcs_blob_name='a.jpg')
+        storage_client.bucket.return_value = self.bucket
+
+        response = client.get('/api/v1/photos/signed_urls/', {'ids': f'{photo.pk},{photo.pk}'})
+        self.assertEqual(list(response.data), [str(photo.pk)])
+
+        ids = ','.join(str(photo_id) for photo_id in range(1, 502))
+        self.assertEqual(client.get('/api/v1/photos/signed_urls/', {'ids': ids}).status_code, 400)
+
+
+class UserGalleryTests(TestCase):
+
+    def setUp(self):
+        caches['default'].clear()
+        self.user = User.objects.create_user(username='owner', password='password')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        patcher = mock.patch('photouploadapi.views.storage_client')
+        generate_signed_url = patcher.start().bucket.return_value.blob.return_value.generate_signed_url
+        self.addCleanup(patcher.stop)
+        generate_signed_url.return_value = 'https://signed'
+
+    def test_pages_carry_signed_urls_for_the_requested_size(self):
+        with_thumb = Photo.objects.create(user=self.user, gcs_blob_name='a.jpg',
+                                          derivatives={'thumb': 'derived/thumb/a.jpg.webp'})
+        Photo.objects.create(user=self.user, gcs_blob_name='b.jpg')
+
+        response = self.client.get(f'/api/v1/users/{self.user.id}/gallery/', {'size': 'thumb', 'page_size': 1})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['count'], 2)
+        self.assertIsNotNone(response.data['next'])
+        photo, = response.data['results']
+        self.assertEqual(photo['signed_url'], 'https://signed')
+        older = self.client.get(response.data['next']).data['results'][0]
+        self.assertEqual(older['photo_id'], with_thumb.pk)
+        self.assertTrue(older['gcs_url'].endswith('derived/thumb/a.jpg.webp'))
+
+    def test_other_users_galleries_are_forbidden(self):
+        other = User.objects.create_user(username='other', password='password')
+        Photo.objects.create(user=other, gcs_blob_name='other.jpg')
+
+        response = self.client.get(f'/api/v1/users/{other.id}/gallery/')
+        self.assertEqual(response.status_code, 403)
+
+        self.user.is_staff = True
+        self.user.save()
+        response = self.client.get(f'/api/v1/users/{other.id}/gallery/')
+        self.assertEqual((response.status_code, response.data['count']), (200, 1))
+
+
+class PhotoDeletionTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='owner', password='password')
+        self.shared = [Photo.objects.create(user=self.user, gcs_blob_name='shared.jpg') for _ in range(2)]
+        self.single = Photo.objects.create(user=self.user, gcs_blob_name='single.jpg',
+                                           derivatives={'thumb': 'derived/thumb/single.webp'})
+        StoredBlob.objects.create(sha256='a' * 64, gcs_blob_name='shared.jpg', ref_count=2)
+        StoredBlob.objects.create(sha256='b' * 64, gcs_blob_name='single.jpg')
+
+    def _tombstones(self):
+        return set(BlobTombstone.objects.values_list('gcs_blob_name', flat=True))
+
+    def test_objects_are_tombstoned_once_unreferenced(self):
+        delete_photos(Photo.objects.filter(pk__in=[self.shared[0].pk, self.single.pk]))
+
+        self.assertEqual(self._tombstones(), {'single.jpg', 'derived/thumb/single.webp'})
+        self.assertEqual(StoredBlob.objects.get(gcs_blob_name='shared.jpg').ref_count, 1)
+        self.assertEqual(list(Photo.objects.all()), [self.shared[1]])
+
+    def test_user_deletion_tombstones_photo_objects(self):
+        self.user.delete()
+
+        self.assertEqual(self._tombstones(), {'shared.jpg', 'single.jpg', 'derived/thumb/single.webp'})
+        self.assertFalse(StoredBlob.objects.exists())
+
+    def test_bulk_delete_removes_only_the_users_photos(self):
+        other = Photo.objects.create(user=User.objects.create(username='other'), gcs_blob_name='other.jpg')
+        client = APIClient()
+        client.force_authenticate(self.user)
+
+        response = client.post('/api/v1/photos/bulk_delete/',
+                               {'photo_ids': [self.shared[0].pk, self.single.pk, other.pk]}, format='json')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, {'deleted': sorted([self.shared[0].pk, self.single.pk]), 'not_found': [other.pk]})
+        self.assertEqual(set(Photo.objects.all()), {self.shared[1], other})
+        self.assertEqual(self._tombstones(), {'single.jpg', 'derived/thumb/single.webp'})
+        self.assertEqual(StoredBlob.objects.get(gcs_blob_name='shared.jpg').ref_count, 1)
+
+
+@override_settings(PURGE_LEASE_SECONDS=60, PURGE_RETRY_BACKOFF_SECONDS=10)
+class PurgeTests(TestCase):
+
+    def setUp(self):
+        self.now = timezone.now()
+        for name in ('a.jpg', 'b.jpg', 'c.jpg'):
+            BlobTombstone.objects.create(gcs_blob_name=name, run_after=self.now)
+
+    def _at(self, seconds):
+        return mock.patch('photouploadapi.purge.timezone.now', return_value=self.now + timedelta(seconds=seconds))
+
+    def _purge(self, status_codes):
+        """
+        Claims and purges every due tombstone; the batch answers each
+        deletion with the next of `status_codes`.
+        """
+        bucket = mock.Mock()
+        with self._at(1):
+            tombstones = claim_tombstones(10)
+            with mock.patch('photouploadapi.purge._ResultBatch') as batch_class:
+                batch_class.return_value.__enter__.return_value.results = [
+                    mock.Mock(status_code=code, text='Service Unavailable') for code in status_codes
+                ]
+                purged = purge_tombstones(tombstones, mock.Mock(), bucket)
+        batch_class.assert_called_once_with(mock.ANY, raise_exception=False)
+        self.assertEqual([call.args[0] for call in bucket.delete_blob.call_args_list],
+                         [tombstone.gcs_blob_name for tombstone in tombstones])
+        return purged
+
+    def test_claims_are_leased_until_the_lease_runs_out(self):
+        with self._at(1):
+            self.assertEqual([tombstone.gcs_blob_name for tombstone in claim_tombstones(2)], ['a.jpg', 'b.jpg'])
+            self.assertEqual([tombstone.gcs_blob_name for tombstone in claim_tombstones(10)], ['c.jpg'])
+        with self._at(60):
+            self.assertEqual(claim_tombstones(10), [])
+        with self._at(62):
+            reclaimed = claim_tombstones(10)
+
+        self.assertEqual([(tombstone.gcs_blob_name, tombstone.attempts) for tombstone in reclaimed],
+                         [('a.jpg', 2), ('b.jpg', 2), ('c.jpg', 2)])
+
+    def test_already_deleted_objects_count_as_purged(self):
+        self.assertEqual(self._purge([204, 404, 200]), (3, 0))
+        self.assertFalse(BlobTombstone.objects.exists())
+
+    def test_failed_deletions_are_retried_with_backoff(self):
+        self.assertEqual(self._purge([204, 503, 204]), (2, 1))
+
+        tombstone = BlobTombstone.objects.get()
+        self.assertEqual((tombstone.gcs_blob_name, tombstone.attempts), ('b.jpg', 1))
+        self.assertEqual(tombstone.last_error, '503 Service Unavailable')
+        self.assertEqual(tombstone.run_after, self.now + timedelta(seconds=11))
+        with self._at(2):
+            self.assertEqual(claim_tombstones(10), [])
+
+    def test_failed_batch_request_keeps_every_tombstone(self):
+        bucket = mock.Mock()
+        with self._at(1):
+            tombstones = claim_tombstones(10)
+            with mock.patch('photouploadapi.purge._ResultBatch') as batch_class:
+                batch_class.return_value.__exit__.side_effect = Exception('connection reset')
+                self.assertEqual(purge_tombstones(tombstones, mock.Mock(), bucket), (0, 3))
+
+        self.assertEqual(set(BlobTombstone.objects.values_list('last_error', flat=True)), {'connection reset'})
+
+
+@override_settings(PHOTO_DERIVATIVE_SIZES={'thumb': 400, 'medium': 1280}, PHOTO_DERIVATIVE_FORMAT='WEBP')
+class DerivativeTests(TestCase):
+
+    def _image(self, size, mode='RGB', image_format='JPEG'):
+        buffer = BytesIO()
+        Image.new(mode, size, 'red').save(buffer, image_format)
+        return buffer.getvalue()
+
+    def _opened(self, data):
+        image = Image.open(BytesIO(data))
+        return image.format, image.size
+
+    def test_each_size_is_scaled_to_its_long_edge(self):
+        rendered = render_derivatives(self._image((2000, 1000)))
+
+        self.assertEqual({size: self._opened(data) for size, data in rendered.items()}, {
+            'thumb': ('WEBP', (400, 200)),
+            'medium': ('WEBP', (1280, 640)),
+        })
+
+    def test_small_images_are_not_upscaled(self):
+        rendered = render_derivatives(self._image((300, 200), mode='RGBA', image_format='PNG'), image_format='JPEG')
+
+        self.assertEqual({size: self._opened(data) for size, data in rendered.items()}, {
+            'thumb': ('JPEG', (300, 200)),
+            'medium': ('JPEG', (300, 200)),
+        })
+
+    def test_blob_names_are_per_size_and_format(self):
+        self.assertEqual(derivative_blob_name('user_1/a.jpg', 'thumb'), 'derived/thumb/user_1/a.jpg.webp')
+        self.assertEqual(derivative_blob_name('user_1/a.jpg', 'medium', 'JPEG'), 'derived/medium/user_1/a.jpg.jpg')
+
+    def test_generated_derivatives_are_uploaded_and_recorded(self):
+        photo = Photo.objects.create(user=User.objects.create(username='owner'), gcs_blob_name='user_1/a.jpg')
+        bucket = mock.Mock()
+        blobs = {}
+        bucket.blob.side_effect = lambda name: blobs.setdefault(name, mock.Mock())
+        bucket.blob('user_1/a.jpg').download_as_bytes.return_value = self._image((2000, 1500))
+
+        generate_derivatives(photo, bucket)
+
+        expected = {'thumb': 'derived/thumb/user_1/a.jpg.webp', 'medium': 'derived/medium/user_1/a.jpg.webp'}
+        self.assertEqual(Photo.objects.get(pk=photo.pk).derivatives, expected)
+        for size, blob_name in expected.items():
+            data = blobs[blob_name].upload_from_string.call_args.args[0]
+            self.assertEqual(blobs[blob_name].upload_from_string.call_args.kwargs, {'content_type': 'image/webp'})
+            self.assertEqual(max(self._opened(data)[1]), {'thumb': 400, 'medium': 1280}[size])
+
+    def test_missing_derivatives_fall_back_to_the_original(self):
+        photo = Photo(gcs_blob_name='a.jpg', derivatives={'thumb': 'derived/thumb/a.jpg.webp'})
+
+        self.assertEqual(photo.blob_name_for_size('thumb'), 'derived/thumb/a.jpg.webp')
+        self.assertEqual(photo.blob_name_for_size('medium'), 'a.jpg')
+        self.assertEqual(photo.blob_name_for_size('original'), 'a.jpg')
+        self.assertEqual(photo.blob_name_for_size(None), 'a.jpg')
+
+    @mock.patch('photouploadapi.views.storage_client')
+    def test_signed_urls_are_for_the_requested_size(self, storage_client):
+        caches['default'].clear()
+        user = User.objects.create_user(username='owner', password='password')
+        client = APIClient()
+        client.force_authenticate(user)
+        photo = Photo.objects.create(user=user, gcs_blob_name='a.jpg', derivatives={'thumb': 'derived/thumb/a.jpg.webp'})
+        bucket = storage_client.bucket.return_value
+        bucket.blob.side_effect = lambda name: mock.Mock(**{'generate_signed_url.return_value': f'https://signed/{name}'})
+
+        response = client.get(f'/api/v1/photos/{photo.pk}/signed_url/', {'size': 'thumb'})
+        self.assertEqual(response.data['signed_url'], 'https://signed/derived/thumb/a.jpg.webp')
+        response = client.get('/api/v1/photos/signed_urls/', {'ids': photo.pk, 'size': 'medium'})
+        self.assertEqual(response.data[str(photo.pk)]['signed_url'], 'https://signed/a.jpg')
+
+        for url in (f'/api/v1/photos/{photo.pk}/signed_url/', '/api/v1/photos/signed_urls/',
+                    f'/api/v1/users/{user.id}/gallery/'):
+            response = client.get(url, {'ids': photo.pk, 'size': 'huge'})
+            self.assertEqual(response.status_code, 400, url)
+            self.assertIn('size', response.data)
+
+    def test_deletes_without_checking_existence(self):
+        bucket = mock.Mock()
+        bucket.blob.return_value.delete.side_effect = [None, NotFound('gone')]
+
+        delete_derivatives(Photo(derivatives={'thumb': 'derived/thumb/a.webp', 'medium': 'derived/medium/a.webp'}),
+                           bucket)
+
+        self.assertEqual(bucket.blob.return_value.delete.call_count, 2)
+        bucket.blob.return_value.exists.assert_not_called()
+
+
+class UserStatsTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='owner', password='password')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def _analyze(self, photo, name, country):
+        photo.processing_status = 'completed'
+        photo.save()
+        Landmark.objects.update_or_create(photo=photo, defaults={'detected_landmark_name': name, 'country': country})
+
+    def _summary(self):
+        return (
+            sorted(UserPhotoStats.objects.values_list('user_id', 'pending', 'processing', 'completed', 'failed')),
+            sorted(UserPlaceStats.objects.values_list('user_id', 'kind', 'name', 'photo_count')),
+        )
+
+    def test_summary_follows_analysis_and_deletion(self):
+        photos = [Photo.objects.create(user=self.user, gcs_blob_name=f'{i}.jpg') for i in range(4)]
+        self._analyze(photos[0], 'Eiffel Tower', 'France')
+        self._analyze(photos[1], 'Eiffel Tower', 'France')
+        self._analyze(photos[2], 'Big Ben', 'United Kingdom')
+        self._analyze(photos[2], 'Louvre', 'France')
+        delete_photos(Photo.objects.filter(pk=photos[0].pk))
+
+        # The owner lookup, then one read per summary table section
+        with self.assertNumQueries(4):
+            response = self.client.get(f'/api/v1/users/{self.user.id}/stats/')
+        self.assertEqual(response.json(), {
+            'counts': {'pending': 1, 'processing': 0, 'completed': 2, 'failed': 0, 'total': 3},
+            'countries_visited': [{'name': 'France', 'photos': 2}],
+            'top_landmarks': [{'name': 'Eiffel Tower', 'photos': 1}, {'name': 'Louvre', 'photos': 1}],
+        })
+
+        incremental = self._summary()
+        rebuild_user_stats([self.user.id])
+        self.assertEqual(self._summary(), incremental)
+
+    def test_deleted_landmarks_are_uncounted(self):
+        photos = [Photo.objects.create(user=self.user, gcs_blob_name=f'{i}.jpg') for i in range(4)]
+        self._analyze(photos[0], 'Eiffel Tower', 'France')
+        self._analyze(photos[1], 'Eiffel Tower', 'France')
+        self._analyze(photos[2], 'Big Ben', 'United Kingdom')
+        self._analyze(photos[3], 'Louvre', 'France')
+
+        Landmark.objects.get(photo=photos[0]).delete()
+        Landmark.objects.filter(photo__in=photos[2:]).delete()
+        delete_photos(Photo.objects.filter(pk=photos[1].pk))
+
+        self.assertEqual(UserPlaceStats.objects.count(), 0)
+        incremental = self._summary()
+        rebuild_user_stats([self.user.id])
+        self.assertEqual(self._summary(), incremental)
+
+
+class SpatialQueryTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='owner', password='password')
+        self.places = {}
+        for name, latitude, longitude in [('eiffel', 48.8584, 2.2945), ('louvre', 48.8606, 2.3376),
+                                          ('fiji_east', -16.5, 179.9), ('fiji_west', -16.5, -179.9)]:
+            photo = Photo.objects.create(user=self.user, gcs_blob_name=f'{name}.jpg')
+            Landmark.objects.update_or_create(photo=photo, defaults={
+                'detected_landmark_name': name, 'latitude': latitude, 'longitude': longitude,
+            })
+            self.places[name] = photo.id
+        other = Photo.objects.create(user=User.objects.create(username='other'), gcs_blob_name='other.jpg')
+        Landmark.objects.create(photo=other, latitude=48.86, longitude=2.3)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def _names(self, response):
+        return {row['detected_landmark_name'] for row in response.json()['results']}
+
+    def test_geohash_is_kept_in_sync_on_save(self):
+        self.assertEqual(geohash_encode(57.64911, 10.40744, 11), 'u4pruydqqvj')
+        self.assertEqual(Landmark.objects.get(photo_id=self.places['eiffel']).geohash, geohash_encode(48.8584, 2.2945))
+
+    def test_bbox_crossing_the_antimeridian(self):
+        response = self.client.get('/api/v1/photos/within/', {'bbox': '-20,179,-10,-179'})
+
+        self.assertEqual(self._names(response), {'fiji_east', 'fiji_west'})
+
+    def test_near_orders_by_exact_distance(self):
+        response = self.client.get('/api/v1/photos/within/', {'near': '48.8584,2.2945', 'radius': '4'})
+
+        self.assertEqual([row['detected_landmark_name'] for row in response.json()['results']], ['eiffel', 'louvre'])
+        self.assertAlmostEqual(response.json()['results'][1]['distance_km'], 3.16, places=1)
+        response = self.client.get('/api/v1/photos/within/', {'near': '48.8584,2.2945', 'radius': '3'})
+        self.assertEqual(self._names(response), {'eiffel'})
+
+    def test_clusters_aggregate_per_zoom_level(self):
+        url = f'/api/v1/users/{self.user.id}/clusters/'
+
+        clusters = self.client.get(url, {'zoom': '3'}).json()['clusters']
+        self.assertEqual([cluster['count'] for cluster in clusters], [2, 1, 1])
+        self.assertEqual(clusters[0]['photo_id'], self.places['louvre'])
+        self.assertAlmostEqual(clusters[0]['latitude'], (48.8584 + 48.8606) / 2)
+
+        clusters = self.client.get(url, {'zoom': '16', 'bbox': '48,2,49,3'}).json()['clusters']
+        self.assertEqual(sorted(cluster['photo_id'] for cluster in clusters),
+                         [self.places['eiffel'], self.places['louvre']])
+
+    def test_rejects_malformed_queries(self):
+        self.assertEqual(self.client.get('/api/v1/photos/within/', {'bbox': '1,2,3'}).status_code, 400)
+        self.assertEqual(self.client.get('/api/v1/photos/within/', {'near': '1,2'}).status_code, 400)
+
+    @override_settings(SPATIAL_QUERY_MAX_RESULTS=3)
+    def test_limit_must_be_within_range(self):
+        for limit in ('-5', '0', '4', 'ten'):
+            response = self.client.get('/api/v1/photos/within/', {'bbox': '-90,-180,90,180', 'limit': limit})
+            self.assertEqual(response.status_code, 400, limit)
+
+        response = self.client.get('/api/v1/photos/within/', {'bbox': '-90,-180,90,180', 'limit': '1'})
+        self.assertEqual((len(response.json()['results']), response.json()['truncated']), (1, True))
+        response = self.client.get('/api/v1/photos/within/', {'bbox': '-90,-180,90,180'})
+        self.assertEqual((len(response.json()['results']), response.json()['truncated']), (3, True))
+
+
+class ReconcileStorageTests(TestCase):
+
+    def test_sorted_merge_finds_orphans_in_both_directions(self):
+        user = User.objects.create_user(username='owner', password='password')
+        for name in ['user_1/B.jpg', 'user_1/a.jpg', 'user_1/\u00e4.jpg', 'user_1/\u00e4.jpg']:
+            Photo.objects.create(user=user, gcs_blob_name=name)
+        StoredBlob.objects.create(sha256='a' * 64, gcs_blob_name='user_1/s.jpg')
+        BlobTombstone.objects.create(gcs_blob_name='user_1/t.jpg')
+        objects = [(name, None) for name in sorted(['user_1/B.jpg', 'user_1/Z.jpg', 'user_1/t.jpg', 'user_1/\u00e4.jpg'])]
+
+        findings = [(kind, name) for kind, name, _ in reconcile(objects, database_records('user_'))]
+
+        self.assertEqual(findings, [
+            ('orphan_object', 'user_1/Z.jpg'),
+            ('missing_object', 'user_1/a.jpg'),
+            ('missing_object', 'user_1/s.jpg'),
+        ])
+
+    @mock.patch('photouploadapi.management.commands.reconcile_storage.storage_client')
+    def test_refuses_prefixes_outside_the_originals(self, storage_client):
+        for prefix in ('derived/', ''):
+            with self.assertRaises(CommandError):
+                call_command('reconcile_storage', prefix=prefix, repair=True, stdout=StringIO())
+
+        storage_client.list_blobs.assert_not_called()
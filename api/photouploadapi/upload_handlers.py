@@ -0,0 +1,113 @@
+import hashlib
+import uuid
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+from django.core.files.uploadhandler import FileUploadHandler, SkipFile, StopFutureHandlers
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+
+# GCS resumable uploads take chunks in multiples of 256 KiB.
+GCS_CHUNK_GRANULARITY = 256 * 1024
+
+
+class UploadTooLarge(APIException):
+    status_code = status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+    default_detail = "The photo is larger than the upload limit."
+    default_code = 'upload_too_large'
+
+
+class GCSUploadedFile(UploadedFile):
+    """
+    A file that was streamed straight into GCS while the request arrived.
+
+    Only the first `head` bytes are kept in memory (enough for format
+    sniffing); the content itself lives at `gcs_blob_name`.
+    """
+
+    def __init__(self, gcs_blob_name, head, sha256, name, content_type, size, charset=None):
+        super().__init__(BytesIO(head), name, content_type, size, charset)
+        self.gcs_blob_name = gcs_blob_name
+        self.head = head
+        self.sha256 = sha256
+
+
+class GCSStreamingUploadHandler(FileUploadHandler):
+    """
+    Pipes the 'image' multipart field into a GCS resumable upload session as
+    the request body is read, hashing and counting bytes on the way.
+
+    Memory per request is bounded by the session's chunk buffer plus the
+    sniffed header, regardless of the file size. Uploads larger than
+    MAX_PHOTO_UPLOAD_BYTES are aborted with UploadTooLarge (413).
+    """
+
+    chunk_size = GCS_CHUNK_GRANULARITY
+
+    def __init__(self, request, bucket, field_name='image'):
+        super().__init__(request)
+        self.bucket = bucket
+        self.accepted_field_name = field_name
+        self.blob = None
+        self.writer = None
+
+    def new_file(self, field_name, file_name, content_type, content_length, charset=None, content_type_extra=None):
+        super().new_file(field_name, file_name, content_type, content_length, charset, content_type_extra)
+        if field_name != self.accepted_field_name or self.writer is not None:
+            raise SkipFile()
+
+        self.blob = self.bucket.blob(f"user_{self.request.user.id}/{uuid.uuid4()}_{file_name}")
+        self.writer = self.blob.open(
+            'wb',
+            chunk_size=settings.UPLOAD_STREAM_CHUNK_BYTES,
+            content_type=content_type,
+            ignore_flush=True,
+        )
+        self.hasher = hashlib.sha256()
+        self.head = b''
+        self.received = 0
+        raise StopFutureHandlers()
+
+    def receive_data_chunk(self, raw_data, start):
+        self.received += len(raw_data)
+        if self.received > settings.MAX_PHOTO_UPLOAD_BYTES:
+            self.upload_interrupted()
+            raise UploadTooLarge(f"Photos are limited to {settings.MAX_PHOTO_UPLOAD_BYTES} bytes.")
+
+        self.hasher.update(raw_data)
+        if len(self.head) < settings.UPLOAD_SNIFF_BYTES:
+            self.head += raw_data[:settings.UPLOAD_SNIFF_BYTES - len(self.head)]
+        self.writer.write(raw_data)
+        return None
+
+    def file_complete(self, file_size):
+        self.writer.close()
+        return GCSUploadedFile(
+            gcs_blob_name=self.blob.name,
+            head=self.head,
+            sha256=self.hasher.hexdigest(),
+            name=self.file_name,
+            content_type=self.content_type,
+            size=file_size,
+            charset=self.charset,
+        )
+
+    def upload_interrupted(self):
+        # Nothing is committed in GCS until the session is finalized by close(),
+        # and unfinished sessions expire on their own.
+        self.writer = None
+
+
+def install_streaming_upload_handler(request, bucket):
+    """
+    Makes the request stream its image straight to `bucket`. Returns False
+    when the body was already parsed (e.g. by the CSRF check of session
+    auth), in which case the regular buffered upload path applies.
+    """
+    django_request = getattr(request, '_request', request)
+    if hasattr(django_request, '_files'):
+        return False
+    django_request.upload_handlers = [GCSStreamingUploadHandler(django_request, bucket)]
+    return True
@@ -1,7 +1,12 @@
 # myapi/urls.py
+from django.conf import settings
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import PhotoViewSet, list_user_photos, hello, db_check
+from .views import PhotoViewSet, list_user_photos, user_gallery, user_photo_clusters, user_photo_stats, hello, db_check, metrics
+
+if settings.ASYNC_VIEWS:
+    # Native async upload/analysis/signing when served over ASGI
+    from .async_views import AsyncPhotoViewSet as PhotoViewSet
 
 router = DefaultRouter()
 router.register(r'photos', PhotoViewSet, basename='photo')
@@ -10,6 +15,10 @@ router.register(r'photos', PhotoViewSet, basename='photo')
 urlpatterns = [
     path('hello/', hello, name='hello'),
     path('db_check/', db_check, name='db_check'),
+    path('metrics/', metrics, name='metrics'),
     path('', include(router.urls)),
     path('users/<int:user_id>/photos/', list_user_photos, name='user-photos-list'),
+    path('users/<int:user_id>/gallery/', user_gallery, name='user-gallery'),
+    path('users/<int:user_id>/clusters/', user_photo_clusters, name='user-photo-clusters'),
+    path('users/<int:user_id>/stats/', user_photo_stats, name='user-photo-stats'),
 ]
\ No newline at end of file
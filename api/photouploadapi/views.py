@@ -1,20 +1,42 @@
 from django.http import JsonResponse
-from django.db import connection
+from django.db import IntegrityError, connection, connections, transaction
 from rest_framework import viewsets, status, generics
 from rest_framework.response import Response
 from rest_framework.decorators import action, api_view, permission_classes
-from rest_framework.permissions import IsAuthenticated, AllowAny
-from .models import Photo, Landmark
-from .serializers import PhotoSerializer, PhotoUploadSerializer, LandmarkSerializer
+from rest_framework.exceptions import APIException, ValidationError
+from rest_framework.permissions import IsAuthenticated, IsAdminUser, AllowAny
+from .models import BlobTombstone, Photo, Landmark, StoredBlob
+from .serializers import PhotoSerializer, PhotoUploadSerializer, LandmarkSerializer, UploadRequestSerializer, UploadFinalizeSerializer, GalleryPhotoSerializer, BulkDeleteSerializer
+from .pagination import GalleryPagination, PhotoKeysetPagination
+from .jobs import enqueue_analysis, enqueue_analyses, enqueue_derivatives, enqueue_reanalysis
+from .analysis import VISION_INPUT_MODES, content_image, detect_landmarks, gcs_image, uri_image, vision_batcher
+from .geocache import geocode_cache
+from .outbound import http_client
+from .blobs import (
+    sha256_of_upload, acquire_existing_blob, acquire_existing_blobs, drop_references, register_blob, register_blobs,
+    register_direct_upload,
+)
+from .upload_handlers import GCSUploadedFile, UploadTooLarge, install_streaming_upload_handler
+from .signed_urls import signed_url_cache
+from .derivatives import available_sizes, generate_derivatives, delete_derivatives, upload_derivatives
+from .exif import read_exif_fields
+from .purge import delete_photos
+from .geo import bbox_filter, cluster_cell_degrees, grid_clusters
+from .stats import record_landmarks_created, record_photos_created, record_status_changes, user_stats
+from .ratelimit import RateLimited, geocoding_rate_limit, rate_limit_stats
 from django.shortcuts import get_object_or_404
 from django.contrib.auth import get_user_model
 from django.conf import settings
+from django.core import signing
+from django.core.exceptions import ImproperlyConfigured
+import math
 import os
 from google.cloud import storage, vision
-import googlemaps 
 import uuid
-import requests
 from datetime import timedelta
+from concurrent.futures import ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from itertools import repeat
 from django.utils import timezone
 import traceback
 
@@ -24,6 +46,10 @@ User = get_user_model()
 PHOTOS_BUCKET_NAME = os.environ.get("PHOTOS_BUCKET_NAME", "your-gcs-photos-bucket-name")
 VISION_API_KEY = os.environ.get("VISION_API_KEY")
 GEOCODING_API_KEY = os.environ.get("GEOCODING_API_KEY")
+GEOCODING_URL = "https://maps.googleapis.com/maps/api/geocode/json"
+UPLOAD_TOKEN_SALT = "photouploadapi.direct-upload"
+# Reverse-geocoding result types that name a place rather than an address
+PLACE_RESULT_TYPES = {'point_of_interest', 'establishment', 'natural_feature', 'park', 'tourist_attraction'}
 
 
 # storage_client = storage.Client()
@@ -31,7 +57,46 @@ key_path = os.path.join(os.path.dirname(__file__), '../keys/photoupload-457815-a
 storage_client = storage.Client.from_service_account_json(key_path)
 
 vision_client = vision.ImageAnnotatorClient()
-gmaps_client = googlemaps.Client(key=GEOCODING_API_KEY)
+
+inline_analysis_pool = ThreadPoolExecutor(max_workers=settings.UPLOAD_INLINE_ANALYSIS_THREADS,
+                                          thread_name_prefix='inline-analysis')
+
+
+def _closing_connections(func, *args):
+    # Pool threads outlive the request, so they must not keep database connections open
+    try:
+        return func(*args)
+    finally:
+        connections.close_all()
+
+def requested_size(request):
+    """
+    The `size` query parameter (a PHOTO_DERIVATIVE_SIZES name or 'original').
+    """
+    size = request.query_params.get('size', 'original')
+    if size not in available_sizes():
+        raise ValidationError({"size": f"Must be one of: {', '.join(available_sizes())}."})
+    return size
+
+def parse_coordinates(value, count):
+    """
+    `count` comma-separated floats from a query parameter; ValueError if
+    there are not exactly that many.
+    """
+    numbers = [float(number) for number in value.split(',')]
+    if len(numbers) != count or not all(math.isfinite(number) for number in numbers):
+        raise ValueError(value)
+    return numbers
+
+def parse_bbox(value):
+    """
+    A `south,west,north,east` query parameter; west > east crosses the
+    antimeridian.
+    """
+    south, west, north, east = parse_coordinates(value, 4)
+    if not (-90 <= south <= north <= 90 and -180 <= west <= 180 and -180 <= east <= 180):
+        raise ValueError(value)
+    return south, west, north, east
 
 def db_check(request):
     try:
@@ -50,15 +115,30 @@ def db_check(request):
 def hello(request):
     return JsonResponse({"message": "Hello from Django API!"})
 
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def metrics(request):
+    """
+    GET /api/v1/metrics/
+    In-process counters of this API worker's caches and batchers.
+    """
+    return Response({
+        "vision_batches": vision_batcher.stats(),
+        "geocode_cache": geocode_cache.stats(),
+        "signed_url_cache": signed_url_cache.stats(),
+        "outbound_http": http_client.stats(),
+        "rate_limits": rate_limit_stats(),
+    })
+
 
 class PhotoViewSet(viewsets.GenericViewSet):
-    queryset = Photo.objects.all()
+    queryset = Photo.objects.with_details()
     serializer_class = PhotoSerializer
     permission_classes = [IsAuthenticated]
 
     def get_queryset(self):
         if not self.request.user.is_staff:
-            return Photo.objects.filter(user=self.request.user).order_by('-upload_time')
+            return Photo.objects.with_details().filter(user=self.request.user).order_by('-upload_time')
         return super().get_queryset()
 
     @action(detail=False, methods=['post'], serializer_class=PhotoUploadSerializer, url_path='upload_photo')
@@ -67,48 +147,568 @@ class PhotoViewSet(viewsets.GenericViewSet):
         POST /api/v1/photos/upload_photo/
         Allows users to upload a photo. The request will contain an image file.
         The image is stored in Google Cloud Storage, and metadata in Cloud SQL.
+        Landmark analysis is queued for the background worker, so the photo
+        is returned as 'pending' with 202 Accepted. Re-uploads of identical
+        bytes share the stored object and reuse the earlier analysis (201).
         """
-        serializer = PhotoUploadSerializer(data=request.data)
+        bucket = storage_client.bucket(PHOTOS_BUCKET_NAME)
+        if not settings.UPLOAD_INLINE_ANALYSIS:
+            # Pipe the file into GCS while the body is still arriving
+            install_streaming_upload_handler(request, bucket)
+        try:
+            data = request.data
+        except APIException:
+            raise
+        except Exception as e:
+            return Response({"error": "Failed to upload image to GCS.", "details": str(e)},
+                            status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+        serializer = PhotoUploadSerializer(data=data)
         if not serializer.is_valid():
+            streamed_file = data.get('image')
+            if isinstance(streamed_file, GCSUploadedFile):
+                self._delete_blob_quietly(streamed_file.gcs_blob_name)
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
         image_file = serializer.validated_data['image']
+        if image_file.size > settings.MAX_PHOTO_UPLOAD_BYTES:
+            # Streamed uploads are cut off while they arrive; buffered ones are checked here
+            raise UploadTooLarge(f"Photos are limited to {settings.MAX_PHOTO_UPLOAD_BYTES} bytes.")
         original_filename = image_file.name
-        
-        gcs_blob_name = f"user_{request.user.id}/{uuid.uuid4()}_{original_filename}"
 
+        # Header-only EXIF read: GPS lets analysis skip Vision and geocode directly
+        if isinstance(image_file, GCSUploadedFile):
+            exif_fields = read_exif_fields(image_file.head)
+        else:
+            exif_fields = read_exif_fields(image_file.read(settings.UPLOAD_SNIFF_BYTES))
+            image_file.seek(0)
+
+        if isinstance(image_file, GCSUploadedFile):
+            content_sha256 = image_file.sha256
+            uploaded_blob_name = image_file.gcs_blob_name
+        else:
+            content_sha256 = sha256_of_upload(image_file)
+            uploaded_blob_name = None
+            # Identical bytes are stored once; only new content is uploaded
+            if not StoredBlob.objects.filter(sha256=content_sha256).exists():
+                if settings.UPLOAD_INLINE_ANALYSIS:
+                    return self._upload_with_inline_analysis(request, bucket, image_file, content_sha256, exif_fields)
+                uploaded_blob_name = f"user_{request.user.id}/{uuid.uuid4()}_{original_filename}"
+                try:
+                    bucket.blob(uploaded_blob_name).upload_from_file(image_file.file, content_type=image_file.content_type)
+                except Exception as e:
+                    return Response({"error": "Failed to upload image to GCS.", "details": str(e)},
+                                    status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+        return self._save_uploaded_photo(request, bucket, image_file, content_sha256, uploaded_blob_name, exif_fields)
+
+    @action(detail=False, methods=['post'], serializer_class=UploadRequestSerializer, url_path='request_upload')
+    def request_upload(self, request):
+        """
+        POST /api/v1/photos/request_upload/
+        Reserves a blob name and returns a V4 signed PUT URL (or POST policy)
+        so the client can upload the photo straight to the bucket. Call
+        finalize_upload with the returned upload_token afterwards.
+        """
+        serializer = UploadRequestSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        data = serializer.validated_data
+
+        gcs_blob_name = f"user_{request.user.id}/{uuid.uuid4()}_{data['filename']}"
+        expiration = timedelta(seconds=settings.DIRECT_UPLOAD_URL_EXPIRY_SECONDS)
         try:
             bucket = storage_client.bucket(PHOTOS_BUCKET_NAME)
-            blob = bucket.blob(gcs_blob_name)
-            blob.upload_from_file(image_file.file, content_type=image_file.content_type)
+            if data['method'] == 'PUT':
+                upload = {
+                    "method": "PUT",
+                    "url": bucket.blob(gcs_blob_name).generate_signed_url(
+                        expiration=expiration,
+                        method='PUT',
+                        content_type=data['content_type'],
+                        version='v4'
+                    ),
+                    "headers": {"Content-Type": data['content_type']},
+                }
+            else:
+                policy = storage_client.generate_signed_post_policy_v4(
+                    PHOTOS_BUCKET_NAME,
+                    gcs_blob_name,
+                    expiration=expiration,
+                    conditions=[
+                        ["content-length-range", data['size'], data['size']],
+                        ["eq", "$Content-Type", data['content_type']],
+                    ],
+                    fields={"Content-Type": data['content_type']},
+                )
+                upload = {"method": "POST", "url": policy["url"], "fields": policy["fields"]}
         except Exception as e:
-            return Response({"error": "Failed to upload image to GCS.", "details": str(e)},
+            print(traceback.format_exc())
+            return Response({"error": "Failed to generate signed upload URL.", "details": str(e)},
+                            status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+        upload_token = signing.dumps({
+            "user_id": request.user.id,
+            "gcs_blob_name": gcs_blob_name,
+            "original_filename": data['filename'],
+            "content_type": data['content_type'],
+            "size": data['size'],
+        }, salt=UPLOAD_TOKEN_SALT)
+        return Response({
+            "upload": upload,
+            "gcs_blob_name": gcs_blob_name,
+            "upload_token": upload_token,
+            "expires_in": settings.DIRECT_UPLOAD_URL_EXPIRY_SECONDS,
+        }, status=status.HTTP_201_CREATED)
+
+    @action(detail=False, methods=['post'], serializer_class=UploadFinalizeSerializer, url_path='finalize_upload')
+    def finalize_upload(self, request):
+        """
+        POST /api/v1/photos/finalize_upload/
+        Checks that the object reserved by request_upload exists with the
+        announced size and type, then registers it as a StoredBlob, creates
+        the Photo and queues analysis. A token can be finalized only once;
+        repeated or concurrent calls get 409.
+        """
+        serializer = UploadFinalizeSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            reservation = signing.loads(
+                serializer.validated_data['upload_token'],
+                salt=UPLOAD_TOKEN_SALT,
+                max_age=settings.DIRECT_UPLOAD_URL_EXPIRY_SECONDS * 2,
+            )
+        except signing.BadSignature:
+            return Response({"error": "Invalid or expired upload token."}, status=status.HTTP_400_BAD_REQUEST)
+        if reservation["user_id"] != request.user.id:
+            return Response({"error": "Invalid or expired upload token."}, status=status.HTTP_400_BAD_REQUEST)
+
+        gcs_blob_name = reservation["gcs_blob_name"]
+        if self._direct_upload_finalized(gcs_blob_name):
+            return Response({"error": "Upload was already finalized."}, status=status.HTTP_409_CONFLICT)
+
+        try:
+            blob = storage_client.bucket(PHOTOS_BUCKET_NAME).get_blob(gcs_blob_name)
+        except Exception as e:
+            return Response({"error": "Failed to check uploaded object.", "details": str(e)},
+                            status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        if blob is None:
+            return Response({"error": "The photo has not been uploaded yet."}, status=status.HTTP_400_BAD_REQUEST)
+        if blob.size != reservation["size"] or blob.content_type != reservation["content_type"]:
+            self._delete_blob_quietly(gcs_blob_name)
+            return Response({"error": "Uploaded object does not match the requested size or type."},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            # A ranged read of the metadata segments only
+            exif_fields = read_exif_fields(blob.download_as_bytes(start=0, end=settings.UPLOAD_SNIFF_BYTES - 1))
+        except Exception as e:
+            print(f"Failed to read EXIF of {gcs_blob_name}: {e}")
+            exif_fields = {}
+
+        # No server-side digest for direct uploads, so they are not deduplicated
+        try:
+            with transaction.atomic():
+                # The unique StoredBlob row lets only one of concurrent finalizes through
+                register_direct_upload(gcs_blob_name)
+                photo = Photo.objects.create(
+                    user=request.user,
+                    gcs_blob_name=gcs_blob_name,
+                    size_bytes=blob.size,
+                    original_filename=reservation["original_filename"],
+                    processing_status='pending',
+                    **exif_fields
+                )
+                enqueue_analysis(photo)
+        except IntegrityError:
+            return Response({"error": "Upload was already finalized."}, status=status.HTTP_409_CONFLICT)
+
+        return Response({
+            "photo": PhotoSerializer(photo).data,
+        }, status=status.HTTP_202_ACCEPTED)
+
+    @action(detail=False, methods=['post'], url_path='upload_photos')
+    def upload_photos(self, request):
+        """
+        POST /api/v1/photos/upload_photos/
+        Uploads many photos (repeated 'images' multipart field, up to
+        BULK_UPLOAD_MAX_FILES) in one request. New content is written to GCS
+        BULK_UPLOAD_CONCURRENCY files at a time, rows are bulk-inserted and
+        analysis is queued in one batch. Returns a manifest with one entry
+        per file, in request order; 207 Multi-Status if any file failed.
+        Requests over BULK_UPLOAD_MAX_BYTES are refused with 413.
+        """
+        too_large = UploadTooLarge(f"Batch uploads are limited to {settings.BULK_UPLOAD_MAX_BYTES} bytes.")
+        if int(request.META.get('CONTENT_LENGTH') or 0) > settings.BULK_UPLOAD_MAX_BYTES:
+            # Refused before the body is read
+            raise too_large
+        image_files = request.FILES.getlist('images')
+        if not image_files:
+            return Response({"images": ["No files were submitted."]}, status=status.HTTP_400_BAD_REQUEST)
+        if len(image_files) > settings.BULK_UPLOAD_MAX_FILES:
+            return Response({"images": [f"At most {settings.BULK_UPLOAD_MAX_FILES} files per request."]},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if sum(image_file.size for image_file in image_files) > settings.BULK_UPLOAD_MAX_BYTES:
+            # Chunked bodies carry no Content-Length
+            raise too_large
+
+        manifest = [{"index": index, "filename": image_file.name} for index, image_file in enumerate(image_files)]
+        bucket = storage_client.bucket(PHOTOS_BUCKET_NAME)
+        with ThreadPoolExecutor(max_workers=settings.BULK_UPLOAD_CONCURRENCY, thread_name_prefix='bulk-upload') as pool:
+            # Image validation, hashing and the EXIF read are CPU work on each file
+            prepared = list(pool.map(self._prepare_bulk_file, image_files))
+            valid = []
+            for entry, (image_file, errors, content_sha256, exif_fields) in zip(manifest, prepared):
+                if errors:
+                    entry.update(status='invalid', errors=errors)
+                else:
+                    valid.append((entry, image_file, content_sha256, exif_fields))
+
+            # Identical bytes are stored once, also within the batch
+            digest_counts = {}
+            for _, _, content_sha256, _ in valid:
+                digest_counts[content_sha256] = digest_counts.get(content_sha256, 0) + 1
+            blob_names = acquire_existing_blobs(digest_counts)
+            reused_digests = set(blob_names)
+
+            new_files = {}
+            for _, image_file, content_sha256, _ in valid:
+                if content_sha256 not in blob_names:
+                    new_files.setdefault(content_sha256, image_file)
+            uploaded = {
+                content_sha256: f"user_{request.user.id}/{uuid.uuid4()}_{image_file.name}"
+                for content_sha256, image_file in new_files.items()
+            }
+            upload_errors = dict(zip(new_files, pool.map(
+                self._upload_bulk_file, repeat(bucket), uploaded.values(), new_files.values()
+            )))
+
+        for content_sha256, error in upload_errors.items():
+            if error is not None:
+                del uploaded[content_sha256]
+        pending = []
+        for entry, image_file, content_sha256, exif_fields in valid:
+            if upload_errors.get(content_sha256) is not None:
+                entry.update(status='failed', error=f"Failed to upload image to GCS: {upload_errors[content_sha256]}")
+            else:
+                pending.append((entry, image_file, content_sha256, exif_fields))
+
+        duplicates = []
+        try:
+            with transaction.atomic():
+                registered = register_blobs({
+                    content_sha256: (gcs_blob_name, digest_counts[content_sha256])
+                    for content_sha256, gcs_blob_name in uploaded.items()
+                })
+                duplicates = [name for content_sha256, name in uploaded.items() if registered[content_sha256] != name]
+                blob_names.update(registered)
+
+                photos = Photo.objects.bulk_create([
+                    Photo(
+                        user=request.user,
+                        gcs_blob_name=blob_names[content_sha256],
+                        content_sha256=content_sha256,
+                        size_bytes=image_file.size,
+                        original_filename=image_file.name,
+                        processing_status='pending',
+                        **exif_fields
+                    )
+                    for _, image_file, content_sha256, exif_fields in pending
+                ])
+                record_photos_created(photos)
+                analyzed = self._reuse_previous_analyses(
+                    [photo for photo in photos if photo.content_sha256 in reused_digests]
+                )
+                enqueue_analyses([photo for photo in photos if photo.pk not in analyzed])
+        except Exception as e:
+            print(traceback.format_exc())
+            for gcs_blob_name in uploaded.values():
+                self._delete_blob_quietly(gcs_blob_name)
+            drop_references({content_sha256: digest_counts[content_sha256] for content_sha256 in reused_digests})
+            return Response({"error": "Failed to save photos.", "details": str(e)},
                             status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-        photo = Photo.objects.create(
-            user=request.user,
-            gcs_blob_name=gcs_blob_name,
-            original_filename=original_filename,
-            processing_status='pending'
+        for gcs_blob_name in duplicates:
+            # Lost a race with a concurrent upload of the same content
+            self._delete_blob_quietly(gcs_blob_name)
+
+        saved = Photo.objects.with_details().in_bulk([photo.pk for photo in photos])
+        for (entry, _, _, _), photo in zip(pending, photos):
+            entry.update(
+                status='completed' if photo.pk in analyzed else 'queued',
+                photo=PhotoSerializer(saved[photo.pk]).data,
+            )
+
+        failed = sum(1 for entry in manifest if entry['status'] in ('invalid', 'failed'))
+        return Response({
+            "uploaded": len(manifest) - failed,
+            "failed": failed,
+            "results": manifest,
+        }, status=status.HTTP_207_MULTI_STATUS if failed else status.HTTP_202_ACCEPTED)
+
+    def _prepare_bulk_file(self, image_file):
+        if image_file.size > settings.MAX_PHOTO_UPLOAD_BYTES:
+            return image_file, [f"Photos are limited to {settings.MAX_PHOTO_UPLOAD_BYTES} bytes."], None, None
+        serializer = PhotoUploadSerializer(data={'image': image_file})
+        if not serializer.is_valid():
+            return image_file, serializer.errors['image'], None, None
+        image_file = serializer.validated_data['image']
+        exif_fields = read_exif_fields(image_file.read(settings.UPLOAD_SNIFF_BYTES))
+        image_file.seek(0)
+        return image_file, None, sha256_of_upload(image_file), exif_fields
+
+    def _upload_bulk_file(self, bucket, gcs_blob_name, image_file):
+        try:
+            bucket.blob(gcs_blob_name).upload_from_file(image_file.file, content_type=image_file.content_type)
+        except Exception as e:
+            return e
+        return None
+
+    def _upload_with_inline_analysis(self, request, bucket, image_file, content_sha256, exif_fields):
+        """
+        Stores a new photo and analyzes it in the same request. The GCS upload,
+        Vision/Geocoding and derivative rendering all start from the in-memory
+        bytes at once, so the request takes about as long as the slowest of
+        them rather than their sum.
+        """
+        image_bytes = image_file.read()
+        gcs_blob_name = f"user_{request.user.id}/{uuid.uuid4()}_{image_file.name}"
+        # Unsaved; carries the EXIF fields the analysis decisions look at
+        probe = Photo(user=request.user, gcs_blob_name=gcs_blob_name, **exif_fields)
+
+        upload = inline_analysis_pool.submit(
+            bucket.blob(gcs_blob_name).upload_from_string, image_bytes, content_type=image_file.content_type
+        )
+        analysis = inline_analysis_pool.submit(_closing_connections, self._analyze_image_bytes, probe, image_bytes)
+        derivatives = inline_analysis_pool.submit(upload_derivatives, bucket, gcs_blob_name, image_bytes)
+        wait([upload, analysis, derivatives])
+
+        return self._finish_inline_upload(
+            request, image_file, content_sha256, gcs_blob_name, exif_fields,
+            upload_error=upload.exception(),
+            landmark_fields=None if analysis.exception() else analysis.result(),
+            analysis_error=analysis.exception(),
+            derivatives=None if derivatives.exception() else derivatives.result(),
         )
+
+    def _analyze_image_bytes(self, photo, image_bytes):
+        """
+        Landmark fields for an image that may not be in GCS yet; Vision gets
+        the downscaled bytes inline.
+        """
+        landmarks = None
+        if self._needs_vision(photo):
+            landmarks = detect_landmarks(content_image(image_bytes, settings.VISION_CONTENT_MAX_EDGE))
+
+        location = self._locate(photo, landmarks)
+        reverse_geocode_result = None
+        if location is not None:
+            _, latitude, longitude = location
+            reverse_geocode_result = self._reverse_geocode(latitude, longitude, GEOCODING_API_KEY)
+        return self._analysis_landmark_fields(location, reverse_geocode_result)
+
+    def _finish_inline_upload(self, request, image_file, content_sha256, gcs_blob_name, exif_fields,
+                              upload_error, landmark_fields, analysis_error, derivatives):
+        """
+        Reconciles the concurrent stages of an inline upload. A failed upload
+        (or database write) removes every object the other stages wrote and
+        creates no rows; a failed analysis keeps the photo and queues it for
+        the worker, and a failed derivative rendering alone (`derivatives`
+        None) keeps the analysis and queues only the rendering.
+        """
+        bucket = storage_client.bucket(PHOTOS_BUCKET_NAME)
+        written = Photo(gcs_blob_name=gcs_blob_name, derivatives=derivatives or {})
+        if upload_error is not None:
+            delete_derivatives(written, bucket)
+            return Response({"error": "Failed to upload image to GCS.", "details": str(upload_error)},
+                            status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
         try:
-            landmark = self._perform_photo_analysis(photo)
-            landmark.save()
+            with transaction.atomic():
+                registered_blob_name = self._register_uploaded_blob(content_sha256, gcs_blob_name)
+                if registered_blob_name != gcs_blob_name:
+                    # A concurrent upload of the same bytes won; its derivatives apply
+                    delete_derivatives(written, bucket)
+                    derivatives = {}
+                photo = Photo.objects.create(
+                    user=request.user,
+                    gcs_blob_name=registered_blob_name,
+                    content_sha256=content_sha256,
+                    size_bytes=image_file.size,
+                    original_filename=image_file.name,
+                    processing_status='completed' if landmark_fields is not None else 'pending',
+                    derivatives=derivatives or {},
+                    **exif_fields
+                )
+                if landmark_fields is not None:
+                    Landmark.objects.create(photo=photo, **landmark_fields)
+                    if derivatives is None:
+                        print(f"Derivatives of photo {photo.id} failed, queued for the worker to render")
+                        enqueue_derivatives(photo)
+                else:
+                    print(f"Inline analysis of photo {photo.id} failed, queued instead: {analysis_error}")
+                    enqueue_analysis(photo)
         except Exception as e:
-            photo.processing_status = 'failed'
-            photo.save()
-            return Response({"error": "Photo analysis failed.", "details": str(e)},
+            # The blob registration rolled back with the transaction
+            print(traceback.format_exc())
+            self._delete_blob_quietly(gcs_blob_name)
+            delete_derivatives(written, bucket)
+            return Response({"error": "Failed to save photo.", "details": str(e)},
                             status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-        photo.processing_status = 'completed'
-        photo.save()            
+        photo = Photo.objects.with_details().get(pk=photo.pk)
+        return Response({
+            "photo": PhotoSerializer(photo).data,
+        }, status=status.HTTP_201_CREATED if landmark_fields is not None else status.HTTP_202_ACCEPTED)
+
+    def _direct_upload_finalized(self, gcs_blob_name):
+        # Registered, or already deleted again and waiting to be purged
+        return (
+            StoredBlob.objects.filter(gcs_blob_name=gcs_blob_name).exists()
+            or BlobTombstone.objects.filter(gcs_blob_name=gcs_blob_name).exists()
+        )
+
+    def _save_uploaded_photo(self, request, bucket, image_file, content_sha256, uploaded_blob_name, exif_fields):
+        """
+        Takes a reference on the stored copy of the content, or registers
+        `uploaded_blob_name` (the object this request wrote) if there is
+        none, and creates the photo in the same transaction. If anything
+        fails the reference rolls back and the written object is deleted.
+        Returns the upload_photo response.
+        """
+        try:
+            with transaction.atomic():
+                gcs_blob_name = acquire_existing_blob(content_sha256)
+                if gcs_blob_name is None and uploaded_blob_name is None:
+                    # The stored copy was released after the caller checked for it
+                    uploaded_blob_name = f"user_{request.user.id}/{uuid.uuid4()}_{image_file.name}"
+                    image_file.seek(0)
+                    bucket.blob(uploaded_blob_name).upload_from_file(image_file.file, content_type=image_file.content_type)
+                if gcs_blob_name is None:
+                    gcs_blob_name = register_blob(content_sha256, uploaded_blob_name)
+                photo, reused = self._create_uploaded_photo(
+                    user=request.user,
+                    gcs_blob_name=gcs_blob_name,
+                    content_sha256=content_sha256,
+                    size_bytes=image_file.size,
+                    original_filename=image_file.name,
+                    **exif_fields
+                )
+        except Exception as e:
+            print(traceback.format_exc())
+            if uploaded_blob_name is not None:
+                self._delete_blob_quietly(uploaded_blob_name)
+            return Response({"error": "Failed to save photo.", "details": str(e)},
+                            status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+        if uploaded_blob_name is not None and uploaded_blob_name != gcs_blob_name:
+            # Identical bytes were already stored (or a concurrent upload won); drop our copy
+            self._delete_blob_quietly(uploaded_blob_name)
 
-        photo_response_serializer = PhotoSerializer(photo)
-        landmark_serializer = LandmarkSerializer(landmark)
         return Response({
-            "photo": photo_response_serializer.data,
-            "landmark": landmark_serializer.data
-        }, status=status.HTTP_201_CREATED)
+            "photo": PhotoSerializer(photo).data,
+        }, status=status.HTTP_201_CREATED if reused else status.HTTP_202_ACCEPTED)
+
+    def _create_uploaded_photo(self, **fields):
+        """
+        Creates a 'pending' photo and, in the same transaction, copies an
+        earlier analysis of the same content or queues a job, so no photo is
+        left pending without one. Returns (photo, whether analysis was reused).
+        """
+        with transaction.atomic():
+            photo = Photo.objects.create(processing_status='pending', **fields)
+            if self._reuse_previous_analysis(photo):
+                return photo, True
+            enqueue_analysis(photo)
+            return photo, False
+
+    def _reuse_previous_analysis(self, photo: Photo):
+        """
+        Copies the landmark data of an already analyzed photo with the same
+        content, so no Vision or Geocoding call is needed. Returns False when
+        there is nothing to reuse.
+        """
+        previous = (
+            Landmark.objects
+            .filter(photo__content_sha256=photo.content_sha256, photo__processing_status='completed')
+            .exclude(photo=photo)
+            .select_related('photo')
+            .order_by('-analysis_timestamp')
+            .first()
+        )
+        if previous is None:
+            return False
+
+        # Same object, so the derivatives are shared too
+        photo.derivatives = previous.photo.derivatives
+
+        previous.pk = None
+        previous.id = None
+        previous.photo = photo
+        previous.save()
+
+        photo.processing_status = 'completed'
+        photo.save()
+        return True
+
+    def _reuse_previous_analyses(self, photos):
+        """
+        Bulk `_reuse_previous_analysis` with a constant number of queries.
+        Returns the ids of the photos that got a copy of an earlier analysis.
+        """
+        previous = {}
+        landmarks = (
+            Landmark.objects
+            .filter(photo__content_sha256__in={photo.content_sha256 for photo in photos},
+                    photo__processing_status='completed')
+            .select_related('photo')
+            .order_by('analysis_timestamp')
+        )
+        for landmark in landmarks:
+            # Newest analysis per content wins
+            previous[landmark.photo.content_sha256] = landmark
+
+        reused = [photo for photo in photos if photo.content_sha256 in previous]
+        copied_fields = [field.attname for field in Landmark._meta.concrete_fields
+                         if not field.primary_key and field.name != 'photo']
+        landmarks = Landmark.objects.bulk_create([
+            Landmark(photo=photo, **{name: getattr(previous[photo.content_sha256], name) for name in copied_fields})
+            for photo in reused
+        ])
+        record_landmarks_created(landmarks)
+        for photo in reused:
+            # Same object, so the derivatives are shared too
+            photo.derivatives = previous[photo.content_sha256].photo.derivatives
+            photo.processing_status = 'completed'
+        Photo.objects.bulk_update(reused, ['derivatives', 'processing_status'])
+        record_status_changes(reused)
+        return {photo.pk for photo in reused}
+
+    def _register_uploaded_blob(self, content_sha256, gcs_blob_name):
+        registered_blob_name = register_blob(content_sha256, gcs_blob_name)
+        if registered_blob_name != gcs_blob_name:
+            # Lost a race with a concurrent upload of the same content
+            self._delete_blob_quietly(gcs_blob_name)
+        return registered_blob_name
+
+    def _delete_blob_quietly(self, gcs_blob_name):
+        try:
+            storage_client.bucket(PHOTOS_BUCKET_NAME).blob(gcs_blob_name).delete()
+        except Exception as e:
+            print(f"Failed to delete GCS object {gcs_blob_name}: {e}")
+
+    def _place_name(self, reverse_geocode_result):
+        """
+        Name of the first point of interest among the reverse-geocoding
+        results, used when Vision was skipped for an EXIF-located photo.
+        """
+        for result in reverse_geocode_result:
+            if PLACE_RESULT_TYPES & set(result.get('types', [])):
+                address_components = result.get('address_components', [])
+                if address_components:
+                    return address_components[0].get('long_name')
+        return None
 
     def _extract_address_component(self, address_components, component_type):
         for component in address_components:
@@ -116,99 +716,165 @@ class PhotoViewSet(viewsets.GenericViewSet):
                 return component.get('long_name') or component.get('short_name')
         return None
 
+    def _render_photo_derivatives(self, photo: Photo):
+        """
+        Renders the derivatives of an already analyzed photo from its stored
+        original. Run by the analysis worker for 'derivatives' jobs.
+        """
+        generate_derivatives(photo, storage_client.bucket(PHOTOS_BUCKET_NAME))
+
     def _perform_photo_analysis(self, photo: Photo):
         """
         Internal method to perform landmark detection and geocoding.
         This simulates calls to Vision and Geocoding APIs.
-        Ideally, this runs asynchronously.
+        Uploads run it from the analysis worker (see jobs.py).
         """
+        self._begin_analysis(photo)
+
+        bucket = storage_client.bucket(PHOTOS_BUCKET_NAME)
+        image_bytes = None
+        try:
+            image_bytes = bucket.blob(photo.gcs_blob_name).download_as_bytes()
+            generate_derivatives(photo, bucket, image_bytes)
+        except Exception as e:
+            # Galleries fall back to the original; landmark analysis can still succeed
+            print(f"Failed to generate derivatives for photo {photo.id}: {e}")
+        self._backfill_exif(photo, image_bytes)
+
+        try:
+            landmarks = None
+            if self._needs_vision(photo):
+                # Batched with other in-flight analyses into one images:annotate call
+                landmarks = detect_landmarks(self._vision_image(photo, bucket, image_bytes))
+
+            location = self._locate(photo, landmarks)
+            reverse_geocode_result = None
+            if location is not None:
+                _, latitude, longitude = location
+                with self._geocoding_errors():
+                    reverse_geocode_result = self._reverse_geocode(latitude, longitude, GEOCODING_API_KEY)
+            landmark_fields = self._analysis_landmark_fields(location, reverse_geocode_result)
+        except Exception as e:
+            self._fail_analysis(photo, e)
+            raise
+        return self._complete_analysis(photo, landmark_fields)
+
+    # The steps below are shared with AsyncPhotoViewSet._aperform_photo_analysis,
+    # which only differs in how it waits on GCS, Vision and Geocoding.
+
+    def _begin_analysis(self, photo):
         photo.processing_status = 'processing'
         photo.save()
 
-        response_photo = self.sign_photo(photo)
-
-        signed_url = response_photo.data.get("signed_url")
+    def _backfill_exif(self, photo, image_bytes):
+        if image_bytes is not None and not photo.has_gps:
+            # Backfills photos uploaded before EXIF was read at upload time
+            for field, value in read_exif_fields(image_bytes[:settings.UPLOAD_SNIFF_BYTES]).items():
+                setattr(photo, field, value)
 
+    @contextmanager
+    def _geocoding_errors(self):
         try:
-            url = f'https://vision.googleapis.com/v1/images:annotate?key={VISION_API_KEY}'
-
-            data = {
-            "requests": [
-                {
-                "image": {
-                    "source": {
-                    "imageUri": signed_url
-                    }
-                },
-                "features": [
-                    {
-                    "type": "LANDMARK_DETECTION",
-                    "maxResults": 1
-                    }
-                ]
-                }
-            ]
-            }
+            yield
+        except RateLimited:
+            raise
+        except Exception as e:
+            raise Exception(f"Geocoding failed: {str(e)}")
+
+    def _analysis_landmark_fields(self, location, reverse_geocode_result):
+        """
+        Landmark fields for a `_locate` result and its reverse geocoding; the
+        'Unknown' landmark when there was nothing to locate the photo by.
+        """
+        if location is None:
+            return {"detected_landmark_name": "Unknown"}
+        if not reverse_geocode_result:
+            raise ValueError("Geocoding failed: Reverse geocoding returned no results.")
+        landmark_name, latitude, longitude = location
+        return self._landmark_fields(landmark_name, latitude, longitude, reverse_geocode_result)
 
-            # Send the request
-            response = requests.post(url, json=data)
-            result = response.json()
+    def _complete_analysis(self, photo, landmark_fields):
+        landmark, _ = Landmark.objects.update_or_create(photo=photo, defaults=landmark_fields)
+        photo.processing_status = 'completed'
+        photo.save()
+        return landmark
 
-            landmarks = result.get('responses', [])[0].get('landmarkAnnotations', [])
+    def _fail_analysis(self, photo, error):
+        # Over quota the analysis is deferred, not failed
+        photo.processing_status = 'pending' if isinstance(error, RateLimited) else 'failed'
+        photo.save()
 
-            if not landmarks or len(landmarks) == 0:
-                photo.processing_status = 'completed'
-                photo.save()
-                #landmark = Landmark.objects.create(photo=photo, detected_landmark_name=str(response))
-                landmark = Landmark.objects.create(photo=photo, detected_landmark_name="Unknown")
-                return landmark
+    def _needs_vision(self, photo):
+        # The camera already told us where it was; Vision only adds a name
+        return not photo.has_gps or settings.EXIF_GPS_VISION_POLICY == 'always'
 
+    def _locate(self, photo, landmarks):
+        """
+        (landmark name or None, latitude, longitude) to geocode, from EXIF GPS
+        or the first Vision landmark; None when there is neither.
+        """
+        landmark_name = None
+        if landmarks:
             landmark = landmarks[0]  # take the first landmark
+            landmark_name = landmark["description"]
 
-            if "locations" not in landmark or len(landmark["locations"]) == 0:
-                raise ValueError(f"Landmark {landmark['description']} has no coordinates.")
-
-            lat_lng = landmark["locations"][0]["latLng"]
-            
-            latitude = lat_lng["latitude"]
-            longitude = lat_lng["longitude"]
-            
-            try:
-                reverse_geocode_result = self._reverse_geocode(latitude, longitude, GEOCODING_API_KEY)
-                if not reverse_geocode_result:
-                    raise ValueError("Reverse geocoding returned no results.")
-                landmark = Landmark.objects.create(
-                    photo=photo,
-                    detected_landmark_name=landmark["description"],
-                    latitude=latitude,
-                    longitude=longitude,
-                    formatted_address=reverse_geocode_result[0].get('formatted_address'),
-                    street_number=self._extract_address_component(reverse_geocode_result[0].get('address_components', []), 'street_number'),
-                    route=self._extract_address_component(reverse_geocode_result[0].get('address_components', []), 'route'),
-                    neighborhood=self._extract_address_component(reverse_geocode_result[0].get('address_components', []), 'neighborhood'),
-                    sublocality=self._extract_address_component(reverse_geocode_result[0].get('address_components', []), 'sublocality'),
-                    state=self._extract_address_component(reverse_geocode_result[0].get('address_components', []), 'administrative_area_level_1'),
-                    district=self._extract_address_component(reverse_geocode_result[0].get('address_components', []), 'administrative_area_level_2'),
-                    country=self._extract_address_component(reverse_geocode_result[0].get('address_components', []), 'country'),
-                    postal_code=self._extract_address_component(reverse_geocode_result[0].get('address_components', []), 'postal_code')
-                )
-                return landmark
-            except Exception as e:
-                photo.processing_status = 'failed'
-                photo.save()
-                raise Exception(f"Geocoding failed: {str(e)}")
-        except Exception as e:
-            photo.processing_status = 'failed'
-            photo.save()
-            raise e
+        if photo.has_gps:
+            return landmark_name, photo.gps_latitude, photo.gps_longitude
+        if not landmarks:
+            return None
+
+        if "locations" not in landmark or len(landmark["locations"]) == 0:
+            raise ValueError(f"Landmark {landmark['description']} has no coordinates.")
+
+        lat_lng = landmark["locations"][0]["latLng"]
+        return landmark_name, lat_lng["latitude"], lat_lng["longitude"]
+
+    def _landmark_fields(self, landmark_name, latitude, longitude, reverse_geocode_result):
+        address_components = reverse_geocode_result[0].get('address_components', [])
+        return dict(
+            detected_landmark_name=landmark_name or self._place_name(reverse_geocode_result) or "Unknown",
+            latitude=latitude,
+            longitude=longitude,
+            formatted_address=reverse_geocode_result[0].get('formatted_address'),
+            street_number=self._extract_address_component(address_components, 'street_number'),
+            route=self._extract_address_component(address_components, 'route'),
+            neighborhood=self._extract_address_component(address_components, 'neighborhood'),
+            sublocality=self._extract_address_component(address_components, 'sublocality'),
+            state=self._extract_address_component(address_components, 'administrative_area_level_1'),
+            district=self._extract_address_component(address_components, 'administrative_area_level_2'),
+            country=self._extract_address_component(address_components, 'country'),
+            postal_code=self._extract_address_component(address_components, 'postal_code')
+        )
+
+    def _vision_image(self, photo, bucket, image_bytes=None, mode=None):
+        """
+        The Vision image for a photo, in the form selected by `mode`
+        (VISION_INPUT_MODE by default).
+        """
+        mode = mode or settings.VISION_INPUT_MODE
+        if mode == 'content':
+            if image_bytes is None:
+                image_bytes = bucket.blob(photo.gcs_blob_name).download_as_bytes()
+            return content_image(image_bytes, settings.VISION_CONTENT_MAX_EDGE)
+        if mode == 'gcs_uri':
+            return gcs_image(PHOTOS_BUCKET_NAME, photo.gcs_blob_name)
+        if mode == 'signed_url':
+            return uri_image(self.sign_photo(photo).data.get("signed_url"))
+        raise ImproperlyConfigured(f"Unknown VISION_INPUT_MODE {mode!r}; expected one of {', '.join(VISION_INPUT_MODES)}.")
 
     def _reverse_geocode(self, lat, lng, api_key):
-        url = "https://maps.googleapis.com/maps/api/geocode/json"
+        return geocode_cache.get_or_fetch(lat, lng, lambda: self._fetch_reverse_geocode(lat, lng, api_key))
+
+    def _fetch_reverse_geocode(self, lat, lng, api_key):
         params = {
             "latlng": f"{lat},{lng}",
             "key": api_key
         }
-        response = requests.get(url, params=params)
+        geocoding_rate_limit.acquire()
+        response = http_client.get(GEOCODING_URL, params=params)
+        return self._geocoding_results(response)
+
+    def _geocoding_results(self, response):
         result = response.json()
 
         if response.status_code != 200 or result.get("status") != "OK":
@@ -227,18 +893,34 @@ class PhotoViewSet(viewsets.GenericViewSet):
         if photo.processing_status == 'processing':
             return Response({'message': 'Analysis is already in progress.'}, status=status.HTTP_409_CONFLICT)
 
-        self._perform_photo_analysis(photo)
+        try:
+            self._perform_photo_analysis(photo)
+        except RateLimited as e:
+            return self._deferred_analysis(photo, e)
 
+        photo = Photo.objects.with_details().get(pk=photo.pk)
         response_serializer = PhotoSerializer(photo)
         return Response(response_serializer.data, status=status.HTTP_200_OK)
 
+    def _deferred_analysis(self, photo, rate_limited):
+        """
+        202 for an analysis that hit a rate limit: it is queued for the
+        analysis worker instead of failing.
+        """
+        enqueue_reanalysis(Photo.objects.filter(pk=photo.pk))
+        photo = Photo.objects.with_details().get(pk=photo.pk)
+        return Response(
+            PhotoSerializer(photo).data, status=status.HTTP_202_ACCEPTED,
+            headers={'Retry-After': str(math.ceil(rate_limited.retry_after))},
+        )
+
     @action(detail=True, methods=['get'], url_path='details', url_name='photo-detail')
     def retrieve_photo_details(self, request, pk=None):
         """
         GET /api/v1/photos/{photo_id}/details/
         Retrieves metadata for a specific photo, including landmark and geolocation if processed.
         """
-        photo = get_object_or_404(Photo, pk=pk, user=request.user)
+        photo = get_object_or_404(Photo.objects.with_details(), pk=pk, user=request.user)
         serializer = PhotoSerializer(photo)
         return Response(serializer.data)
 
@@ -251,48 +933,149 @@ class PhotoViewSet(viewsets.GenericViewSet):
         photo = get_object_or_404(Photo, pk=pk, user=request.user)
 
         try:
-            bucket = storage_client.bucket(PHOTOS_BUCKET_NAME)
-            blob = bucket.blob(photo.gcs_blob_name)
-            if blob.exists():
-               blob.delete()
+            # The GCS objects (unless shared with other photos) are purged in the background
+            delete_photos(Photo.objects.filter(pk=photo.pk))
         except Exception as e:
-            print(f"Failed to delete GCS object {photo.gcs_blob_name}: {e}")
+            print(f"Failed to delete photo {photo.id}: {e}")
             return Response(
-                {"error": "Failed to delete photo from Google Cloud Storage."},
+                {"error": "Failed to delete photo."},
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
 
-        photo.delete()
         return Response(status=status.HTTP_204_NO_CONTENT)
 
-    def sign_photo(self, photo):
+    @action(detail=False, methods=['post'], serializer_class=BulkDeleteSerializer, url_path='bulk_delete')
+    def bulk_delete(self, request):
+        """
+        POST /api/v1/photos/bulk_delete/
+        Deletes up to BULK_DELETE_MAX_PHOTOS of the user's photos in one
+        transaction. Their GCS objects are tombstoned and removed later by
+        the purge worker, so no storage call is made in the request.
+        """
+        serializer = BulkDeleteSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        photo_ids = set(serializer.validated_data['photo_ids'])
+
+        try:
+            deleted = delete_photos(Photo.objects.filter(pk__in=photo_ids, user=request.user))
+        except Exception as e:
+            print(traceback.format_exc())
+            return Response({"error": "Failed to delete photos.", "details": str(e)},
+                            status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+        return Response({
+            "deleted": sorted(deleted),
+            "not_found": sorted(photo_ids - set(deleted)),
+        }, status=status.HTTP_200_OK)
+
+    @action(detail=False, methods=['get'], url_path='within')
+    def photos_within(self, request):
+        """
+        GET /api/v1/photos/within/?bbox=south,west,north,east
+        GET /api/v1/photos/within/?near=lat,lng&radius=km
+        The user's analyzed photos in a map viewport (newest first; west >
+        east crosses the antimeridian) or within `radius` km of a point
+        (nearest first), as map markers. At most `limit` (1 up to
+        SPATIAL_QUERY_MAX_RESULTS, the default); `truncated` tells whether
+        there are more.
+        """
+        try:
+            limit = int(request.query_params.get('limit', settings.SPATIAL_QUERY_MAX_RESULTS))
+            if not 1 <= limit <= settings.SPATIAL_QUERY_MAX_RESULTS:
+                raise ValueError
+        except ValueError:
+            return Response({"error": f"limit must be between 1 and {settings.SPATIAL_QUERY_MAX_RESULTS}."},
+                            status=status.HTTP_400_BAD_REQUEST)
+        try:
+            if 'bbox' in request.query_params:
+                photos = Photo.objects.within_bbox(*parse_bbox(request.query_params['bbox'])).order_by('-upload_time', '-id')
+                fields = []
+            elif 'near' in request.query_params:
+                latitude, longitude = parse_coordinates(request.query_params['near'], 2)
+                radius_km = float(request.query_params['radius'])
+                if not (-90 <= latitude <= 90 and -180 <= longitude <= 180 and 0 < radius_km <= 20050):
+                    raise ValueError
+                photos = Photo.objects.near(latitude, longitude, radius_km).order_by('distance_km', 'id')
+                fields = ['distance_km']
+            else:
+                raise ValueError
+        except (KeyError, ValueError):
+            return Response({"error": "Pass bbox=south,west,north,east, or near=lat,lng and radius (km)."},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        rows = list(
+            photos.filter(user=request.user)
+            .values('id', 'landmark_data__detected_landmark_name', 'landmark_data__latitude',
+                    'landmark_data__longitude', *fields)[:limit + 1]
+        )
+        return Response({
+            "results": [{
+                "photo_id": row['id'],
+                "detected_landmark_name": row['landmark_data__detected_landmark_name'],
+                "latitude": row['landmark_data__latitude'],
+                "longitude": row['landmark_data__longitude'],
+                **{field: row[field] for field in fields},
+            } for row in rows[:limit]],
+            "truncated": len(rows) > limit,
+        })
+
+    def sign_photo(self, photo, size=None):
         try:
             bucket = storage_client.bucket(PHOTOS_BUCKET_NAME)
-            blob = bucket.blob(photo.gcs_blob_name)
 
-            # Generate signed URL valid for 60 minutes
-            url = blob.generate_signed_url(
-                expiration=timedelta(minutes=60),
-                method='GET',
-                version='v4'
-            )
+            # Cached per blob; valid for at least SIGNED_URL_TTL_SECONDS - SIGNED_URL_REFRESH_MARGIN_SECONDS
+            url, expires_at = signed_url_cache.sign(bucket, photo.blob_name_for_size(size))
 
-            return Response({"signed_url": url})
+            return Response({"signed_url": url, "expires_at": expires_at})
         except Exception as e:
             print(traceback.format_exc())  # Or log to a logger
             return Response({"error": "Failed to generate signed URL.", "details": str(e)},
                             status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+    @action(detail=False, methods=['get'], url_path='signed_urls')
+    def generate_signed_urls(self, request):
+        """
+        GET /api/v1/photos/signed_urls/?ids=1,2,3&size=thumb
+        Returns signed URLs for several of the user's photos in one call, at
+        most one gallery page (GalleryPagination.max_page_size) of them.
+        """
+        size = requested_size(request)
+        try:
+            photo_ids = {int(photo_id) for photo_id in request.query_params.get('ids', '').split(',') if photo_id}
+        except ValueError:
+            return Response({"error": "ids must be a comma-separated list of photo IDs."},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if len(photo_ids) > GalleryPagination.max_page_size:
+            return Response({"error": f"At most {GalleryPagination.max_page_size} ids per request."},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        photos = Photo.objects.filter(pk__in=photo_ids, user=request.user).only('id', 'gcs_blob_name', 'derivatives')
+        blob_names = {photo.id: photo.blob_name_for_size(size) for photo in photos}
+        try:
+            bucket = storage_client.bucket(PHOTOS_BUCKET_NAME)
+            signed = signed_url_cache.sign_many(bucket, list(set(blob_names.values())))
+        except Exception as e:
+            print(traceback.format_exc())
+            return Response({"error": "Failed to generate signed URLs.", "details": str(e)},
+                            status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+        return Response({
+            str(photo_id): {"signed_url": signed[blob_name][0], "expires_at": signed[blob_name][1]}
+            for photo_id, blob_name in blob_names.items()
+        })
 
     @action(detail=True, methods=['get'], url_path='signed_url')
     def generate_signed_url(self, request, pk=None):
         """
-        GET /api/v1/photos/{photo_id}/signed_url/
-        Returns a temporary signed URL to access the photo.
+        GET /api/v1/photos/{photo_id}/signed_url/?size=thumb
+        Returns a temporary signed URL to access the photo (or one of its
+        downscaled derivatives).
         """
+        size = requested_size(request)
         photo = get_object_or_404(Photo, pk=pk, user=request.user)
 
-        return self.sign_photo(photo)
+        return self.sign_photo(photo, size)
 
         # try:
         #     bucket = storage_client.bucket(PHOTOS_BUCKET_NAME)
@@ -319,8 +1102,9 @@ class PhotoViewSet(viewsets.GenericViewSet):
 @permission_classes([IsAuthenticated])
 def list_user_photos(request, user_id):
     """
-    GET /api/v1/users/{user_id}/photos/
-    Retrieves a list of all photos uploaded by a specific user.
+    GET /api/v1/users/{user_id}/photos/?cursor=&page_size=&size=
+    Retrieves the photos uploaded by a specific user, newest first, one
+    keyset-paginated page at a time (follow `next` for the following page).
     Basic metadata: photo IDs, upload times, processing statuses, original filename.
     """
 
@@ -328,7 +1112,115 @@ def list_user_photos(request, user_id):
         return Response({"detail": "Not authorized to view these photos."}, status=status.HTTP_403_FORBIDDEN)
 
     target_user = get_object_or_404(User, pk=user_id)
-    photos = Photo.objects.filter(user=target_user).order_by('-upload_time')
-    
-    serializer = PhotoSerializer(photos, many=True)
-    return Response(serializer.data, status=status.HTTP_200_OK)
\ No newline at end of file
+    photos = Photo.objects.with_details().filter(user=target_user)
+
+    paginator = PhotoKeysetPagination()
+    page = paginator.paginate_queryset(photos, request)
+    serializer = PhotoSerializer(page, many=True, context={'size': requested_size(request)})
+    return paginator.get_paginated_response(serializer.data)
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def user_gallery(request, user_id):
+    """
+    GET /api/v1/users/{user_id}/gallery/?page=&page_size=&size=
+    One page of a user's photos with embedded landmark data and signed URLs,
+    fetched with a constant number of queries regardless of page size.
+    """
+
+    if request.user.id != user_id and not request.user.is_staff:
+        return Response({"detail": "Not authorized to view these photos."}, status=status.HTTP_403_FORBIDDEN)
+
+    target_user = get_object_or_404(User, pk=user_id)
+    photos = (
+        Photo.objects
+        .with_details()
+        .filter(user=target_user)
+        .order_by('-upload_time', '-id')
+    )
+
+    size = requested_size(request)
+    paginator = GalleryPagination()
+    page = paginator.paginate_queryset(photos, request)
+    try:
+        bucket = storage_client.bucket(PHOTOS_BUCKET_NAME)
+        signed_urls = signed_url_cache.sign_many(bucket, list({photo.blob_name_for_size(size) for photo in page}))
+    except Exception as e:
+        print(traceback.format_exc())
+        return Response({"error": "Failed to generate signed URLs.", "details": str(e)},
+                        status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    serializer = GalleryPhotoSerializer(page, many=True, context={'signed_urls': signed_urls, 'size': size})
+    return paginator.get_paginated_response(serializer.data)
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def user_photo_clusters(request, user_id):
+    """
+    GET /api/v1/users/{user_id}/clusters/?zoom=&bbox=south,west,north,east
+    The user's located photos as map clusters for a zoom level: photos are
+    grouped in SQL into grid cells MAP_CLUSTER_CELL_PIXELS wide at that
+    zoom, so the response size depends on the viewport, not on the number
+    of photos. Each cluster has a count, centroid and its newest photo.
+    """
+
+    if request.user.id != user_id and not request.user.is_staff:
+        return Response({"detail": "Not authorized to view these photos."}, status=status.HTTP_403_FORBIDDEN)
+
+    try:
+        zoom = float(request.query_params['zoom'])
+        if not 0 <= zoom <= 24:
+            raise ValueError
+        bbox = parse_bbox(request.query_params['bbox']) if 'bbox' in request.query_params else None
+    except (KeyError, ValueError):
+        return Response({"error": "Pass zoom (0-24) and optionally bbox=south,west,north,east."},
+                        status=status.HTTP_400_BAD_REQUEST)
+
+    target_user = get_object_or_404(User, pk=user_id)
+    landmarks = Landmark.objects.filter(photo__user=target_user)
+    if bbox is not None:
+        landmarks = landmarks.filter(bbox_filter(*bbox))
+
+    cell_degrees = cluster_cell_degrees(zoom, settings.MAP_CLUSTER_CELL_PIXELS)
+    limit = settings.SPATIAL_QUERY_MAX_RESULTS
+    clusters = list(grid_clusters(landmarks, cell_degrees)[:limit + 1])
+    names = dict(
+        Landmark.objects
+        .filter(photo_id__in=[cluster['newest_photo_id'] for cluster in clusters[:limit]])
+        .values_list('photo_id', 'detected_landmark_name')
+    )
+    return Response({
+        "cell_degrees": cell_degrees,
+        "clusters": [{
+            "count": cluster['count'],
+            "latitude": cluster['center_latitude'],
+            "longitude": cluster['center_longitude'],
+            "photo_id": cluster['newest_photo_id'],
+            "detected_landmark_name": names.get(cluster['newest_photo_id']),
+        } for cluster in clusters[:limit]],
+        "truncated": len(clusters) > limit,
+    })
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def user_photo_stats(request, user_id):
+    """
+    GET /api/v1/users/{user_id}/stats/?top=10
+    Per-status photo counts, countries visited and the `top` landmarks,
+    read from the summary tables kept up to date as photos are analyzed and
+    deleted (three queries, whatever the number of photos).
+    """
+
+    if request.user.id != user_id and not request.user.is_staff:
+        return Response({"detail": "Not authorized to view these photos."}, status=status.HTTP_403_FORBIDDEN)
+
+    try:
+        top = max(1, min(int(request.query_params.get('top', 10)), 100))
+    except ValueError:
+        return Response({"error": "top must be a number."}, status=status.HTTP_400_BAD_REQUEST)
+
+    target_user = get_object_or_404(User, pk=user_id)
+    return Response(user_stats(target_user, top))
@@ -27,19 +27,40 @@ def logout_user(token):
         return {"success": False, "error": response.text}
 
 def upload_photo(file_obj, filename, content_type, token=None):
-    url = f"{get_base_url()}/api/photos/upload_photo/"
+    """
+    Uploads straight to the bucket: reserve a signed URL, PUT the bytes to
+    GCS, then ask the API to finalize the photo.
+    """
+    base_url = get_base_url()
     headers = {}
 
     if token:
         headers["Authorization"] = f"Token {token}"
 
-    files = {
-        "image": (filename, file_obj, content_type)
-    }
+    data = file_obj.getvalue() if hasattr(file_obj, "getvalue") else file_obj.read()
+
+    response = requests.post(
+        f"{base_url}/api/v1/photos/request_upload/",
+        json={"filename": filename, "content_type": content_type, "size": len(data)},
+        headers=headers,
+    )
+    if response.status_code != 201:
+        return {"success": False, "status_code": response.status_code, "error": response.text}
+    reservation = response.json()
 
-    response = requests.post(url, files=files, headers=headers)
+    upload = reservation["upload"]
+    response = requests.put(upload["url"], data=data, headers=upload["headers"])
+    if response.status_code not in (200, 201):
+        return {"success": False, "status_code": response.status_code, "error": response.text}
+
+    response = requests.post(
+        f"{base_url}/api/v1/photos/finalize_upload/",
+        json={"upload_token": reservation["upload_token"]},
+        headers=headers,
+    )
 
-    if response.status_code in (200, 201):
+    # 202: stored, landmark analysis continues in the background
+    if response.status_code in (200, 201, 202):
         return {"success": True, "response": response.json()}
     else:
         return {"success": False, "status_code": response.status_code, "error": response.text}
@@ -55,10 +76,103 @@ def delete_photo(photo_id, token):
     else:
         return {"success": False, "status_code": response.status_code, "error": response.text}
 
-def get_user_photos(user_id, token):
+def get_user_photos(user_id, token, cursor_url=None, page_size=50):
+    """
+    One page of the user's photos, newest first: {"results": [...], "next": url}.
+    Pass the previous page's "next" as cursor_url to continue.
+    """
+    base_url = get_base_url()
+    headers = {"Authorization": f"Token {token}"}
+    url = cursor_url or f"{base_url}/api/v1/users/{user_id}/photos/?page_size={page_size}"
+    response = requests.get(url, headers=headers)
+    if response.status_code == 200:
+        return response.json()
+    else:
+        return {"error": response.text, "status_code": response.status_code}
+
+class APIError(Exception):
+    """
+    A page request that failed part way through a listing.
+    """
+    def __init__(self, status_code, error):
+        super().__init__(f"{status_code}: {error}")
+        self.status_code = status_code
+        self.error = error
+
+def iter_pages(url, headers):
+    """
+    Yields the items of a paginated listing starting at `url`, requesting
+    the next page only once the previous one has been consumed and stopping
+    when its "next" link is null. Raises APIError if a page fails.
+    """
+    while url:
+        response = requests.get(url, headers=headers)
+        if response.status_code != 200:
+            raise APIError(response.status_code, response.text)
+        page = response.json()
+        yield from page["results"]
+        url = page.get("next")
+
+def iter_user_photos(user_id, token, page_size=50):
+    """
+    Yields the user's photos, newest first, following the cursor pages lazily.
+    """
+    headers = {"Authorization": f"Token {token}"}
+    return iter_pages(f"{get_base_url()}/api/v1/users/{user_id}/photos/?page_size={page_size}", headers)
+
+def iter_user_gallery(user_id, token, page_size=200, size="thumb"):
+    """
+    Yields photos with landmark data and signed URLs, following the gallery
+    pages lazily. `size` picks the rendition the URLs point at ("thumb",
+    "medium" or "original").
+    """
+    headers = {"Authorization": f"Token {token}"} if token else {}
+    return iter_pages(f"{get_base_url()}/api/v1/users/{user_id}/gallery/?page_size={page_size}&size={size}", headers)
+
+def get_photos_within(token, bbox=None, near=None, radius_km=None, limit=None):
+    """
+    Map markers for the user's photos in bbox=(south, west, north, east), or
+    within radius_km of near=(lat, lng): {"results": [...], "truncated": bool}.
+    """
     base_url = get_base_url()
     headers = {"Authorization": f"Token {token}"}
-    response = requests.get(f"{base_url}/api/v1/users/{user_id}/photos/", headers=headers)
+    params = {"limit": limit} if limit else {}
+    if bbox is not None:
+        params["bbox"] = ",".join(str(value) for value in bbox)
+    else:
+        params["near"] = f"{near[0]},{near[1]}"
+        params["radius"] = radius_km
+    response = requests.get(f"{base_url}/api/v1/photos/within/", headers=headers, params=params)
+    if response.status_code == 200:
+        return response.json()
+    else:
+        return {"error": response.text, "status_code": response.status_code}
+
+def get_user_clusters(user_id, token, zoom, bbox=None):
+    """
+    Map clusters of the user's photos for a zoom level and optional
+    bbox=(south, west, north, east): a few hundred markers at most, each with
+    "count", "latitude", "longitude" and a representative "photo_id".
+    """
+    base_url = get_base_url()
+    headers = {"Authorization": f"Token {token}"} if token else {}
+    params = {"zoom": zoom}
+    if bbox is not None:
+        params["bbox"] = ",".join(str(value) for value in bbox)
+    response = requests.get(f"{base_url}/api/v1/users/{user_id}/clusters/", headers=headers, params=params)
+    if response.status_code == 200:
+        return response.json()
+    else:
+        return {"error": response.text, "status_code": response.status_code}
+
+def get_user_stats(user_id, token, top=10):
+    """
+    Summary of the user's photos: "counts" per processing status,
+    "countries_visited" and "top_landmarks" (each a list of name/photos).
+    """
+    base_url = get_base_url()
+    headers = {"Authorization": f"Token {token}"} if token else {}
+    response = requests.get(f"{base_url}/api/v1/users/{user_id}/stats/", headers=headers, params={"top": top})
     if response.status_code == 200:
         return response.json()
     else:
@@ -87,10 +201,10 @@ def get_photo_details(photo_id, token):
     else:
         return None
 
-def get_signed_url(photo_id, token):
+def get_signed_url(photo_id, token, size="original"):
     base_url = get_base_url()
     headers = {"Authorization": f"Token {token}"}
-    response = requests.get(f"{base_url}/api/v1/photos/{photo_id}/signed_url/", headers=headers)
+    response = requests.get(f"{base_url}/api/v1/photos/{photo_id}/signed_url/", headers=headers, params={"size": size})
 
     if response.status_code == 200:
         return response.json().get("signed_url")
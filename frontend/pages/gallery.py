@@ -1,9 +1,10 @@
 import streamlit as st
-from api.client import get_user_photos, get_current_user, get_signed_url, get_photo_details, upload_photo, delete_photo, get_base_url
+from api.client import APIError, iter_user_gallery, get_user_clusters, get_user_stats, get_current_user, upload_photo, delete_photo, get_base_url
 #import pydeck as pdk
 import folium
 from streamlit_folium import st_folium
 from utils.session_state import get_session_state
+from utils.map_view import cluster_label, last_map_view
 from components.navbar import show_navbar, show_sidebar
 
 def show_upload_form(token, state):
@@ -68,49 +69,65 @@ with col_upload:
 if state["show_upload_form"]:
     show_upload_form(token, state)
 ### Getting info about user photos ###
-photos = get_user_photos(user_id, token)
-if "error" in photos:
-    st.error(f"Error loading photos: {photos['error']}")
-    st.stop()
-
-coordinates = []
 photos_with_coords = []
 
-for photo in photos:
-    photo_id = photo.get("photo_id") or photo.get("id")
-    filename = photo.get("original_filename")
-    signed_url = get_signed_url(photo_id, token)
-    
-    details = get_photo_details(photo_id, token)
-    landmark = details.get("landmark_data") if details else None
-
-    if landmark:
-        lat = landmark.get("latitude")
-        lon = landmark.get("longitude")
-        if lat and lon:
-            coordinates.append({
-                "lat": float(lat),
-                "lon": float(lon),
-                "photo_id": photo_id,
-                "name": landmark.get("detected_landmark_name")
-            })
-
-    photos_with_coords.append({
-        "photo_id": photo_id,
-        "filename": filename,
-        "signed_url": signed_url,
-        "landmark": landmark,
-        "details": details
-    })
+try:
+    for photo in iter_user_gallery(user_id, token):
+        photo_id = photo.get("photo_id") or photo.get("id")
+        filename = photo.get("original_filename")
+        signed_url = photo.get("signed_url")
+
+        details = photo
+        landmark = photo.get("landmark_data")
+
+        photos_with_coords.append({
+            "photo_id": photo_id,
+            "filename": filename,
+            "signed_url": signed_url,
+            "landmark": landmark,
+            "details": details
+        })
+except APIError as e:
+    st.error(f"Error loading photos: {e.error}")
+    st.stop()
+
+### Summary of the user's photos ###
+stats = get_user_stats(user_id, token, top=5)
+if "error" not in stats:
+    counts = stats["counts"]
+    col_photos, col_analyzed, col_countries = st.columns(3)
+    col_photos.metric("Photos", counts["total"])
+    col_analyzed.metric("Analyzed", counts["completed"])
+    col_countries.metric("Countries", len(stats["countries_visited"]))
+    if stats["top_landmarks"]:
+        st.caption("Top landmarks: " + ", ".join(
+            f"{landmark['name']} ({landmark['photos']})" for landmark in stats["top_landmarks"]
+        ))
 
 ### Creating map with visited coordinates ###
-if coordinates:
+# One marker per cluster of nearby photos, aggregated by the API for the zoom
+# and viewport the map was left at, however many photos there are
+zoom, bbox, center = last_map_view("gallery_map")
+clusters = get_user_clusters(user_id, token, zoom, bbox)
+if "error" in clusters:
+    st.error(f"Error loading map: {clusters['error']}")
+    clusters = {"clusters": []}
+
+coordinates = [{
+    "lat": cluster["latitude"],
+    "lon": cluster["longitude"],
+    "photo_id": cluster["photo_id"],
+    "name": cluster_label(cluster)
+} for cluster in clusters["clusters"]]
+
+if coordinates or bbox is not None:
     st.subheader("🗺️ Visited Locations Map")
 
     col1, col2 = st.columns([3, 1])
 
     with col1:
-        m = folium.Map(location=[coordinates[0]['lat'], coordinates[0]['lon']], zoom_start=1.5)
+        location = center or ([coordinates[0]['lat'], coordinates[0]['lon']] if coordinates else [0, 0])
+        m = folium.Map(location=location, zoom_start=zoom)
         for coord in coordinates:
             folium.Marker(
                 location=[coord['lat'], coord['lon']],
@@ -119,7 +136,7 @@ if coordinates:
                 icon=folium.Icon(color="red", icon="camera", prefix="fa")
             ).add_to(m)
 
-        map_data = st_folium(m, width=700, height=500)
+        map_data = st_folium(m, width=700, height=500, key="gallery_map")
 
     with col2:
         clicked = map_data.get("last_object_clicked", None)
@@ -34,7 +34,7 @@ try:
         st.error("Failed to load photo details.")
         st.stop()
 
-    signed_url = get_signed_url(photo_id, token)
+    signed_url = get_signed_url(photo_id, token, size="medium")
 
     if signed_url:
         col1, col2, col3 = st.columns([1, 3, 1]) 
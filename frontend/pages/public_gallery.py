@@ -1,6 +1,7 @@
 # pages/public_gallery.py
 import streamlit as st
-from api.client import get_user_photos, get_signed_url, get_photo_details
+from api.client import APIError, iter_user_gallery, get_user_clusters
+from utils.map_view import cluster_label, last_map_view
 import folium
 from streamlit_folium import st_folium
 
@@ -13,51 +14,48 @@ if not user_id:
     st.error("No user ID provided.")
     st.stop()
 
-photos = get_user_photos(user_id, None)
-if "error" in photos:
-    st.error(f"Error loading photos: {photos['error']}")
-    st.stop()
-
-coordinates = []
 photos_with_coords = []
 
-for photo in photos:
-    photo_id = photo.get("photo_id") or photo.get("id")
-    filename = photo.get("original_filename")
-    signed_url = get_signed_url(photo_id, None)
-    
-    details = get_photo_details(photo_id, None)
-    landmark = details.get("landmark_data") if details else None
+try:
+    for photo in iter_user_gallery(user_id, None):
+        photo_id = photo.get("photo_id") or photo.get("id")
+        filename = photo.get("original_filename")
+        signed_url = photo.get("signed_url")
 
-    if landmark:
-        lat = landmark.get("latitude")
-        lon = landmark.get("longitude")
-        if lat and lon:
-            coordinates.append({
-                "lat": float(lat),
-                "lon": float(lon),
-                "photo_id": photo_id,
-                "name": landmark.get("detected_landmark_name")
-            })
+        details = photo
+        landmark = photo.get("landmark_data")
+
+        photos_with_coords.append({
+            "photo_id": photo_id,
+            "filename": filename,
+            "signed_url": signed_url,
+            "landmark": landmark,
+            "details": details
+        })
+except APIError as e:
+    st.error(f"Error loading photos: {e.error}")
+    st.stop()
 
-    photos_with_coords.append({
-        "photo_id": photo_id,
-        "filename": filename,
-        "signed_url": signed_url,
-        "landmark": landmark,
-        "details": details
-    })
+# Clusters for the zoom and viewport the map was left at (see pages/gallery.py)
+zoom, bbox, center = last_map_view("public_gallery_map")
+clusters = get_user_clusters(user_id, None, zoom, bbox)
+coordinates = [{
+    "lat": cluster["latitude"],
+    "lon": cluster["longitude"],
+    "name": cluster_label(cluster)
+} for cluster in clusters.get("clusters", [])]
 
-if coordinates:
+if coordinates or bbox is not None:
     st.subheader("🗺️ Visited Locations Map")
-    m = folium.Map(location=[coordinates[0]['lat'], coordinates[0]['lon']], zoom_start=1.5)
+    location = center or ([coordinates[0]['lat'], coordinates[0]['lon']] if coordinates else [0, 0])
+    m = folium.Map(location=location, zoom_start=zoom)
     for coord in coordinates:
         folium.Marker(
             location=[coord['lat'], coord['lon']],
             tooltip=coord['name'],
             icon=folium.Icon(color="blue", icon="camera", prefix="fa")
         ).add_to(m)
-    map_data = st_folium(m, width=700, height=500)
+    map_data = st_folium(m, width=700, height=500, key="public_gallery_map")
 else:
     st.info("No geolocation data available.")
 
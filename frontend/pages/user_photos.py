@@ -1,5 +1,5 @@
 import streamlit as st
-from api.client import get_user_photos, get_current_user, get_photo_details, get_signed_url
+from api.client import APIError, iter_user_gallery, get_current_user
 
 st.title("My Uploaded Photos")
 
@@ -18,13 +18,11 @@ if not user_info or "pk" not in user_info:
 
 user_id = user_info["pk"]
 
-photos = get_user_photos(user_id, token)
-
-if "error" in photos:
-    st.error(f"Error loading photos: {photos['error']}")
-else:
-    st.header("📸 My Uploaded Photos")
-    for photo in photos:
+# Each photo is drawn as soon as its page arrives; later pages are requested
+# only once the earlier ones have been rendered
+st.header("📸 My Uploaded Photos")
+try:
+    for photo in iter_user_gallery(user_id, token):
         photo_id = photo.get("photo_id") or photo.get("id")
         filename = photo.get("original_filename")
         uploaded = photo.get("upload_time")
@@ -35,7 +33,7 @@ else:
         st.markdown(f"⚙️ Status: {status}")
 
         if photo_id:
-            signed_url = get_signed_url(photo_id, token)
+            signed_url = photo.get("signed_url")
             st.markdown(signed_url)
             if signed_url:
                 st.image(signed_url, caption=filename, use_container_width=True)
@@ -44,9 +42,10 @@ else:
         else:
             st.warning("Photo ID missing, cannot show image.")
 
-        details = get_photo_details(photo_id, token) if photo_id else None
-        if details and details.get("landmark_data"):
-            landmark = details["landmark_data"]
+        if photo.get("landmark_data"):
+            landmark = photo["landmark_data"]
             st.markdown(f"🏛️ **Detected Landmark:** {landmark.get('detected_landmark_name')}")
             st.markdown(f"📍 **Location:** {landmark.get('formatted_address')}")
         st.divider()
+except APIError as e:
+    st.error(f"Error loading photos: {e.error}")
@@ -0,0 +1,32 @@
+import streamlit as st
+
+
+def last_map_view(key, default_zoom=1.5):
+    """
+    (zoom, bbox, center) of the st_folium map rendered under `key` in the
+    previous run, so clusters can be fetched for what the user is looking at.
+    bbox is (south, west, north, east), or None when the whole world is visible.
+    """
+    state = st.session_state.get(key) or {}
+    zoom, bounds, center = state.get("zoom"), state.get("bounds"), state.get("center")
+    if zoom is None or not bounds or not bounds.get("_southWest") or not bounds.get("_northEast"):
+        return default_zoom, None, None
+
+    south_west, north_east = bounds["_southWest"], bounds["_northEast"]
+    center = [center["lat"], center["lng"]] if center else None
+    if north_east["lng"] - south_west["lng"] >= 360:
+        return zoom, None, center
+
+    # Leaflet keeps counting longitudes past +-180 when the map is panned around the world
+    west = (south_west["lng"] + 180) % 360 - 180
+    east = (north_east["lng"] + 180) % 360 - 180
+    south = max(-90.0, south_west["lat"])
+    north = min(90.0, north_east["lat"])
+    return zoom, (south, west, north, east), center
+
+
+def cluster_label(cluster):
+    name = cluster.get("detected_landmark_name") or "Unknown"
+    if cluster["count"] == 1:
+        return name
+    return f"{cluster['count']} photos, e.g. {name}"